@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+
+"""
+Measure the time taken by "import toolbox2" and by the first lookup of an
+action, each in a fresh interpreter, as paid by short-lived processes.
+"""
+
+import os
+import sys
+import time
+import optparse
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+SCENARIOS = [
+    ("python", "pass"),
+    ("import toolbox2", "import toolbox2"),
+    (
+        "get_class(avinfo)",
+        "import toolbox2; toolbox2.Loader().get_class('avinfo_extract')",
+    ),
+    (
+        "get_class(transcode)",
+        "import toolbox2; toolbox2.Loader().get_class('transcode')",
+    ),
+]
+
+
+def bench(code, count):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "p50": timings[len(timings) // 2] * 1000,
+        "min": timings[0] * 1000,
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--count", type="int", default=20, help="runs per scenario")
+    opts, _ = parser.parse_args()
+
+    for name, code in SCENARIOS:
+        result = bench(code, opts.count)
+        print("%-22s min=%7.2f ms  p50=%7.2f ms" % (name, result["min"], result["p50"]))
+
+
+if __name__ == "__main__":
+    main()
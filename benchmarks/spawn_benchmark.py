@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+"""
+Measure process spawn latency of the toolbox2 Command spawn methods.
+
+The parent process can be grown to emulate a large application embedding
+toolbox2, since the cost of forking depends on the size of the parent.
+"""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import optparse
+import subprocess
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from toolbox2.command import Command, COMMAND_SPAWN_METHODS
+
+MEMORY_LIMIT = 4 * 1024 * 1024 * 1024
+
+
+def set_memory_limit():
+    resource.setrlimit(resource.RLIMIT_AS, (MEMORY_LIMIT, MEMORY_LIMIT))
+
+
+def spawn_preexec_fn(base_dir, args):
+    """Spawn like toolbox2 <= 1.0.1 did when a memory limit was set"""
+    process = subprocess.Popen(
+        args,
+        cwd=base_dir,
+        close_fds=True,
+        preexec_fn=set_memory_limit,
+        restore_signals=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    process.communicate()
+
+
+def spawn_command(spawn_method):
+    def spawn(base_dir, args):
+        command = Command(base_dir)
+        command.spawn_method = spawn_method
+        command.memory_limit = MEMORY_LIMIT
+        command.run(args)
+        command.wait()
+
+    return spawn
+
+
+def bench(spawn, base_dir, count, jobs):
+    latencies = []
+    lock = threading.Lock()
+
+    def run(n):
+        for _ in range(n):
+            start = time.perf_counter()
+            spawn(base_dir, ["true"])
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+
+    threads = [threading.Thread(target=run, args=(count // jobs,)) for _ in range(jobs)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rate": len(latencies) / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--count", type="int", default=500, help="spawns per method")
+    parser.add_option("--jobs", type="int", default=4, help="concurrent spawners")
+    parser.add_option(
+        "--parent-size", type="int", default=1024, help="parent heap size in MiB"
+    )
+    opts, _ = parser.parse_args()
+
+    # Touch every page so that they have to be mapped in a forked child
+    ballast = bytearray(opts.parent_size * 1024 * 1024)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    base_dir = tempfile.mkdtemp()
+    methods = [("popen+preexec_fn", spawn_preexec_fn)]
+    methods += [(method, spawn_command(method)) for method in COMMAND_SPAWN_METHODS]
+
+    print(
+        "parent=%d MiB, count=%d, jobs=%d" % (opts.parent_size, opts.count, opts.jobs)
+    )
+    for name, spawn in methods:
+        result = bench(spawn, base_dir, opts.count, opts.jobs)
+        print(
+            "%-18s %8.1f spawns/s  p50=%6.2f ms  p95=%6.2f ms"
+            % (name, result["rate"], result["p50"], result["p95"])
+        )
+    os.rmdir(base_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,7 @@ setup(
     url="https://github.com/SmartJog/python-toolbox2/",
     version=toolbox2.__version__,
     packages=find_packages(exclude=("tests", "tests.*")),
-    scripts=["bin/toolbox2", "bin/toolbox2-transcode"],
+    scripts=["bin/toolbox2", "bin/toolbox2d", "bin/toolbox2-transcode"],
     data_files=data_files,
     test_suite="tests",
     cmdclass={"build": MyBuild},
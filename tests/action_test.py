@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.action module"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from toolbox2.action import Action, ActionException
+from toolbox2.worker import Worker
+
+
+class ShellAction(Action):
+    """Run shell scripts given in the "scripts" parameter, one worker each"""
+
+    name = "test_shell"
+    category = "test"
+
+    def _setup(self):
+        workers = []
+        for script in self.params.get("scripts", []):
+            worker = self._new_worker(Worker, {"-c": script})
+            worker.tool = "sh"
+            workers.append(worker)
+        for index, depends in self.params.get("dependencies", {}).items():
+            workers[index].dependencies = [workers[i] for i in depends]
+        if self.params.get("pipeline"):
+            self.add_pipeline(*workers)
+        else:
+            self.workers.extend(workers)
+
+    def _finalize(self):
+        pass
+
+
+class ActionTestCase(unittest.TestCase):
+    """Test the Action class"""
+
+    def setUp(self):
+        self.log = logging.getLogger("toolbox2_test")
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def _action(self, *scripts, **params):
+        params["scripts"] = scripts
+        return ShellAction(self.log, self.base_dir, None, params)
+
+    def test_run(self):
+        """Test Action.run
+
+        Workers run in sequence.
+        """
+        action = self._action("echo one", "echo two")
+        action.run()
+        self.assertEqual(action.progress, 100)
+        self.assertEqual([w.stdout for w in action.workers], ["one\n", "two\n"])
+
+    def test_run_error(self):
+        """Test Action.run
+
+        A failing worker raises an ActionException.
+        """
+        action = self._action("echo broken >&2; exit 1")
+        self.assertRaises(ActionException, action.run)
+
+    def test_pipeline(self):
+        """Test Action.add_pipeline
+
+        Workers of a pipeline run concurrently, through a named pipe.
+        """
+        os.mkfifo(os.path.join(self.base_dir, "fifo"))
+        for run in [lambda a: a.run(), lambda a: asyncio.run(a.run_async())]:
+            action = self._action("seq 3 > fifo", "wc -l < fifo", pipeline=1)
+            run(action)
+            self.assertEqual(action.progress, 100)
+            self.assertEqual(action.workers[1].stdout.strip(), "3")
+
+    def test_pipeline_error(self):
+        """Test Action.add_pipeline
+
+        When a worker fails, the others are killed instead of blocking.
+        """
+        os.mkfifo(os.path.join(self.base_dir, "fifo"))
+        for run in [lambda a: a.run(), lambda a: asyncio.run(a.run_async())]:
+            action = self._action("echo broken >&2; exit 1", "cat fifo", pipeline=1)
+            start = time.time()
+            with self.assertRaises(ActionException) as context:
+                run(action)
+            self.assertEqual(str(context.exception), "broken")
+            self.assertLess(time.time() - start, 5)
+
+    def test_pipeline_cancel(self):
+        """Test Action.cancel
+
+        Every worker of a running pipeline is killed.
+        """
+        action = self._action("sleep 10", "sleep 10", pipeline=1)
+        threading.Timer(0.2, action.cancel).start()
+        start = time.time()
+        action.run()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual([w.returncode for w in action.workers], [-9, -9])
+
+    def test_parallel_workers(self):
+        """Test the max_parallel_workers param
+
+        Independent workers run concurrently, dependent ones wait.
+        """
+        dependencies = {1: [], 2: [0, 1]}
+        scripts = ["sleep 0.5; date +%s.%N", "sleep 0.5", "date +%s.%N"]
+        for run in [lambda a: a.run(), lambda a: asyncio.run(a.run_async())]:
+            action = self._action(
+                *scripts, dependencies=dependencies, max_parallel_workers=2
+            )
+            start = time.time()
+            run(action)
+            self.assertLess(time.time() - start, 0.9)
+            first, last = [float(w.stdout) for w in action.workers[0::2]]
+            self.assertLessEqual(first, last)
+            self.assertEqual(action.progress, 100)
+
+    def test_parallel_workers_limit(self):
+        """Test the max_parallel_workers param
+
+        Workers run in sequence by default, and invalid limits are rejected.
+        """
+        action = self._action("sleep 0.3", "sleep 0.3", dependencies={1: []})
+        start = time.time()
+        action.run()
+        self.assertGreaterEqual(time.time() - start, 0.6)
+        self.assertRaises(ActionException, self._action, max_parallel_workers=0)
+
+    def test_usage(self):
+        """Test the usage metadata
+
+        Resource usage is reported per worker and in total.
+        """
+        action = self._action("echo one", "head -c 100000 /dev/zero > out")
+        action.run()
+        usage = action.get_metadata()["usage"]
+        self.assertEqual([w["tool"] for w in usage["workers"]], ["sh", "sh"])
+        self.assertGreaterEqual(usage["total"]["wchar"], 100004)
+        self.assertEqual(
+            usage["total"]["utime"], sum(w["utime"] for w in usage["workers"])
+        )
+
+    def test_scheduling(self):
+        """Test the scheduling params
+
+        Workers are started with the requested nice level and CPU affinity.
+        """
+        action = self._action(
+            "sleep 0.1; nice; grep Cpus_allowed_list /proc/$$/status",
+            nice=5,
+            cpu_affinity="0",
+            ionice_class="idle",
+        )
+        action.run()
+        self.assertEqual(
+            action.workers[0].stdout.split(), ["5", "Cpus_allowed_list:", "0"]
+        )
+
+    def test_scheduling_invalid(self):
+        """Test the scheduling params
+
+        Invalid values are rejected when the action is created.
+        """
+        self.assertRaises(ActionException, self._action, "true", nice="high")
+        self.assertRaises(ActionException, self._action, "true", ionice_class="x")
+
+    def test_cancel(self):
+        """Test Action.cancel
+
+        The running worker is killed without waiting for a polling timeout.
+        """
+        action = self._action("sleep 10", "echo never")
+        action.callback_interval = 10
+        threading.Timer(0.2, action.cancel).start()
+        start = time.time()
+        action.run()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(action.workers[1].command, None)
+
+    def test_pause(self):
+        """Test Action.pause
+
+        Workers started while the action is paused wait for resume().
+        """
+        action = self._action("sleep 0.2; echo one", "echo two", process_group=1)
+        threading.Timer(0.1, action.pause).start()
+        threading.Timer(1, action.resume).start()
+        start = time.time()
+        action.run()
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertFalse(action.paused)
+        self.assertEqual([w.stdout for w in action.workers], ["one\n", "two\n"])
+
+    def test_pause_before_run(self):
+        """Test Action.pause
+
+        No worker is started until a paused action is resumed.
+        """
+        for run in [lambda a: a.run(), lambda a: asyncio.run(a.run_async())]:
+            action = self._action("echo one", "echo two")
+            action.pause()
+            thread = threading.Thread(target=run, args=(action,))
+            thread.start()
+            time.sleep(0.3)
+            self.assertTrue(thread.is_alive())
+            self.assertTrue(all(w.command is None for w in action.workers))
+            action.resume()
+            thread.join()
+            self.assertEqual([w.stdout for w in action.workers], ["one\n", "two\n"])
+
+    def test_pause_between_stages(self):
+        """Test Action.pause
+
+        The next worker is not started while the action is paused.
+        """
+
+        def callback(action):
+            if action.workers[0].progress == 100 and not action.paused:
+                action.pause()
+
+        for run in [
+            lambda a: a.run(callback),
+            lambda a: asyncio.run(a.run_async(callback)),
+        ]:
+            action = self._action("echo one", "echo two")
+            action.callback_interval = 0
+            thread = threading.Thread(target=run, args=(action,))
+            thread.start()
+            while not action.paused:
+                time.sleep(0.05)
+            time.sleep(0.3)
+            self.assertTrue(thread.is_alive())
+            self.assertIsNone(action.workers[1].command)
+            action.resume()
+            thread.join()
+            self.assertEqual(action.workers[1].stdout, "two\n")
+
+    def test_run_async(self):
+        """Test Action.run_async
+
+        Workers run on the event loop and coroutine callbacks are awaited.
+        """
+        action = self._action("echo one", "echo two")
+        progress = []
+
+        async def callback(action):
+            progress.append(action.progress)
+
+        asyncio.run(action.run_async(callback))
+        self.assertEqual(progress[-1], 100)
+        self.assertEqual([w.stdout for w in action.workers], ["one\n", "two\n"])
+
+    def test_run_async_error(self):
+        """Test Action.run_async
+
+        A failing worker raises an ActionException.
+        """
+        action = self._action("echo broken >&2; exit 1")
+        with self.assertRaises(ActionException) as context:
+            asyncio.run(action.run_async())
+        self.assertEqual(str(context.exception), "broken")
+
+    def test_run_async_cancel(self):
+        """Test Action.cancel
+
+        A coroutine action is cancelled without waiting for its interval.
+        """
+        action = self._action("sleep 10")
+        action.callback_interval = 10
+
+        async def run():
+            asyncio.get_running_loop().call_later(0.2, action.cancel)
+            await action.run_async()
+
+        start = time.time()
+        asyncio.run(run())
+        self.assertLess(time.time() - start, 5)
+
+    def test_run_async_task_cancel(self):
+        """Test Action.run_async
+
+        Cancelling the task kills the workers, even those run by an
+        overridden _execute in an executor thread.
+        """
+
+        class ExecuteAction(ShellAction):
+            def _execute(self, callback=None):
+                Action._execute(self, callback)
+
+        for action_class in [ShellAction, ExecuteAction]:
+            action = action_class(
+                self.log, self.base_dir, None, {"scripts": ["sleep 3"]}
+            )
+
+            async def run():
+                task = asyncio.ensure_future(action.run_async())
+                await asyncio.sleep(0.3)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+            start = time.time()
+            asyncio.run(run())
+            self.assertLess(time.time() - start, 2)
+
+    def test_run_async_concurrent(self):
+        """Test Action.run_async
+
+        Many actions share a single event loop.
+        """
+        actions = [self._action("sleep 0.2; echo %d" % i) for i in range(10)]
+
+        async def run_all():
+            await asyncio.gather(*[action.run_async() for action in actions])
+
+        asyncio.run(run_all())
+        for index, action in enumerate(actions):
+            self.assertEqual(action.workers[0].stdout, "%d\n" % index)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
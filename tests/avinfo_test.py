@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.action.extract.avinfo_extract module"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+from fractions import Fraction
+
+from toolbox2.action.extract.avinfo_extract import (
+    AVInfo,
+    AVInfoActionException,
+    CompactAVInfo,
+    estimate_frame_count,
+    get_resource_avinfo,
+)
+
+
+class AVInfoTestCase(unittest.TestCase):
+    """Test the AVInfo payloads"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.media = os.path.join(self.tmp_dir, "media.mxf")
+        with open(self.media, "w") as fp:
+            fp.write("media")
+        self.avinfo = AVInfo(
+            {
+                "format": {"duration": "10.0"},
+                "streams": [{"codec_type": "audio", "codec_name": "pcm_s16le"}],
+                "usage": {},
+            }
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_payload(self):
+        """Test AVInfo.to_payload and AVInfo.from_payload
+
+        Payloads survive a JSON round trip, and are used without probing.
+        """
+        payload = json.dumps(self.avinfo.to_payload(self.media))
+        avinfo = AVInfo.from_payload(payload, self.media)
+        self.assertEqual(avinfo.format, {"duration": "10.0"})
+        self.assertEqual(len(avinfo.audio_streams), 1)
+        self.assertNotIn("usage", avinfo.data)
+
+        resource = {"path": self.media, "avinfo": payload}
+        avinfo = get_resource_avinfo(logging, self.tmp_dir, None, resource)
+        self.assertEqual(avinfo.format, {"duration": "10.0"})
+
+    def test_payload_changed(self):
+        """Test AVInfo.from_payload
+
+        Payloads of modified files or invalid payloads are rejected.
+        """
+        payload = self.avinfo.to_payload(self.media)
+        with open(self.media, "a") as fp:
+            fp.write("more media")
+        for invalid in [payload, "{}", "not json"]:
+            self.assertRaises(
+                AVInfoActionException, AVInfo.from_payload, invalid, self.media
+            )
+
+    def test_estimate_frame_count(self):
+        """Test estimate_frame_count
+
+        The most reliable metadata is used, inconsistent ones are rejected.
+        """
+
+        def estimate(stream, duration="N/A"):
+            stream.update({"codec_type": "video", "r_frame_rate": "25/1"})
+            stream.update({"width": 720, "height": 576, "pix_fmt": "yuv422p"})
+            avinfo = AVInfo({"format": {"duration": duration}, "streams": [stream]})
+            count = estimate_frame_count(avinfo)
+            return count and (count["count"], count["method"], count["confidence"])
+
+        self.assertEqual(
+            estimate({"nb_frames": "250", "duration": "10.0"}),
+            (250, "nb_frames", "high"),
+        )
+        self.assertEqual(estimate({"nb_frames": "250"}), (250, "nb_frames", "medium"))
+        self.assertEqual(
+            estimate({"duration": "10.0"}), (250, "stream_duration", "medium")
+        )
+        self.assertEqual(estimate({}, "10.04"), (251, "format_duration", "low"))
+        self.assertIsNone(estimate({"nb_frames": "250", "duration": "20.0"}))
+        self.assertIsNone(estimate({"nb_frames": "N/A"}))
+
+    def test_compact(self):
+        """Test AVInfo.compact
+
+        Compact AVInfos keep the main properties and survive a round trip
+        through their binary serialization.
+        """
+        stream = {"codec_type": "video", "codec_name": "mpeg2video"}
+        stream.update({"r_frame_rate": "30000/1001", "width": 720, "height": 608})
+        stream.update({"pix_fmt": "yuv422p", "display_aspect_ratio": "4:3"})
+        self.avinfo.data["streams"].append(stream)
+        compact = AVInfo(self.avinfo.data).compact()
+        self.assertEqual(compact.video_res, "720x608")
+        self.assertEqual(compact.resolution, (720, 608))
+        self.assertEqual(compact.video_fps, 29.97)
+        self.assertEqual(compact.fps, Fraction(30000, 1001))
+        self.assertEqual(compact.dar, Fraction(4, 3))
+        self.assertEqual(compact.audio_format, "s16le")
+        self.assertTrue(compact.video_is_SD_PAL())
+        self.assertTrue(compact.video_has_VBI())
+        self.assertFalse(hasattr(compact, "__dict__"))
+
+        data = compact.to_bytes()
+        self.assertLess(len(data), 100)
+        self.assertEqual(CompactAVInfo.from_bytes(data), compact)
+        self.assertRaises(AVInfoActionException, CompactAVInfo.from_bytes, data[:8])
+
+    def test_compact_partial(self):
+        """Test CompactAVInfo.to_bytes
+
+        Missing fields get defaults and long strings are cut between two
+        characters, so that any compact AVInfo survives a round trip.
+        """
+        compact = CompactAVInfo(timecode="é" * 200)
+        self.assertEqual(compact.frame_count, -1)
+        copy = CompactAVInfo.from_bytes(compact.to_bytes())
+        self.assertEqual(copy.width, 0)
+        self.assertEqual(copy.video_codec, "")
+        self.assertEqual(copy.timecode, "é" * 127)
+        self.assertIsNone(copy.fps)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.batch module"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+from toolbox2.batch import BatchException, read_jobs, run_batch
+
+# Registers the test_shell action
+from tests.action_test import ShellAction
+
+
+class BatchTestCase(unittest.TestCase):
+    """Test the batch runs"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jobs_path = os.path.join(self.tmp_dir, "jobs.jsonl")
+        self.report_path = os.path.join(self.tmp_dir, "report.jsonl")
+        self.log = logging.getLogger("toolbox2_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_jobs(self, *scripts):
+        with open(self.jobs_path, "w") as fp:
+            for script in scripts:
+                job = {"action": ShellAction.name, "params": {"scripts": [script]}}
+                fp.write(json.dumps(job) + "\n")
+
+    def _read_report(self):
+        with open(self.report_path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_read_jobs(self):
+        """Test read_jobs
+
+        Jobs are read from JSONL files or directories of JSON files.
+        """
+        self._write_jobs("true", "false")
+        self.assertEqual([_id for _id, _ in read_jobs(self.jobs_path)], ["1", "2"])
+
+        jobs_dir = os.path.join(self.tmp_dir, "jobs")
+        os.mkdir(jobs_dir)
+        for name, job in [("b", {"action": "x"}), ("a", {"action": "x", "id": 7})]:
+            with open(os.path.join(jobs_dir, "%s.json" % name), "w") as fp:
+                json.dump(job, fp)
+        self.assertEqual([_id for _id, _ in read_jobs(jobs_dir)], ["7", "b"])
+
+        with open(self.jobs_path, "a") as fp:
+            fp.write("not json\n")
+        self.assertRaises(BatchException, list, read_jobs(self.jobs_path))
+
+    def test_run_batch(self):
+        """Test run_batch
+
+        Every job is reported, a resumed batch only runs again failed jobs.
+        """
+        self._write_jobs("true", "false", "true")
+        counts = run_batch(read_jobs(self.jobs_path), self.report_path, self.log, 2)
+        self.assertEqual(counts, {"done": 2, "error": 1, "skipped": 0})
+        reports = sorted(self._read_report(), key=lambda report: report["id"])
+        self.assertEqual(
+            [report["status"] for report in reports], ["done", "error", "done"]
+        )
+        self.assertIn("usage", reports[0]["metadata"])
+        self.assertGreaterEqual(reports[0]["duration"], 0)
+
+        counts = run_batch(read_jobs(self.jobs_path), self.report_path, self.log, 2)
+        self.assertEqual(counts, {"done": 0, "error": 1, "skipped": 2})
+        self.assertEqual(len(self._read_report()), 4)
+
+    def test_run_batch_ids(self):
+        """Test run_batch ids
+
+        Duplicate job ids are rejected, every job runs in its own directory.
+        """
+        jobs = [("a", {"action": "x"}), ("b", {"action": "x"}), ("a", {})]
+        self.assertRaises(
+            BatchException, run_batch, jobs, self.report_path, self.log, 2, None
+        )
+        self.assertFalse(os.path.exists(self.report_path))
+
+        job_ids = []
+
+        def runner(settings, _id=None):
+            job_ids.append(_id)
+            return {"outputs": [], "metadata": {}}
+
+        run_batch(jobs[:2], self.report_path, self.log, 2, runner)
+        self.assertEqual(len(set(job_ids)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
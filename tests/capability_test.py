@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.capability module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from toolbox2.capability import (
+    CapabilityException,
+    clear_capability_indexes,
+    get_capability_index,
+)
+
+FAKE_TOOL = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+case "$1" in
+-h) printf -- '-y  overwrite output files\\n  -d10_channelcount <int> E...A\\n' ;;
+-codecs) printf -- 'Codecs:\\n D..... = Decoding supported\\n -------\\n DEV.L. mpeg2video   MPEG-2\\n' ;;
+-encoders) printf -- 'Encoders:\\n ------\\n A..... aac   AAC\\n' ;;
+-filters) printf -- 'Filters:\\n  T.. = Timeline support\\n TSC thumbnail  V->V  Select\\n' ;;
+-formats) printf -- 'File formats:\\n --\\n DE matroska,webm   Matroska\\n' ;;
+-version) printf -- 'fake version 1.0\\n' ;;
+esac
+"""
+
+
+class CapabilityTestCase(unittest.TestCase):
+    """Test the capability index"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tool = os.path.join(self.tmp_dir, "ffmpeg")
+        self.calls = os.path.join(self.tmp_dir, "calls")
+        self._write_tool(FAKE_TOOL)
+        os.environ["TOOLBOX2_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        clear_capability_indexes()
+
+    def tearDown(self):
+        del os.environ["TOOLBOX2_CACHE_DIR"]
+        clear_capability_indexes()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_tool(self, content):
+        with open(self.tool, "w") as fp:
+            fp.write(content)
+        os.chmod(self.tool, 0o755)
+
+    def _count_calls(self):
+        with open(self.calls) as fp:
+            return len(fp.readlines())
+
+    def test_index(self):
+        """Test get_capability_index
+
+        Options, codecs, encoders, filters and formats are indexed.
+        """
+        index = get_capability_index(self.tool)
+        self.assertTrue(index.has_option("d10_channelcount"))
+        self.assertFalse(index.has_option("channelcount"))
+        self.assertTrue(index.has_option("channel.*E", regex=True))
+        self.assertTrue(index.has_codec("mpeg2video"))
+        self.assertTrue(index.has_encoder("aac"))
+        self.assertTrue(index.has_filter("thumbnail"))
+        self.assertTrue(index.has_format("webm"))
+        self.assertFalse(index.has_format("="))
+        self.assertEqual(index.version, "fake version 1.0")
+
+    def test_index_cache(self):
+        """Test get_capability_index
+
+        The tool only runs once, other processes load the persisted index,
+        which is rebuilt when the tool changes.
+        """
+        get_capability_index(self.tool)
+        calls = self._count_calls()
+        self.assertIs(get_capability_index(self.tool), get_capability_index(self.tool))
+
+        clear_capability_indexes()
+        self.assertTrue(get_capability_index(self.tool).has_codec("mpeg2video"))
+        self.assertEqual(self._count_calls(), calls)
+
+        self._write_tool(FAKE_TOOL.replace("mpeg2video", "mpeg1video"))
+        self.assertTrue(get_capability_index(self.tool).has_codec("mpeg1video"))
+        self.assertEqual(self._count_calls(), 2 * calls)
+
+    def test_index_error(self):
+        """Test get_capability_index
+
+        A failing tool raises an exception and its index is not persisted.
+        """
+        self._write_tool(FAKE_TOOL.replace("esac", "esac\n[ $1 = -filters ] && exit 1"))
+        self.assertRaises(CapabilityException, get_capability_index, self.tool)
+        cache_dir = os.environ["TOOLBOX2_CACHE_DIR"]
+        self.assertEqual([files for _, _, files in os.walk(cache_dir) if files], [])
+
+        self._write_tool(FAKE_TOOL)
+        self.assertTrue(get_capability_index(self.tool).has_filter("thumbnail"))
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.command module"""
+
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from toolbox2.command import (
+    AsyncCommand,
+    Command,
+    CommandException,
+    CommandSupervisor,
+    RingBuffer,
+    _waitstatus_to_exitcode,
+)
+from toolbox2.worker import Worker
+
+
+class CommandTestCase(unittest.TestCase):
+    """Test the Command and CommandSupervisor classes"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def _run(self, script):
+        command = Command(self.base_dir)
+        command.run(["sh", "-c", script])
+        return command
+
+    def test_wait_output(self):
+        """Test Command.wait
+
+        Output is passed to the callback and the exit code is returned.
+        """
+        output = []
+        command = self._run("echo out; echo err >&2; exit 3")
+        ret = command.wait(lambda stdout, stderr: output.append((stdout, stderr)))
+        self.assertEqual(ret, 3)
+        self.assertEqual("".join(o[0] for o in output), "out\n")
+        self.assertEqual("".join(o[1] for o in output), "err\n")
+
+    def test_spawn_methods(self):
+        """Test Command.run
+
+        Every spawn method runs in base_dir and applies the memory limit.
+        """
+        for spawn_method in ["popen", "posix_spawn"]:
+            output = []
+            command = Command(self.base_dir)
+            command.spawn_method = spawn_method
+            command.memory_limit = 1024 * 1024 * 1024
+            command.run(["sh", "-c", "sleep 0.1; pwd; ulimit -v; exit 2"])
+            ret = command.wait(lambda stdout, stderr: output.append(stdout))
+            self.assertEqual(ret, 2)
+            self.assertEqual("".join(output), "%s\n1048576\n" % self.base_dir)
+
+    def test_pause(self):
+        """Test Command.pause
+
+        The whole process group is stopped and is not killed on timeout.
+        """
+        for spawn_method in ["popen", "posix_spawn"]:
+            output = []
+            command = Command(self.base_dir)
+            command.spawn_method = spawn_method
+            command.process_group = True
+            command.set_timeout(0.05)
+            command.kill_timeout = 0.5
+            start = time.time()
+            command.run(["sh", "-c", "(sleep 0.2; echo child) & wait"])
+            command.pause()
+            self.assertTrue(command.paused)
+            threading.Timer(1, command.resume).start()
+            ret = command.wait(lambda stdout, stderr: output.append(stdout))
+            self.assertEqual(ret, 0)
+            self.assertFalse(command.timed_out)
+            self.assertEqual("".join(output), "child\n")
+            self.assertGreaterEqual(time.time() - start, 1)
+
+    def test_exit_codes(self):
+        """Test Command.poll
+
+        Processes killed by a signal get a negative exit code.
+        """
+        self.assertEqual(_waitstatus_to_exitcode(3 << 8), 3)
+        self.assertEqual(_waitstatus_to_exitcode(signal.SIGKILL), -signal.SIGKILL)
+        for spawn_method in ["popen", "posix_spawn"]:
+            command = Command(self.base_dir)
+            command.spawn_method = spawn_method
+            command.memory_limit = 1024 * 1024 * 1024
+            command.run(["sleep", "10"])
+            command.cancel()
+            self.assertEqual(command.wait(), -signal.SIGKILL)
+
+    def test_scheduling(self):
+        """Test Command.run
+
+        Scheduling settings are applied before the tool is executed, limits
+        which cannot be applied prevent it from running.
+        """
+        for spawn_method in ["popen", "posix_spawn"]:
+            output = []
+            command = Command(self.base_dir)
+            command.spawn_method = spawn_method
+            command.nice = 5
+            command.cpu_affinity = [0]
+            command.run(["sh", "-c", "nice; grep Cpus_allowed_list /proc/self/status"])
+            command.wait(lambda stdout, stderr: output.append(stdout))
+            self.assertEqual("".join(output).split(), ["5", "Cpus_allowed_list:", "0"])
+
+            command = Command(self.base_dir)
+            command.spawn_method = spawn_method
+            command.cpu_affinity = [65535]
+            self.assertRaises(CommandException, command.run, ["touch", "ran"])
+            if spawn_method == "posix_spawn":
+                self.assertIsNotNone(command.process.returncode)
+                self.assertTrue(command.process.stdout.closed)
+            self.assertFalse(os.path.exists(os.path.join(self.base_dir, "ran")))
+
+    def test_scheduling_async(self):
+        """Test AsyncCommand.run
+
+        Scheduling settings are applied before the tool is executed, limits
+        which cannot be applied prevent it from running.
+        """
+        output = []
+
+        async def run(command, script):
+            await command.run(["sh", "-c", script])
+            return await command.wait(lambda stdout, stderr: output.append(stdout))
+
+        command = AsyncCommand(self.base_dir)
+        command.nice = 5
+        command.memory_limit = 1024 * 1024 * 1024
+        script = "nice; ulimit -v"
+        self.assertEqual(asyncio.run(run(command, script)), 0)
+        self.assertEqual("".join(output).split(), ["5", "1048576"])
+
+        command = AsyncCommand(self.base_dir)
+        command.cpu_affinity = [65535]
+        with self.assertRaises(CommandException):
+            asyncio.run(run(command, "touch ran"))
+        self.assertFalse(os.path.exists(os.path.join(self.base_dir, "ran")))
+
+    def test_wait_exit_latency(self):
+        """Test Command.wait
+
+        The exit of a silent process is noticed before the timeout.
+        """
+        command = self._run("exec >&- 2>&-; sleep 0.1")
+        command.set_timeout(10)
+        start = time.time()
+        self.assertEqual(command.wait(), 0)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wait_wakeup(self):
+        """Test Command.wakeup
+
+        A pending wait returns before the timeout.
+        """
+        command = self._run("sleep 10")
+        command.set_timeout(10)
+        threading.Timer(0.1, command.wakeup).start()
+        start = time.time()
+        self.assertIsNone(command.wait(loop=False))
+        self.assertLess(time.time() - start, 5)
+        command.cancel()
+        self.assertEqual(command.wait(), -9)
+
+    def test_wait_split_multibyte(self):
+        """Test Command.wait
+
+        Multi-byte characters split across reads are decoded properly.
+        """
+        output = []
+        command = Command(self.base_dir)
+        command.set_read_size(1)
+        command.run(["sh", "-c", "printf '\\303'; sleep 0.1; printf '\\251\\n'"])
+        command.wait(lambda stdout, stderr: output.append(stdout))
+        self.assertEqual("".join(output), "\u00e9\n")
+
+    def test_wait_usage(self):
+        """Test Command.usage
+
+        Resource usage and I/O counters are collected when the process is reaped.
+        """
+        command = self._run("head -c 1000000 /dev/zero > out")
+        self.assertEqual(command.wait(), 0)
+        self.assertGreater(command.usage["max_rss"], 0)
+        self.assertGreaterEqual(command.usage["utime"], 0)
+        self.assertGreaterEqual(command.usage["wchar"], 1000000)
+        self.assertGreater(command.usage["wall_time"], 0)
+
+    def test_ring_buffer(self):
+        """Test the RingBuffer class
+
+        Only the last bytes are kept, whatever the size of the writes.
+        """
+        ring = RingBuffer(8)
+        ring.write("abc")
+        self.assertEqual(ring.getvalue(), "abc")
+        ring.write("defghi")
+        self.assertEqual(ring.getvalue(), "bcdefghi")
+        ring.write("j")
+        self.assertEqual(ring.getvalue(), "cdefghij")
+        ring.write("0123456789")
+        self.assertEqual(ring.getvalue(), "23456789")
+
+    def test_worker_bounded_output(self):
+        """Test the Worker class
+
+        Without keep_stderr, stderr is not retained but errors are reported.
+        """
+        worker = Worker(
+            logging.getLogger("toolbox2_test"),
+            {"-c": "seq 100000 >&2; echo failure >&2; exit 1"},
+        )
+        worker.tool = "sh"
+        worker.keep_stderr = False
+        worker.run(self.base_dir)
+        self.assertEqual(worker.command.wait(worker._handle_output), 1)
+        self.assertEqual(worker.stderr, "")
+        self.assertEqual(worker.get_error(), "failure")
+
+    def test_supervisor_many_commands(self):
+        """Test CommandSupervisor.run
+
+        Several commands are driven from a single thread.
+        """
+        supervisor = CommandSupervisor(timeout=0.1)
+        outputs = {}
+        returncodes = {}
+
+        for index in range(5):
+            command = self._run("sleep 0.%d; echo %d; exit %d" % (index, index, index))
+
+            def callback(stdout, stderr, index=index):
+                outputs[index] = outputs.get(index, "") + stdout
+
+            def exit_callback(returncode, index=index):
+                returncodes[index] = returncode
+
+            supervisor.register(command, callback, exit_callback)
+
+        supervisor.run()
+        supervisor.close()
+
+        self.assertEqual(len(supervisor), 0)
+        for index in range(5):
+            self.assertEqual(outputs[index], "%d\n" % index)
+            self.assertEqual(returncodes[index], index)
+
+    def test_supervisor_idle_callback(self):
+        """Test CommandSupervisor.poll
+
+        Silent commands get empty idle callbacks.
+        """
+        supervisor = CommandSupervisor(timeout=0.05)
+        calls = []
+        supervisor.register(
+            self._run("sleep 0.3"), lambda stdout, stderr: calls.append(stdout)
+        )
+        supervisor.run()
+        self.assertIn("", calls)
+
+    def test_supervisor_worker(self):
+        """Test Worker.supervise
+
+        The worker gets its output and exit code through the supervisor.
+        """
+        worker = Worker(logging.getLogger("toolbox2_test"), {"-c": "echo done"})
+        worker.tool = "sh"
+        worker.run(self.base_dir)
+
+        done = []
+        supervisor = CommandSupervisor()
+        worker.supervise(supervisor, done.append)
+        supervisor.run()
+
+        self.assertEqual(done, [worker])
+        self.assertEqual(worker.returncode, 0)
+        self.assertEqual(worker.stdout, "done\n")
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
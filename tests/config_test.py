@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.config module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from toolbox2.config import get_config
+
+CONFIG = """[tools]
+ffmpeg=%s
+ffprobe=ffprobe-missing
+
+[scheduling]
+nice=%d
+"""
+
+
+class ConfigTestCase(unittest.TestCase):
+    """Test the process-wide configuration"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "toolbox2.conf")
+        self.tool = os.path.join(self.tmp_dir, "ffmpeg-custom")
+        with open(self.tool, "w") as fp:
+            fp.write("#!/bin/sh\n")
+        os.chmod(self.tool, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_config(self, tool, nice):
+        with open(self.path, "w") as fp:
+            fp.write(CONFIG % (tool, nice))
+
+    def test_reload(self):
+        """Test get_config
+
+        The file is only parsed again when it changes.
+        """
+        config = get_config(self.path)
+        self.assertIsNone(config.get("scheduling", "nice"))
+
+        self._write_config("ffmpeg", 10)
+        config = get_config(self.path)
+        self.assertEqual(config.get("scheduling", "nice"), "10")
+        parser = config.parser
+        self.assertIs(get_config(self.path).parser, parser)
+
+        self._write_config("ffmpeg", 5)
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(get_config(self.path).get("scheduling", "nice"), "5")
+
+    def test_get_tool(self):
+        """Test Config.get_tool
+
+        Tools are resolved to absolute paths using PATH, once.
+        """
+        self._write_config("ffmpeg-custom", 0)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.tmp_dir, path)
+        try:
+            config = get_config(self.path)
+            self.assertEqual(config.get_tool("ffmpeg"), self.tool)
+            self.assertEqual(config.get_tool("ffprobe"), "ffprobe-missing")
+            self.assertIsNone(config.get_tool("kt-toolbox"))
+            config.parser.get = config.parser.items = None
+            self.assertEqual(config.get_tool("ffmpeg"), self.tool)
+        finally:
+            os.environ["PATH"] = path
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
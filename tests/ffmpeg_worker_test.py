@@ -4,10 +4,12 @@
 """Test file for the FFmpeg worker"""
 
 import os
+import stat
 import logging
+import tempfile
 import unittest
 
-from toolbox2.worker.ffmpeg import FFmpegWorker
+from toolbox2.worker.ffmpeg import FFmpegWorker, FFmpegWorkerException
 from toolbox2.action.extract.avinfo_extract import AVInfo
 
 
@@ -48,6 +50,90 @@ class FfmpegWorkerTestCase(unittest.TestCase):
             "The looked-up bitrate is wrong.",
         )
 
+    def test_progress(self):
+        """Test the _handle_output function
+
+        Progress and statistics are read from -progress reports, which may
+        be split anywhere across reads.
+        """
+        self.avinfo.format["duration"] = "10.000000"
+        self.ffw.add_input_file("input.mxf", {}, self.avinfo)
+        self.assertEqual(
+            self.ffw.get_args()[:4], ["-y", "-nostats", "-progress", "pipe:1"]
+        )
+
+        report = (
+            "frame=125\nfps=50.00\nbitrate=2400.1kbits/s\ntotal_size=1500000\n"
+            "out_time_us=5000000\ndup_frames=1\ndrop_frames=2\nspeed=2.5x\n"
+            "progress=continue\n"
+        )
+        self.ffw._handle_output(report[:30], "")
+        self.assertEqual(self.ffw.progress, 0)
+        self.ffw._handle_output(report[30:], "")
+        self.assertEqual(self.ffw.progress, 50)
+        self.assertEqual(self.ffw.frame, 125)
+        self.assertEqual(self.ffw.fps, 50)
+        self.assertEqual(self.ffw.bitrate, 2400.1)
+        self.assertEqual(self.ffw.total_size, 1500000)
+        self.assertEqual(self.ffw.dup_frames, 1)
+        self.assertEqual(self.ffw.drop_frames, 2)
+        self.assertEqual(self.ffw.speed, 2.5)
+        self.assertEqual(self.ffw.timeleft, 2)
+        self.assertEqual(self.ffw.stdout, "")
+
+        self.ffw._handle_output("bitrate=N/A\nout_time_us=N/A\nprogress=end\n", "")
+        self.assertEqual(self.ffw.bitrate, 2400.1)
+        self.assertEqual(self.ffw.progress, 50)
+
+        # ffmpeg < 4.2 only reports out_time_ms, in microseconds, and out_time
+        self.ffw._handle_output("out_time_ms=6000000\nprogress=continue\n", "")
+        self.assertEqual(self.ffw.progress, 60)
+        self.ffw._handle_output("out_time=00:00:07.500000\nprogress=continue\n", "")
+        self.assertEqual(self.ffw.progress, 75)
+
+    def test_make_thumbnails(self):
+        """Test the make_thumbnails function
+
+        Every still seeks its own input and decodes keyframes only, the
+        sprite sheet tiles them, all from one ffmpeg command.
+        """
+        self.ffw.add_input_file("input.mxf", {}, self.avinfo)
+        thumbnails, sprite = self.ffw.make_thumbnails(
+            "/tmp", [0, 12.5, 25], {"width": 160, "sprite": True}
+        )
+        self.assertEqual(len(thumbnails), 3)
+        self.assertEqual(sprite, "/tmp/sprite.jpg")
+
+        args = [str(arg) for arg in self.ffw.get_args()]
+        self.assertEqual(args.count("-i"), 3)
+        self.assertEqual(args.count("nokey"), 3)
+        self.assertEqual(args[args.index("-ss") + 1], "12.500")
+        graph = args[args.index("-filter_complex") + 1]
+        self.assertIn("[1:v:0]trim=end_frame=1", graph)
+        self.assertIn("[s0][s1][s2]concat=n=3:v=1:a=0,tile=3x1[sprite]", graph)
+        self.assertEqual(args[-1], "/tmp/sprite.jpg")
+        self.assertEqual(args[-5:-1], ["-frames:v", "1", "-map", "[sprite]"])
+
+    def test_demux_fifo(self):
+        """Test the demux function
+
+        Outputs are created as named pipes, unless their muxer has to seek.
+        """
+        base_dir = tempfile.mkdtemp()
+        video = {"index": 0, "codec_type": "video", "codec_name": "mpeg2video"}
+        video.update(width=720, height=576, r_frame_rate="25/1", pix_fmt="yuv420p")
+        audio = {"index": 1, "codec_type": "audio", "codec_name": "pcm_s16le"}
+        audio.update(channels=2)
+        self.avinfo = AVInfo({"format": {}, "streams": [video, audio]})
+        self.ffw.add_input_file("input.mxf", {}, self.avinfo)
+        self.ffw.demux(base_dir, fifo=True)
+        self.assertEqual(len(self.ffw.output_files), 2)
+        for output_file in self.ffw.output_files:
+            self.assertTrue(stat.S_ISFIFO(os.stat(output_file.path).st_mode))
+
+        self.ffw.transcode_pcm()
+        self.assertRaises(FFmpegWorkerException, self.ffw.demux, base_dir, fifo=True)
+
 
 if __name__ == "__main__":
     unittest.main()  # run all tests
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+"""Test file for the FFprobe worker"""
+
+import logging
+import unittest
+
+from toolbox2.worker.ffprobe import (
+    FFprobeWorker,
+    ProbeTable,
+    NOPTS_VALUE,
+    PACKET_FLAG_KEY,
+    PACKET_FLAG_DISCARD,
+)
+
+
+class FfprobeWorkerTestCase(unittest.TestCase):
+    """Test functions from the toolbox2.worker.FFprobeWorker class"""
+
+    def test_dump_table(self):
+        """Test FFprobeWorker.dump_table
+
+        Packets are parsed as the output arrives, split anywhere.
+        """
+        worker = FFprobeWorker(logging.getLogger("toolbox2_test"))
+        worker.dump_table("packet")
+        self.assertEqual(worker.params["-print_format"], "compact=p=0:nk=0")
+        self.assertNotIn("-show_streams", worker.params)
+
+        output = (
+            "stream_index=0|pts=0|dts=-1|size=1024|pos=48|flags=K_\n"
+            "stream_index=1|pts=N/A|dts=N/A|size=12|flags=_D\n"
+            "stream_index=0|pts=2|dts=1|size=512|flags=__"
+        )
+        for index in range(0, len(output), 7):
+            worker._handle_output(output[index : index + 7], "")
+        worker._finalize()
+
+        columns = worker.table.columns
+        self.assertEqual(len(worker.table), 3)
+        self.assertEqual(worker.stdout, "")
+        self.assertEqual(list(columns["stream_index"]), [0, 1, 0])
+        self.assertEqual(list(columns["pts"]), [0, NOPTS_VALUE, 2])
+        self.assertEqual(list(columns["dts"]), [-1, NOPTS_VALUE, 1])
+        self.assertEqual(list(columns["size"]), [1024, 12, 512])
+        self.assertEqual(list(columns["pos"]), [48, -1, -1])
+        self.assertEqual(
+            list(columns["flags"]), [PACKET_FLAG_KEY, PACKET_FLAG_DISCARD, 0]
+        )
+
+    def test_frame_table(self):
+        """Test ProbeTable
+
+        Frame entries are stored in the packet columns.
+        """
+        table = ProbeTable("frame")
+        table.feed("stream_index=0|pts=40|pkt_dts=N/A|pkt_size=99|key_frame=1\n")
+        self.assertEqual(table.columns["pts"][0], 40)
+        self.assertEqual(table.columns["dts"][0], NOPTS_VALUE)
+        self.assertEqual(table.columns["size"][0], 99)
+        self.assertEqual(table.columns["flags"][0], PACKET_FLAG_KEY)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.keyframe_index module"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+import toolbox2.probe_cache
+from toolbox2.keyframe_index import get_keyframe_index, write_keyframe_index
+from toolbox2.keyframe_index import KeyframeIndexException
+from toolbox2.action.extract.avinfo_extract import AVInfo, AVInfoAction
+from toolbox2.action.extract.keyframe_extract import KeyframeIndexAction
+
+FAKE_FFPROBE = """#!/bin/sh
+case "$*" in
+*-show_entries*)
+    echo "$@" >> "$(dirname "$0")/calls"
+    for pts in 0 1 2 3 4 5 6 7 8 9; do
+        case $pts in 0|4|8) flags=K_ ;; *) flags=__ ;; esac
+        echo "stream_index=0|pts=$pts|dts=$pts|size=10|pos=$((pts * 10))|flags=$flags"
+    done ;;
+*) echo '%s' ;;
+esac
+""" % json.dumps(
+    {
+        "format": {"duration": "0.4"},
+        "streams": [
+            {
+                "index": 0,
+                "codec_type": "video",
+                "time_base": "1/25",
+                "r_frame_rate": "25/1",
+                "width": 720,
+                "height": 576,
+                "pix_fmt": "yuv422p",
+            }
+        ],
+    }
+)
+
+
+class KeyframeIndexTestCase(unittest.TestCase):
+    """Test the keyframe indexes"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.media = os.path.join(self.tmp_dir, "media.mxf")
+        with open(self.media, "w") as fp:
+            fp.write("media")
+        os.environ["TOOLBOX2_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        # AVInfoAction uses the probe cache of the process
+        toolbox2.probe_cache._probe_cache = None
+
+    def tearDown(self):
+        toolbox2.probe_cache._probe_cache = None
+        del os.environ["TOOLBOX2_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find(self):
+        """Test KeyframeIndex.find
+
+        The nearest keyframe before a time is found, until the file changes.
+        """
+        self.assertIsNone(get_keyframe_index(self.media, 0))
+        keyframes = [(100, 4096, 12), (0, 0, 12), (112, 8192, 3)]
+        write_keyframe_index(self.media, 0, (1, 25), keyframes)
+
+        index = get_keyframe_index(self.media, 0)
+        self.assertEqual(len(index), 3)
+        self.assertIsNone(index.find(-1))
+        self.assertEqual(index.find(0)["pos"], 0)
+        self.assertEqual(index.find(4.2)["pos"], 4096)
+        self.assertEqual(index.find(4.5)["time"], 4.48)
+        self.assertEqual(index.find(3600)["gop_size"], 3)
+        index.close()
+
+        self.assertIsNone(get_keyframe_index(self.media, 1))
+        with open(self.media, "a") as fp:
+            fp.write("more media")
+        self.assertIsNone(get_keyframe_index(self.media, 0))
+
+    def test_find_start_time(self):
+        """Test KeyframeIndex.find
+
+        Positions relative to the start of a file are looked up by pts, as
+        for MPEG-TS files, and invalid time bases are rejected.
+        """
+        keyframes = [(126000, 0, 12), (171000, 4096, 12), (216000, 8192, 12)]
+        write_keyframe_index(self.media, 0, (1, 90000), keyframes)
+        index = get_keyframe_index(self.media, 0)
+        self.assertIsNone(index.find(-0.1, 1.4))
+        self.assertEqual(index.find(0, 1.4)["pos"], 0)
+        self.assertAlmostEqual(index.find(0.6, 1.4)["time"], 0.5)
+        index.close()
+
+        stream = {"index": 0, "codec_type": "video", "time_base": "1/90000"}
+        stream.update(width=720, height=576, r_frame_rate="25/1", pix_fmt="yuv420p")
+        avinfo = AVInfo(
+            {
+                "format": {"duration": "2.0", "start_time": "1.400000"},
+                "streams": [stream],
+            }
+        )
+        action = AVInfoAction(
+            logging.getLogger("toolbox2_test"), self.tmp_dir, None, {"thumbnails": 2}
+        )
+        action.input_file = self.media
+        times = action.get_thumbnail_times(avinfo)
+        self.assertEqual([round(time, 3) for time in times], [0.5, 1.0])
+
+        self.assertRaises(
+            KeyframeIndexException,
+            write_keyframe_index,
+            self.media,
+            0,
+            (0, 1),
+            keyframes,
+        )
+
+    def test_action(self):
+        """Test KeyframeIndexAction
+
+        Keyframes are indexed once, then the index is reused.
+        """
+        with open(os.path.join(self.tmp_dir, "ffprobe"), "w") as fp:
+            fp.write(FAKE_FFPROBE)
+        os.chmod(os.path.join(self.tmp_dir, "ffprobe"), 0o755)
+
+        log = logging.getLogger("toolbox2_test")
+        path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.tmp_dir, path)
+        try:
+            for _ in range(2):
+                action = KeyframeIndexAction(log, self.tmp_dir, "keyframes")
+                action.add_input_resource(1, {"path": self.media})
+                action.run()
+                metadata = action.get_metadata()["keyframe_indexes"]["0"]
+                self.assertEqual(metadata["keyframes"], 3)
+                self.assertEqual(metadata["max_gop_size"], 4)
+        finally:
+            os.environ["PATH"] = path
+
+        with open(os.path.join(self.tmp_dir, "calls")) as fp:
+            self.assertEqual(len(fp.readlines()), 1)
+        index = get_keyframe_index(self.media, 0)
+        self.assertEqual(index.find(0.3)["pos"], 40)
+        self.assertEqual(index.get_gop_sizes(), [4, 4, 2])
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.probe_cache module"""
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+import toolbox2.probe_cache
+from toolbox2.probe_cache import ProbeCache
+from toolbox2.action.extract.avinfo_extract import AVInfoAction
+
+FAKE_FFPROBE = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+echo '%s'
+""" % json.dumps(
+    {
+        "format": {"duration": "10.0"},
+        "streams": [{"codec_type": "audio", "codec_name": "pcm_s16le"}],
+    }
+)
+
+
+class ProbeCacheTestCase(unittest.TestCase):
+    """Test the ProbeCache class"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "probe.sqlite")
+        self.media = os.path.join(self.tmp_dir, "media.mxf")
+        with open(self.media, "w") as fp:
+            fp.write("media")
+        # AVInfoAction uses the probe cache of the process
+        os.environ["TOOLBOX2_CACHE_DIR"] = os.path.join(self.tmp_dir, "cache")
+        toolbox2.probe_cache._probe_cache = None
+
+    def tearDown(self):
+        toolbox2.probe_cache._probe_cache = None
+        del os.environ["TOOLBOX2_CACHE_DIR"]
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_put(self):
+        """Test ProbeCache.get
+
+        Entries are found in memory first, then in the shared database.
+        """
+        cache = ProbeCache(self.db_path)
+        self.assertIsNone(cache.get(self.media))
+        cache.put(self.media, {}, {"format": {}})
+        self.assertEqual(cache.get(self.media), {"format": {}})
+        self.assertIsNone(cache.get(self.media, {"count_packets": True}))
+
+        other = ProbeCache(self.db_path)
+        self.assertEqual(other.get(self.media), {"format": {}})
+        self.assertEqual(other.get(self.media), {"format": {}})
+        self.assertEqual(cache.stats, {"hits": 1, "db_hits": 0, "misses": 2})
+        self.assertEqual(other.stats, {"hits": 1, "db_hits": 1, "misses": 0})
+
+    def test_invalidation(self):
+        """Test ProbeCache.get
+
+        A modified file is not found anymore.
+        """
+        cache = ProbeCache(self.db_path)
+        cache.put(self.media, {}, {"format": {}})
+        with open(self.media, "a") as fp:
+            fp.write("more media")
+        self.assertIsNone(cache.get(self.media))
+        self.assertIsNone(ProbeCache(self.db_path).get(self.media))
+
+    def test_lru(self):
+        """Test ProbeCache.put
+
+        Only the most recently used entries are kept in memory.
+        """
+        cache = ProbeCache(size=2)
+        for index in range(3):
+            cache.put(self.media, {"index": index}, {"index": index})
+        self.assertIsNone(cache.get(self.media, {"index": 0}))
+        self.assertEqual(cache.get(self.media, {"index": 2}), {"index": 2})
+
+    def test_avinfo_action(self):
+        """Test the AVInfoAction probe_cache param
+
+        A file is only probed once.
+        """
+        with open(os.path.join(self.tmp_dir, "ffprobe"), "w") as fp:
+            fp.write(FAKE_FFPROBE)
+        os.chmod(os.path.join(self.tmp_dir, "ffprobe"), 0o755)
+
+        log = logging.getLogger("toolbox2_test")
+        path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.tmp_dir, path)
+        try:
+            for _ in range(2):
+                action = AVInfoAction(log, self.tmp_dir, "probe")
+                action.add_input_resource(1, {"path": self.media})
+                avinfo = action.run()
+                self.assertEqual(avinfo.format["duration"], "10.0")
+        finally:
+            os.environ["PATH"] = path
+
+        with open(os.path.join(self.tmp_dir, "calls")) as fp:
+            self.assertEqual(len(fp.readlines()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.scheduler module"""
+
+import time
+import threading
+import unittest
+
+from toolbox2.scheduler import (
+    ActionScheduler,
+    SchedulerException,
+    get_lane,
+    LANE_LIGHT,
+    LANE_HEAVY,
+)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Test the ActionScheduler class"""
+
+    def setUp(self):
+        self.scheduler = ActionScheduler(light_workers=1, heavy_workers=1)
+        self.order = []
+        self.blocker = threading.Event()
+
+    def tearDown(self):
+        self.blocker.set()
+        self.scheduler.shutdown()
+
+    def _block(self, lane=LANE_HEAVY):
+        """Occupy the only worker of a lane until self.blocker is set"""
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self.blocker.wait()
+
+        future = self.scheduler.submit(block, lane, "blocker")
+        started.wait()
+        return future
+
+    def _job(self, name):
+        def job():
+            time.sleep(0.01)
+            self.order.append(name)
+            return name
+
+        return job
+
+    def test_priority(self):
+        """Test ActionScheduler.submit
+
+        Higher priority classes run first.
+        """
+        self._block()
+        futures = [
+            self.scheduler.submit(self._job(priority), priority=priority)
+            for priority in ["low", "normal", "urgent", "high"]
+        ]
+        self.blocker.set()
+        for future in futures:
+            future.result()
+        self.assertEqual(self.order, ["urgent", "high", "normal", "low"])
+        self.assertRaises(
+            SchedulerException, self.scheduler.submit, self._job("x"), priority="now"
+        )
+
+    def test_lanes(self):
+        """Test get_lane
+
+        Light jobs do not wait behind heavy ones.
+        """
+        self.assertEqual(get_lane({"action": "avinfo_extract"}), LANE_LIGHT)
+        self.assertEqual(get_lane({"action": "transcode"}), LANE_HEAVY)
+        self.assertEqual(
+            get_lane({"action": "transcode", "params": {"single_frame": True}}),
+            LANE_LIGHT,
+        )
+        names = ["count_frames", "count_packets", "estimate_frames", "thumbnail"]
+        for name in names + ["thumbnails", "sprite"]:
+            self.assertEqual(
+                get_lane({"action": "avinfo_extract", "params": {name: True}}),
+                LANE_HEAVY,
+            )
+
+        heavy = self._block()
+        light = self.scheduler.submit(self._job("probe"), LANE_LIGHT)
+        self.assertEqual(light.result(timeout=5), "probe")
+        self.assertFalse(heavy.done())
+        self.assertEqual(self.scheduler.get_stats()[LANE_HEAVY]["running"], 1)
+
+    def test_fair_share(self):
+        """Test ActionScheduler.submit
+
+        Tenants share a lane, whatever the number of jobs they queue.
+        """
+        self._block()
+        futures = [
+            self.scheduler.submit(self._job("a%d" % index), tenant="a")
+            for index in range(3)
+        ]
+        futures.append(self.scheduler.submit(self._job("b0"), tenant="b"))
+        self.blocker.set()
+        for future in futures:
+            future.result()
+        self.assertEqual(self.order, ["a0", "b0", "a1", "a2"])
+
+    def test_shutdown(self):
+        """Test ActionScheduler.shutdown
+
+        Queued jobs are cancelled, running jobs complete.
+        """
+        running = self._block()
+        queued = self.scheduler.submit(self._job("queued"))
+        self.assertTrue(queued.cancel())
+        queued = self.scheduler.submit(self._job("queued"))
+        threading.Timer(0.1, self.blocker.set).start()
+        self.scheduler.shutdown()
+        self.assertTrue(queued.cancelled())
+        self.assertIsNone(running.result())
+        self.assertRaises(SchedulerException, self.scheduler.submit, self._job("x"))
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+"""Test file for the toolbox2.server module"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import unittest
+
+from toolbox2.server import JobServer, ServerException, submit_job
+from toolbox2.server import get_absolute_settings
+
+# Registers the test_shell action
+from tests.action_test import ShellAction
+
+
+class ServerTestCase(unittest.TestCase):
+    """Test the job server"""
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.base_dir, "toolbox2d.sock")
+        log = logging.getLogger("toolbox2_test")
+        self.server = JobServer(self.socket_path, log, self.base_dir, max_jobs=1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.base_dir)
+
+    def _submit(self, *scripts, **kwargs):
+        settings = {"action": ShellAction.name, "params": {"scripts": scripts}}
+        return submit_job(settings, self.socket_path, **kwargs)
+
+    def test_submit(self):
+        """Test submit_job
+
+        The job runs in the server, which streams its events.
+        """
+        events = []
+        result = self._submit("true", callback=events.append)
+        names = [event["event"] for event in events]
+        self.assertEqual(names[:2], ["queued", "started"])
+        self.assertEqual(names[-1], "done")
+        self.assertIn("usage", result["metadata"])
+
+    def test_submit_error(self):
+        """Test submit_job
+
+        Invalid and failing jobs are reported to the client.
+        """
+        self.assertRaises(ServerException, self._submit, "false")
+        self.assertRaises(
+            ServerException, submit_job, {"action": "foobar"}, self.socket_path
+        )
+
+    def test_relative_paths(self):
+        """Test the resource paths
+
+        Clients make them absolute, the server rejects relative ones.
+        """
+        settings = {
+            "action": ShellAction.name,
+            "resources": {"inputs": {"1": {"path": "media.mxf"}}},
+        }
+        resources = get_absolute_settings(settings)["resources"]
+        self.assertEqual(
+            resources["inputs"]["1"]["path"], os.path.join(os.getcwd(), "media.mxf")
+        )
+        self.assertEqual(settings["resources"]["inputs"]["1"]["path"], "media.mxf")
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        with sock, sock.makefile("rwb") as fp:
+            fp.write((json.dumps(settings) + "\n").encode())
+            fp.flush()
+            event = json.loads(fp.readline().decode())
+        self.assertEqual(event["event"], "error")
+        self.assertIn("media.mxf", event["error"])
+
+    def test_disconnect_queued(self):
+        """Test the disconnection of a client
+
+        A queued job is dropped when its client disconnects.
+        """
+        thread = threading.Thread(target=self._submit, args=("sleep 10",))
+        thread.start()
+        while not self.server.actions:
+            time.sleep(0.05)
+
+        path = os.path.join(self.base_dir, "ran")
+        settings = {
+            "action": ShellAction.name,
+            "params": {"scripts": ["touch " + path]},
+        }
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        with sock, sock.makefile("rwb") as fp:
+            fp.write((json.dumps(settings) + "\n").encode())
+            fp.flush()
+            self.assertEqual(json.loads(fp.readline().decode())["event"], "queued")
+        start = time.time()
+        while self.server.queued and time.time() - start < 5:
+            time.sleep(0.05)
+        self.assertEqual(self.server.queued, 0)
+
+        for action in list(self.server.actions):
+            action.cancel()
+        thread.join()
+        self.assertFalse(os.path.exists(path))
+
+    def test_concurrency(self):
+        """Test the max_jobs limit
+
+        Jobs wait in the queue until a slot is free.
+        """
+        threads = [
+            threading.Thread(target=self._submit, args=("sleep 0.3",)) for _ in range(2)
+        ]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.6)
+
+    def test_close(self):
+        """Test JobServer.server_close
+
+        Running jobs are cancelled and waited for, their clients are told.
+        """
+        errors = []
+
+        def submit():
+            try:
+                self._submit("sleep 10")
+            except ServerException as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        while not self.server.actions:
+            time.sleep(0.05)
+        action = list(self.server.actions)[0]
+        while not (action.workers and action.workers[0].is_running):
+            time.sleep(0.05)
+
+        start = time.time()
+        self.server.shutdown()
+        self.server.server_close()
+        thread.join()
+        self.assertLess(time.time() - start, 5)
+        self.assertFalse(self.server.actions)
+        self.assertEqual(action.workers[0].returncode, -9)
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+if __name__ == "__main__":
+    unittest.main()  # run all tests
@@ -3,6 +3,12 @@
 """Test file for the toolbox2 module"""
 
 import os
+import sys
+import shutil
+import pkgutil
+import tempfile
+import importlib
+import subprocess
 import unittest
 
 import toolbox2
@@ -43,6 +49,73 @@ class Toolbox2TestCase(unittest.TestCase):
         path = toolbox2.get_internal_resource("dummy", "foobar")
         assert not os.path.isfile(path), "The returned path should not exist."
 
+    def test_registry(self):
+        """Test the ACTIONS registry
+
+        Every action of the package is declared, as it is defined.
+        """
+        import toolbox2.action
+
+        for module in pkgutil.walk_packages(
+            toolbox2.action.__path__, "toolbox2.action."
+        ):
+            importlib.import_module(module.name)
+        names = set()
+        for cls in toolbox2.find_subclasses(toolbox2.Action):
+            if cls.__module__.startswith("toolbox2.action."):
+                names.add(cls.name)
+        self.assertEqual(names, set(toolbox2.ACTIONS))
+
+        loader = toolbox2.Loader()
+        for name, action in toolbox2.ACTIONS.items():
+            cls = loader.get_class(name)
+            self.assertEqual(cls.name, name)
+            self.assertEqual(cls.__module__, action["module"])
+            self.assertEqual(cls.category, action["category"])
+            self.assertEqual(cls.description, action["description"])
+            self.assertEqual(cls.required_params, action["required_params"])
+        self.assertRaises(toolbox2.LoaderException, loader.get_class, "foobar")
+
+    def test_entry_points(self):
+        """Test the actions of installed packages
+
+        Actions failing to load raise a LoaderException.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        dist_info = os.path.join(tmp_dir, "broken_actions-1.0.dist-info")
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as fp:
+            fp.write("Name: broken_actions\nVersion: 1.0\n")
+        with open(os.path.join(dist_info, "entry_points.txt"), "w") as fp:
+            fp.write("[%s]\n" % toolbox2.ACTIONS_ENTRY_POINT_GROUP)
+            fp.write("broken = broken_actions:BrokenAction\n")
+        sys.path.append(tmp_dir)
+        try:
+            loader = toolbox2.Loader()
+            self.assertRaises(toolbox2.LoaderException, loader.get_class, "broken")
+        finally:
+            sys.path.remove(tmp_dir)
+            shutil.rmtree(tmp_dir)
+
+    def test_import_time(self):
+        """Test the import of the toolbox2 module
+
+        Neither actions nor workers are imported, which keeps short-lived
+        processes fast to start.
+        """
+        code = "import sys, toolbox2; print(' '.join(sys.modules))"
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        ).stdout
+        modules = output.split()
+        self.assertIn("toolbox2", modules)
+        prefixes = ("toolbox2.action", "toolbox2.worker", "toolbox2.command")
+        self.assertEqual([m for m in modules if m.startswith(prefixes)], [])
+        self.assertNotIn("asyncio", modules)
+
 
 if __name__ == "__main__":
     unittest.main()  # run all tests
@@ -1,17 +1,81 @@
 import os
 import sys
+import importlib
 
-from toolbox2.action import Action
 from toolbox2.exception import Toolbox2Exception
 
-from toolbox2.action.extract import *
-from toolbox2.action.rewrap import *
-from toolbox2.action.transcode import *
-from toolbox2.action.getcapability import *
-
 
 __version__ = "1.0.1"
 
+# Actions shipped with toolbox2. Their modules, which pull in the workers,
+# are only imported when Loader.get_class asks for them, keep this table in
+# sync with the class attributes of the actions.
+ACTIONS = {
+    "avinfo_extract": {
+        "module": "toolbox2.action.extract.avinfo_extract",
+        "class_name": "AVInfoAction",
+        "category": "extract",
+        "description": "audio/video information extract tool",
+        "required_params": {},
+    },
+    "keyframe_extract": {
+        "module": "toolbox2.action.extract.keyframe_extract",
+        "class_name": "KeyframeIndexAction",
+        "category": "extract",
+        "description": "keyframe index extract tool",
+        "required_params": {},
+    },
+    "kttoolbox_extract": {
+        "module": "toolbox2.action.extract.kttoolbox_extract",
+        "class_name": "KTToolboxAction",
+        "category": "extract",
+        "description": "kt-toolbox extract tool",
+        "required_params": {},
+    },
+    "getcapability": {
+        "module": "toolbox2.action.getcapability.getcapability",
+        "class_name": "GetCapabilityAction",
+        "category": "getcapability",
+        "description": "get availability of command line options",
+        "required_params": {},
+    },
+    "manzanita_rewrap": {
+        "module": "toolbox2.action.rewrap.manzanita_rewrap",
+        "class_name": "ManzanitaRewrapAction",
+        "category": "rewrap",
+        "description": "Manzanita rewrap tool",
+        "required_params": {},
+    },
+    "transcode": {
+        "module": "toolbox2.action.transcode.transcode",
+        "class_name": "TranscodeAction",
+        "category": "transcode",
+        "description": "transcode to mpeg2 video and mux to various formats",
+        "required_params": {},
+    },
+}
+
+# Third-party packages register their actions as "name = module:Class"
+ACTIONS_ENTRY_POINT_GROUP = "toolbox2.actions"
+
+# Action modules used to be imported by this package, they are still
+# available as attributes, see __getattr__
+_ACTION_MODULES = dict(
+    (action["module"].rpartition(".")[2], action["module"])
+    for action in ACTIONS.values()
+)
+
+
+def __getattr__(name):
+    if name == "Action":
+        from toolbox2.action import Action
+
+        return Action
+    if name in _ACTION_MODULES:
+        return importlib.import_module(_ACTION_MODULES[name])
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 _ROOT = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -52,6 +116,21 @@ class LoaderException(Toolbox2Exception):
     pass
 
 
+def _get_entry_points(group):
+    """
+    Return the entry points of a group, from importlib.metadata (Python 3.8)
+    whose entry_points(group=...) only exists since Python 3.10.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    entry_points = entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=group)
+    return entry_points.get(group, [])
+
+
 class Loader(object):
     _instance = None
 
@@ -63,22 +142,52 @@ class Loader(object):
     def __init__(self):
         if not hasattr(self, "actions"):
             self.actions = {}
-            for cls in find_subclasses(Action):
-                if cls.name in self.actions:
-                    raise LoaderException(
-                        "Identifier %s already used for class: %s" % (cls.name, cls)
-                    )
-
-                self.actions[cls.name] = {
-                    "name": cls.name,
-                    "description": cls.description,
-                    "category": cls.category,
-                    "required_params": cls.required_params,
-                    "class": cls,
-                }
+            for name, action in ACTIONS.items():
+                self.actions[name] = dict(action, name=name)
+
+    def _register(self, cls):
+        action = self.actions.get(cls.name)
+        if action is not None and action.get("class", cls) is not cls:
+            raise LoaderException(
+                "Identifier %s already used for class: %s" % (cls.name, cls)
+            )
+        self.actions[cls.name] = {
+            "name": cls.name,
+            "description": cls.description,
+            "category": cls.category,
+            "required_params": cls.required_params,
+            "module": cls.__module__,
+            "class_name": cls.__name__,
+            "class": cls,
+        }
+        return self.actions[cls.name]
+
+    def _find_action(self, name):
+        """
+        Look for an action which is not shipped with toolbox2: among the
+        entry points of installed packages, then among the Action subclasses
+        already imported.
+        """
+        from toolbox2.action import Action
+
+        for entry_point in _get_entry_points(ACTIONS_ENTRY_POINT_GROUP):
+            if entry_point.name == name:
+                try:
+                    cls = entry_point.load()
+                except Exception as exc:
+                    raise LoaderException("Cannot load action %s: %s" % (name, exc))
+                return self._register(cls)
+
+        for cls in find_subclasses(Action):
+            if cls.name == name:
+                return self._register(cls)
+        return None
 
     def get_class(self, name):
-        try:
-            return self.actions[name]["class"]
-        except KeyError:
+        action = self.actions.get(name) or self._find_action(name)
+        if action is None:
             raise LoaderException("Action %s does not exist" % name)
+        if "class" not in action:
+            module = importlib.import_module(action["module"])
+            action["class"] = getattr(module, action["class_name"])
+        return action["class"]
@@ -1,14 +1,25 @@
 import os
 import time
 import math
+import asyncio
+import inspect
 import shutil
-import configparser
-from configparser import SafeConfigParser
+import threading
 from toolbox2.exception import Toolbox2Exception
+from toolbox2.command import IOPRIO_CLASSES, CommandSupervisor
+from toolbox2.config import TOOLBOX2_CONFIG_FILE, get_config
+from toolbox2.utils import parse_cpu_list
 from toolbox2.worker import WorkerException
 
-
-TOOLBOX2_CONFIG_FILE = "/etc/toolbox2.conf"
+# Scheduling settings applied to every worker, see Action._get_scheduling
+SCHEDULING_PARAMS = [
+    "cpu_affinity",
+    "nice",
+    "ionice_class",
+    "ionice_level",
+    "sched_idle",
+    "process_group",
+]
 
 
 class ActionException(Toolbox2Exception):
@@ -49,6 +60,14 @@ class Action(object):
         self.params = params or {}
 
         self._cancel = False
+        self._paused = False
+        # Set when the action is not paused, or cancelled: new stages wait
+        # for it, see _execute
+        self._unpaused = threading.Event()
+        self._unpaused.set()
+        self._loop = None
+        self._cancel_event = None
+        self._resume_event = None
 
         self.resources = {"inputs": {}, "outputs": {}, "metadata": {}}
 
@@ -63,25 +82,60 @@ class Action(object):
         self.started_at = 0
         self.ended_at = 0
 
-        try:
-            self.conf = None
-            with open(TOOLBOX2_CONFIG_FILE, "r") as fp:
-                self.conf = SafeConfigParser()
-                self.conf.readfp(fp)
-        except (Exception, IOError) as exc:
-            self.log.warning("%s", exc)
+        self.conf = get_config(TOOLBOX2_CONFIG_FILE)
 
         if self.id:
             self.tmp_dir = os.path.join(self.base_dir, "job-%s" % self.id)
         else:
             self.tmp_dir = self.base_dir
         self.debug = self.params.get("debug", False)
+        max_parallel_workers = self.params.get("max_parallel_workers", 1)
+        try:
+            self.max_parallel_workers = int(max_parallel_workers)
+        except ValueError:
+            self.max_parallel_workers = 0
+        if self.max_parallel_workers < 1:
+            raise ActionException(
+                "Invalid max_parallel_workers: %s" % max_parallel_workers
+            )
+        self.scheduling = self._get_scheduling()
         self.last_callback = time.time()
         self.callback_interval = self.params.get("callback_interval", 1)
 
         if not os.path.isdir(self.tmp_dir):
             os.makedirs(self.tmp_dir)
 
+    def _get_scheduling(self):
+        """
+        Return the scheduling settings of the workers: CPU affinity, nice
+        level, I/O priority class and level, SCHED_IDLE policy, and whether
+        they run in their own process group, see pause().
+        Action params take precedence over the [scheduling] section of the
+        configuration file.
+        """
+        scheduling = {}
+        for name in SCHEDULING_PARAMS:
+            value = self.params.get(name)
+            if value is None:
+                value = self.conf.get("scheduling", name)
+            if value is None or value == "":
+                continue
+
+            try:
+                if name == "cpu_affinity":
+                    value = parse_cpu_list(value)
+                elif name in ["nice", "ionice_level"]:
+                    value = int(value)
+                elif name in ["sched_idle", "process_group"]:
+                    value = bool(int(value))
+            except ValueError:
+                raise ActionException("Invalid %s: %s" % (name, value))
+
+            if name == "ionice_class" and value not in IOPRIO_CLASSES:
+                raise ActionException("Invalid ionice_class: %s" % value)
+            scheduling[name] = value
+        return scheduling
+
     def _setup(self):
         """
         Setup all workers you have to execute.
@@ -100,18 +154,151 @@ class Action(object):
         Override this method if you want to control workers' inputs/outputs at
         runtime.
 
+        Workers run in sequence unless they declare their dependencies, up
+        to max_parallel_workers at once. All running workers are killed as
+        soon as one of them fails.
+
         :param callback: user defined callback called every loop interval.
         :type calback: callable(action)
         """
-        for self.worker_idx, _ in enumerate(self.workers):
-            if self._cancel:
-                break  # no need to run other workers
-            self._execute_current_worker(callback)
+        stages = self._get_stages()
+        dependencies = self._get_stage_dependencies(stages)
+        supervisor = CommandSupervisor()
+        running = set()
+        done = set()
+        failed = []
+
+        def exit_callback(worker):
+            if worker.returncode != 0:
+                failed.append(worker)
 
+        try:
+            while not failed and not self._cancel:
+                # No stage is started while the action is paused
+                for stage in self._get_ready_stages(
+                    stages, dependencies, running, done
+                ):
+                    running.add(stage)
+                    self.worker_idx = stages[stage][0]
+                    for index in stages[stage]:
+                        worker = self.workers[index]
+                        worker.run(self.tmp_dir)
+                        worker.supervise(supervisor, exit_callback)
+                if running:
+                    supervisor.poll()
+                elif self._paused and len(done) < len(stages):
+                    self._unpaused.wait(self.callback_interval)
+                else:
+                    break
+
+                for stage in list(running):
+                    workers = [self.workers[index] for index in stages[stage]]
+                    if all(worker.returncode == 0 for worker in workers):
+                        for worker in workers:
+                            worker.progress = 100
+                        running.remove(stage)
+                        done.add(stage)
+
+                self._update_progress()
+                self.running_time = time.time() - self.started_at
+                if (time.time() - self.last_callback) > self.callback_interval:
+                    self.last_callback = time.time()
+                    self._callback(callback)
+        finally:
+            if len(supervisor):
+                self.log.info("Killing the running workers...")
+                for command in list(supervisor.commands):
+                    command.cancel()
+                supervisor.run()
+            supervisor.close()
+
+        # Workers killed on cancel are not errors
+        if failed and not self._cancel:
+            raise WorkerException(failed[0].get_error())
         if not self._cancel:
             self.progress = 100
         self._callback(callback)
 
+    def add_pipeline(self, *workers):
+        """
+        Append workers connected by named pipes to the workers list. They
+        are run concurrently, and all of them are killed as soon as one
+        fails. Readers must read all their pipes sequentially, without
+        seeking, and all of them at once so that a writer interleaving them
+        never blocks.
+        """
+        pipeline = len(self.workers)
+        for worker in workers:
+            worker.pipeline = pipeline
+            self.workers.append(worker)
+
+    def _get_stages(self):
+        """
+        Return the indexes of the workers to run, grouped by stage: each
+        stage is either a single worker or a whole pipeline.
+        """
+        stages = []
+        for index, worker in enumerate(self.workers):
+            previous = self.workers[stages[-1][0]] if stages else None
+            if (
+                previous is not None
+                and worker.pipeline is not None
+                and worker.pipeline == previous.pipeline
+            ):
+                stages[-1].append(index)
+            else:
+                stages.append([index])
+        return stages
+
+    def _get_stage_dependencies(self, stages):
+        """
+        Return the set of stages each stage depends on. Workers without
+        declared dependencies depend on every worker before them.
+        """
+        stage_of = {}
+        for stage, indexes in enumerate(stages):
+            for index in indexes:
+                stage_of[id(self.workers[index])] = stage
+
+        dependencies = []
+        for stage, indexes in enumerate(stages):
+            depends = set()
+            for index in indexes:
+                worker = self.workers[index]
+                if worker.dependencies is None:
+                    depends.update(range(stage))
+                    continue
+                for dependency in worker.dependencies:
+                    if id(dependency) not in stage_of:
+                        raise ActionException(
+                            "Worker %s depends on an unknown worker" % worker.tool
+                        )
+                    depends.add(stage_of[id(dependency)])
+            depends.discard(stage)
+            dependencies.append(depends)
+        return dependencies
+
+    def _get_ready_stages(self, stages, dependencies, running, done):
+        """
+        Return the stages which can be started now, in order, none while
+        the action is paused. A pipeline is started as a whole, even if it
+        exceeds max_parallel_workers when nothing else is running.
+        """
+        ready = []
+        if self._paused:
+            return ready
+        count = sum(len(stages[stage]) for stage in running)
+        for stage, indexes in enumerate(stages):
+            if stage in running or stage in done:
+                continue
+            if not dependencies[stage] <= done:
+                continue
+            if count and count + len(indexes) > self.max_parallel_workers:
+                break
+            ready.append(stage)
+            count += len(indexes)
+        return ready
+
     def _execute_current_worker(self, callback=None):
         """
         Execute current worker designed by worker_idx, update progress,
@@ -145,17 +332,141 @@ class Action(object):
         self._update_progress()
         self._callback(callback)
 
-    def _update_progress(self):
+    async def _execute_async(self, callback=None):
         """
-        Update action progress.
+        Coroutine counterpart of _execute.
 
-        :param worker: current worker being executed
-        :type worker: toolbox2.worker.Worker
+        Actions overriding _execute drive their workers themselves: their
+        _execute is run in the loop's default executor, user callbacks being
+        forwarded to the event loop.
+
+        :param callback: user defined callback called every loop interval.
+        :type calback: callable(action)
         """
-        worker = self.workers[self.worker_idx]
-        self.progress = int(
-            (worker.progress + 100 * self.worker_idx) / len(self.workers)
-        )
+        if type(self)._execute is not Action._execute:
+            loop = asyncio.get_running_loop()
+
+            def threadsafe_callback(action):
+                asyncio.run_coroutine_threadsafe(
+                    self._user_callback_async(callback), loop
+                ).result()
+
+            await self._run_in_executor(self._execute, threadsafe_callback)
+            return
+
+        stages = self._get_stages()
+        dependencies = self._get_stage_dependencies(stages)
+        cancelled = asyncio.ensure_future(self._cancel_event.wait())
+        tasks = {}
+        running = set()
+        done = set()
+        error = None
+
+        try:
+            while error is None and not self._cancel:
+                for stage in self._get_ready_stages(
+                    stages, dependencies, running, done
+                ):
+                    running.add(stage)
+                    self.worker_idx = stages[stage][0]
+                    for index in stages[stage]:
+                        tasks[index] = asyncio.ensure_future(
+                            self.workers[index].run_async(self.tmp_dir)
+                        )
+                pending = [task for task in tasks.values() if not task.done()]
+                if pending:
+                    await asyncio.wait(
+                        pending + [cancelled],
+                        timeout=self.callback_interval,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                elif self._paused and len(done) + len(running) < len(stages):
+                    await self._wait_resumed_async(cancelled)
+                else:
+                    break
+                for task in tasks.values():
+                    if task.done() and task.exception() is not None:
+                        error = task.exception()
+                        break
+                for stage in list(running):
+                    if all(tasks[index].done() for index in stages[stage]):
+                        for index in stages[stage]:
+                            self.workers[index].progress = 100
+                        running.remove(stage)
+                        done.add(stage)
+
+                self._update_progress()
+                self.running_time = time.time() - self.started_at
+                if (time.time() - self.last_callback) > self.callback_interval:
+                    self.last_callback = time.time()
+                    await self._callback_async(callback)
+        finally:
+            cancelled.cancel()
+            for index, task in tasks.items():
+                if not task.done():
+                    await self._cancel_worker_async(self.workers[index], task)
+                elif not task.cancelled():
+                    task.exception()  # only the first error is raised
+
+        if error is not None:
+            raise error
+        if not self._cancel:
+            self.progress = 100
+        await self._callback_async(callback)
+
+    async def _wait_resumed_async(self, cancelled):
+        """
+        Wait for resume() or cancel(), at most callback_interval.
+        """
+        self._resume_event.clear()
+        if not self._paused:
+            return
+        resumed = asyncio.ensure_future(self._resume_event.wait())
+        try:
+            await asyncio.wait(
+                [resumed, cancelled],
+                timeout=self.callback_interval,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            resumed.cancel()
+
+    async def _run_in_executor(self, func, *args):
+        """
+        Run func in the loop's default executor. If the calling task is
+        cancelled, the action is cancelled and func is waited for before
+        CancelledError is raised again, so that no worker outlives the task.
+        """
+        future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+            try:
+                await future
+            except Exception:
+                pass  # the task is cancelled anyway
+            raise
+
+    async def _cancel_worker_async(self, worker, task):
+        """
+        Kill the worker run by task and wait for it to be reaped.
+        """
+        self.log.info("Killing the running worker...")
+        if worker.command is not None and worker.command.process is not None:
+            worker.cancel()
+        else:
+            task.cancel()
+        await asyncio.wait([task])
+        if not task.cancelled():
+            task.exception()  # a killed worker always fails
+
+    def _update_progress(self):
+        """
+        Update action progress from the progress of every worker.
+        """
+        progress = sum(worker.progress for worker in self.workers)
+        self.progress = int(progress / len(self.workers))
 
     def _callback(self, user_callback):
         """
@@ -169,18 +480,40 @@ class Action(object):
         if callable(user_callback):
             user_callback(self)
 
+    async def _callback_async(self, user_callback):
+        """
+        Coroutine counterpart of _callback. user_callback may return an
+        awaitable (e.g. be a coroutine function), in which case it is awaited.
+
+        :param user_callback: user defined callback to execute
+        :type user_callback: callable(action)
+        """
+        # Go through _callback so that overloads keep being honored
+        results = []
+        if callable(user_callback):
+            self._callback(lambda action: results.append(user_callback(action)))
+        for result in results:
+            if inspect.isawaitable(result):
+                await result
+
+    async def _user_callback_async(self, user_callback):
+        if callable(user_callback):
+            result = user_callback(self)
+            if inspect.isawaitable(result):
+                await result
+
     def _new_worker(self, worker_class, *args, **kwargs):
         """
         Return a worker instance of a given class. If configuration specifies
         a custom worker tool path, created instance will use it.
         """
         worker = worker_class(self.log, *args, **kwargs)
-        try:
-            if self.conf:
-                path = self.conf.get("tools", worker.tool)
-                worker.tool = path
-        except (configparser.NoSectionError, configparser.NoOptionError) as exc:
-            self.log.warning("%s", exc)
+        for name, value in list(self.scheduling.items()):
+            setattr(worker, name, value)
+        worker.paused = self._paused
+        path = self.conf.get_tool(worker.tool)
+        if path is not None:
+            worker.tool = path
 
         return worker
 
@@ -342,9 +675,64 @@ class Action(object):
         except OSError:
             self.log.exception("An error occured")
 
+    def _update_usage(self):
+        """
+        Store the resource usage of the workers which have run in the
+        "usage" metadata, per worker and in total. CPU times and I/O
+        counters are summed, the peak memory is the largest of the workers.
+        """
+        workers = []
+        total = {"wall_time": self.ended_at - self.started_at}
+        for worker in self.workers:
+            usage = worker.usage
+            # A worker may be listed more than once
+            if not usage or any(usage is seen["usage"] for seen in workers):
+                continue
+            workers.append({"tool": worker.tool, "usage": usage})
+            for key, value in list(usage.items()):
+                if key == "max_rss":
+                    total[key] = max(total.get(key, 0), value)
+                elif key != "wall_time":
+                    total[key] = total.get(key, 0) + value
+
+        workers = [dict(w["usage"], tool=w["tool"]) for w in workers]
+        self.add_metadata("usage", {"workers": workers, "total": total})
+
     def cancel(self):
-        """Cancel/abort the running action"""
+        """Cancel/abort the running action, may be called from any thread"""
         self._cancel = True
+        self._unpaused.set()
+        # Do not wait for the next polling timeout to notice it
+        for worker in self.workers:
+            worker.wakeup()
+        if self._cancel_event is not None:
+            self._loop.call_soon_threadsafe(self._cancel_event.set)
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def pause(self):
+        """
+        Suspend the running workers with SIGSTOP, may be called from any
+        thread. No other worker is started until resume() is called, and
+        workers started concurrently are stopped right away. Set the
+        process_group param to suspend the processes started by the tools
+        as well. Paused workers are not killed by their kill_timeout.
+        """
+        self._paused = True
+        self._unpaused.clear()
+        for worker in self.workers:
+            worker.pause()
+
+    def resume(self):
+        """Continue the workers suspended by pause(), from any thread"""
+        self._paused = False
+        self._unpaused.set()
+        for worker in self.workers:
+            worker.resume()
+        if self._resume_event is not None:
+            self._loop.call_soon_threadsafe(self._resume_event.set)
 
     def run(self, callback=None):
         """
@@ -366,3 +754,35 @@ class Action(object):
             raise ActionException(exc)
         finally:
             self.ended_at = time.time()
+            self._update_usage()
+
+    async def run_async(self, callback=None):
+        """
+        Coroutine counterpart of run: workers are driven by the running event
+        loop instead of blocking the calling thread. callback may be a
+        coroutine function, it is then awaited every callback_interval.
+
+        _setup is run in the loop's default executor since some actions
+        probe their inputs there.
+
+        :param callback: user defined callable function
+        :type callback: callable(action)
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        self._cancel_event = asyncio.Event()
+        self._resume_event = asyncio.Event()
+        if self._cancel:
+            self._cancel_event.set()
+        self.started_at = time.time()
+
+        try:
+            await self._run_in_executor(self._setup)
+            await self._execute_async(callback)
+            self._finalize()
+        except WorkerException as exc:
+            self.log.exception("An error occurred")
+            raise ActionException(exc)
+        finally:
+            self.ended_at = time.time()
+            self._update_usage()
@@ -1,11 +1,21 @@
 import os
 import os.path
 import re
+import json
+import struct
+import fractions
 
 from toolbox2.action import Action, ActionException
+from toolbox2.keyframe_index import get_keyframe_index
+from toolbox2.probe_cache import get_probe_cache
 from toolbox2.worker.ffprobe import FFprobeWorker
 from toolbox2.worker.ffmpeg import FFmpegWorker
 
+# Difference allowed between the frame count of the index and the one
+# derived from the stream duration: frames or ratio of the frame count
+FRAME_COUNT_MIN_TOLERANCE = 2
+FRAME_COUNT_TOLERANCE = 0.005
+
 
 class AVInfo(object):
 
@@ -33,6 +43,8 @@ class AVInfo(object):
         self.audio_streams = []
         self.data_streams = []
         self.format = data["format"]
+        # Estimated number of video frames, see estimate_frame_count
+        self.frame_count = data.get("frame_count")
 
         for stream in data["streams"]:
             if stream["codec_type"] == "video":
@@ -130,11 +142,301 @@ class AVInfo(object):
             self.timecode,
         )
 
+    def to_payload(self, path):
+        """
+        Return a JSON serializable payload of this AVInfo, tied to the current
+        size and modification time of the probed file. Pass it as the "avinfo"
+        key of an input resource to spare actions a probe of that file.
+
+        :param path: path of the probed file
+        :type path: string
+        """
+        stat = os.stat(path)
+        data = dict(self.data)
+        data.pop("usage", None)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "data": data}
+
+    def compact(self):
+        """
+        Return the CompactAVInfo summary of this AVInfo.
+        """
+        return CompactAVInfo.from_avinfo(self)
+
+    @classmethod
+    def from_payload(cls, payload, path):
+        """
+        Return the AVInfo of a payload built by to_payload, or its JSON
+        serialization. An AVInfoActionException is raised if the payload is
+        invalid or if the file has changed since it was probed.
+
+        :param path: path of the probed file
+        :type path: string
+        """
+        try:
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime_ns) != (
+                payload["size"],
+                payload["mtime_ns"],
+            ):
+                raise AVInfoActionException("%s changed since it was probed" % path)
+            return cls(payload["data"])
+        except (OSError, ValueError, TypeError, KeyError) as exc:
+            raise AVInfoActionException("Invalid AVInfo payload: %s" % exc)
+
 
 class AVInfoActionException(ActionException):
     pass
 
 
+def _parse_ratio(value, separator="/"):
+    """
+    Return the (num, den) integers of a "num/den" string, (0, 0) if invalid.
+    """
+    num, _, den = str(value or "").partition(separator)
+    try:
+        return int(num), int(den)
+    except ValueError:
+        return 0, 0
+
+
+class CompactAVInfo(object):
+    """
+    Memory efficient summary of an AVInfo, for catalogs holding many of
+    them: only the properties of the file and of its first video and audio
+    streams are kept, as plain numbers and short strings. Derived values
+    are computed when accessed.
+
+    to_bytes and from_bytes serialize it to a few dozen bytes, which are
+    decoded without any JSON parsing.
+    """
+
+    __slots__ = [
+        "duration",
+        "width",
+        "height",
+        "fps_num",
+        "fps_den",
+        "dar_num",
+        "dar_den",
+        "nb_video_streams",
+        "nb_audio_streams",
+        "frame_count",
+        "video_codec",
+        "pix_fmt",
+        "audio_format",
+        "timecode",
+    ]
+
+    # Numeric fields, then the length of every string field
+    HEADER = struct.Struct("<dIIIIIIHHq4B")
+    STRING_FIELDS = ["video_codec", "pix_fmt", "audio_format", "timecode"]
+    # Values of missing fields, a frame count of -1 is unknown
+    DEFAULTS = {"duration": 0.0, "frame_count": -1}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            default = "" if name in self.STRING_FIELDS else self.DEFAULTS.get(name, 0)
+            value = fields.get(name)
+            setattr(self, name, default if value is None else value)
+
+    @classmethod
+    def from_avinfo(cls, avinfo):
+        """
+        :type avinfo: toolbox2.action.extract.avinfo_extract.AVInfo
+        """
+        video = avinfo.video_streams[0] if avinfo.video_streams else {}
+        fps_num, fps_den = _parse_ratio(video.get("r_frame_rate"))
+        dar_num, dar_den = _parse_ratio(avinfo.video_dar, ":")
+        frame_count = (avinfo.frame_count or {}).get("count", -1)
+        return cls(
+            duration=_parse_number(avinfo.format.get("duration")) or 0.0,
+            width=int(video.get("width", 0)),
+            height=int(video.get("height", 0)),
+            fps_num=fps_num,
+            fps_den=fps_den,
+            dar_num=dar_num,
+            dar_den=dar_den,
+            nb_video_streams=len(avinfo.video_streams),
+            nb_audio_streams=len(avinfo.audio_streams),
+            frame_count=frame_count,
+            video_codec=video.get("codec_name", ""),
+            pix_fmt=video.get("pix_fmt", ""),
+            audio_format=avinfo.audio_format or "",
+            timecode=avinfo.timecode,
+        )
+
+    def to_bytes(self):
+        # Strings are cut to 255 bytes, without splitting a character
+        strings = [
+            getattr(self, name).encode()[:255].decode("utf-8", "ignore").encode()
+            for name in self.STRING_FIELDS
+        ]
+        header = self.HEADER.pack(
+            self.duration,
+            self.width,
+            self.height,
+            self.fps_num,
+            self.fps_den,
+            self.dar_num,
+            self.dar_den,
+            self.nb_video_streams,
+            self.nb_audio_streams,
+            self.frame_count,
+            *[len(string) for string in strings]
+        )
+        return header + b"".join(strings)
+
+    @classmethod
+    def from_bytes(cls, data):
+        try:
+            values = cls.HEADER.unpack_from(data)
+            fields = dict(zip(cls.__slots__, values[:10]))
+            offset = cls.HEADER.size
+            for name, length in zip(cls.STRING_FIELDS, values[10:]):
+                fields[name] = bytes(data[offset : offset + length]).decode()
+                offset += length
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise AVInfoActionException("Invalid compact AVInfo: %s" % exc)
+        return cls(**fields)
+
+    @property
+    def fps(self):
+        if not self.fps_den:
+            return None
+        return fractions.Fraction(self.fps_num, self.fps_den)
+
+    @property
+    def video_fps(self):
+        fps = self.fps
+        return round(float(fps), 2) if fps else 0
+
+    @property
+    def resolution(self):
+        if not self.nb_video_streams:
+            return None
+        return (self.width, self.height)
+
+    @property
+    def video_res(self):
+        if not self.nb_video_streams:
+            return None
+        return "%sx%s" % (self.width, self.height)
+
+    @property
+    def dar(self):
+        if not self.dar_den:
+            return None
+        return fractions.Fraction(self.dar_num, self.dar_den)
+
+    def video_has_VBI(self):
+        return self.video_res in [AVInfo.RES_SD_PAL_VBI, AVInfo.RES_SD_NTSC_VBI]
+
+    def video_is_SD_PAL(self):
+        return self.video_res in [AVInfo.RES_SD_PAL, AVInfo.RES_SD_PAL_VBI]
+
+    def video_is_SD_NTSC(self):
+        return self.video_res in [AVInfo.RES_SD_NTSC, AVInfo.RES_SD_NTSC_VBI]
+
+    def video_is_HD(self):
+        return self.width * self.height >= 1280 * 1080
+
+    def video_is_SD(self):
+        return not self.video_is_HD()
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactAVInfo):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        return "CompactAVInfo (video_res=%s, timecode=%s)" % (
+            self.video_res,
+            self.timecode,
+        )
+
+
+def _parse_number(value, number_class=float):
+    try:
+        return number_class(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def estimate_frame_count(avinfo):
+    """
+    Estimate the number of frames of the first video stream from container
+    metadata, without reading the file. The frame count of the index (MOV,
+    MXF...) is preferred when the stream duration agrees with it, then the
+    stream duration, then the file duration.
+
+    Return a dict with the frame count, the method used and its confidence
+    (high, medium or low), or None if metadata are missing or inconsistent.
+
+    :param avinfo: probed file
+    :type avinfo: toolbox2.action.extract.avinfo_extract.AVInfo
+    """
+    if not avinfo.video_streams:
+        return None
+    stream = avinfo.video_streams[0]
+    fps = _parse_number(stream.get("r_frame_rate"), fractions.Fraction)
+    if not fps:
+        fps = None
+
+    nb_frames = _parse_number(stream.get("nb_frames"), int)
+    from_duration = None
+    duration = _parse_number(stream.get("duration"))
+    if duration and fps:
+        from_duration = int(round(duration * fps))
+
+    if nb_frames and from_duration:
+        tolerance = max(FRAME_COUNT_MIN_TOLERANCE, FRAME_COUNT_TOLERANCE * nb_frames)
+        if abs(nb_frames - from_duration) > tolerance:
+            return None
+        return {"count": nb_frames, "method": "nb_frames", "confidence": "high"}
+    if nb_frames:
+        return {"count": nb_frames, "method": "nb_frames", "confidence": "medium"}
+    if from_duration:
+        return {
+            "count": from_duration,
+            "method": "stream_duration",
+            "confidence": "medium",
+        }
+
+    duration = _parse_number(avinfo.format.get("duration"))
+    if duration and fps:
+        return {
+            "count": int(round(duration * fps)),
+            "method": "format_duration",
+            "confidence": "low",
+        }
+    return None
+
+
+def get_resource_avinfo(log, base_dir, _id, resource):
+    """
+    Return the AVInfo of a file resource: the one carried by its "avinfo"
+    key when it still matches the file, see AVInfo.to_payload, otherwise
+    the file is probed.
+
+    :param resource: resource with at least a "path" key
+    :type resource: dict
+    """
+    path = resource.get("path")
+    if resource.get("avinfo"):
+        try:
+            return AVInfo.from_payload(resource["avinfo"], path)
+        except AVInfoActionException as exc:
+            log.warning("Probing %s again: %s", path, exc)
+
+    avinfo_action = AVInfoAction(log, base_dir, _id)
+    avinfo_action.add_input_resource(1, {"path": path})
+    return avinfo_action.run()
+
+
 class AVInfoAction(Action):
     """
     Extract audio/video information from media files using ffprobe/ffmpeg.
@@ -152,17 +454,26 @@ class AVInfoAction(Action):
         self.thumbnail = None
         self.probe_worker = None
         self.probe2_worker = None
+        self.count_worker = None
         self.ffmpeg_worker = None
+        self.thumbnails_worker = None
 
         if not os.path.isdir(self.tmp_dir):
             os.makedirs(self.tmp_dir)
 
         self.do_thumbnail = self.params.get("thumbnail", False)
+        # Number of evenly spaced stills, extracted from keyframes
+        self.thumbnails = int(self.params.get("thumbnails", 0))
+        self.do_sprite = self.params.get("sprite", False)
         self.do_count_frames = self.params.get("count_frames", False)
         self.do_count_packets = self.params.get("count_packets", False)
+        self.do_estimate_frames = self.params.get("estimate_frames", False)
+        self.use_probe_cache = self.params.get("probe_cache", True)
 
         self.thumbnail_options = {
             "width": int(self.params.get("thumbnail_width", 0)),
+            "sprite": self.do_sprite,
+            "sprite_columns": int(self.params.get("sprite_columns", 0)),
         }
 
     def _setup(self):
@@ -170,13 +481,27 @@ class AVInfoAction(Action):
         self.thumbnail = os.path.join(self.tmp_dir, "thumbnail.jpg")
 
     def _execute(self, callback=None):
-        self.probe_worker = self._new_worker(FFprobeWorker)
-        self.probe_worker.add_input_file(self.input_file)
-        self.workers.append(self.probe_worker)
-        self.worker_idx = 0
-        self._execute_current_worker(callback)
-        self.update_metadata(self.probe_worker.metadata)
-        avinfo = AVInfo(self.probe_worker.metadata)
+        probe_options = {}
+        if self.do_count_frames:
+            probe_options["count_frames"] = True
+        if self.do_count_packets:
+            probe_options["count_packets"] = True
+        if self.do_estimate_frames:
+            probe_options["estimate_frames"] = True
+        cache = get_probe_cache() if self.use_probe_cache else None
+        metadata = cache.get(self.input_file, probe_options) if cache else None
+
+        if metadata is not None:
+            self.log.debug("Probe cache hit for %s", self.input_file)
+            self.update_metadata(metadata)
+        else:
+            self.probe_worker = self._new_worker(FFprobeWorker)
+            self.probe_worker.add_input_file(self.input_file)
+            self.workers.append(self.probe_worker)
+            self.worker_idx = len(self.workers) - 1
+            self._execute_current_worker(callback)
+            self.update_metadata(self.probe_worker.metadata)
+        avinfo = AVInfo(self.get_metadata())
 
         has_video_streams = len(avinfo.video_streams) > 0
 
@@ -187,12 +512,15 @@ class AVInfoAction(Action):
             self.ffmpeg_worker.make_thumbnail(self.thumbnail_options)
 
             self.workers.append(self.ffmpeg_worker)
-            self.worker_idx = 1
+            self.worker_idx = len(self.workers) - 1
             self._execute_current_worker(callback)
-            self.update_metadata({"thumbnail": self.thumbnail})
-            self.add_output_resource("thumbnail", self.thumbnail)
 
-        if has_video_streams and (self.do_count_frames or self.do_count_packets):
+        if has_video_streams and self.thumbnails > 0:
+            self._make_thumbnails(avinfo, callback)
+
+        if metadata is None and (
+            has_video_streams and (self.do_count_frames or self.do_count_packets)
+        ):
             self.probe2_worker = self._new_worker(FFprobeWorker)
             self.probe2_worker.add_input_file(self.input_file)
             if self.do_count_packets:
@@ -201,17 +529,113 @@ class AVInfoAction(Action):
                 self.probe2_worker.count_frames()
 
             self.workers.append(self.probe2_worker)
-            self.worker_idx = 2
-            self.workers.append(self.probe2_worker)
+            self.worker_idx = len(self.workers) - 1
             self._execute_current_worker(callback)
             self.update_metadata(self.probe2_worker.metadata)
 
+        frame_count = None
+        if metadata is None and has_video_streams and self.do_estimate_frames:
+            frame_count = estimate_frame_count(avinfo)
+            if frame_count is None:
+                frame_count = self._count_video_packets(callback)
+            self.log.info(
+                "%s has %d frames (method=%s, confidence=%s)",
+                self.input_file,
+                frame_count["count"],
+                frame_count["method"],
+                frame_count["confidence"],
+            )
+            self.update_metadata({"frame_count": frame_count})
+
+        if metadata is None and cache:
+            probed = dict(self.probe_worker.metadata)
+            if probe_options:
+                # The plain probe is also worth caching
+                cache.put(self.input_file, {}, probed)
+            if self.probe2_worker:
+                probed.update(self.probe2_worker.metadata)
+            if frame_count:
+                probed["frame_count"] = frame_count
+            cache.put(self.input_file, probe_options, probed)
+
+        if has_video_streams and self.do_thumbnail:
+            self.update_metadata({"thumbnail": self.thumbnail})
+            self.add_output_resource("thumbnail", self.thumbnail)
+
         self.progress = 100
         self._callback(callback)
 
+    def get_thumbnail_times(self, avinfo):
+        """
+        Return the positions of the stills, in the middle of evenly spaced
+        sections of the file. When the keyframes of the file have been
+        indexed, see KeyframeIndexAction, positions are moved to the
+        keyframe actually extracted.
+        """
+        duration = _parse_number(avinfo.format.get("duration")) or 0
+        times = [
+            duration * (index + 0.5) / self.thumbnails
+            for index in range(self.thumbnails)
+        ]
+        stream = avinfo.video_streams[0]
+        index = get_keyframe_index(self.input_file, int(stream.get("index", 0)))
+        if index is not None:
+            # Keyframes are indexed by pts, -ss positions start at 0
+            start_time = _parse_number(avinfo.format.get("start_time"))
+            if start_time is None:
+                start_time = _parse_number(stream.get("start_time")) or 0
+            keyframes = [index.find(position, start_time) for position in times]
+            times = [
+                keyframe["time"] if keyframe else position
+                for keyframe, position in zip(keyframes, times)
+            ]
+            index.close()
+        return times
+
+    def _make_thumbnails(self, avinfo, callback=None):
+        times = self.get_thumbnail_times(avinfo)
+        self.thumbnails_worker = self._new_worker(FFmpegWorker)
+        self.thumbnails_worker.add_input_file(self.input_file, {}, avinfo)
+        thumbnails, sprite = self.thumbnails_worker.make_thumbnails(
+            self.tmp_dir, times, self.thumbnail_options
+        )
+
+        self.workers.append(self.thumbnails_worker)
+        self.worker_idx = len(self.workers) - 1
+        self._execute_current_worker(callback)
+
+        for index, thumbnail in enumerate(thumbnails):
+            self.add_output_resource("thumbnail_%d" % index, {"path": thumbnail})
+        self.update_metadata({"thumbnails": thumbnails, "thumbnail_times": times})
+        if sprite:
+            self.add_output_resource("sprite", {"path": sprite})
+            self.update_metadata({"sprite": sprite})
+
+    def _count_video_packets(self, callback=None):
+        """
+        Count the packets of the first video stream, which requires to
+        demux the whole file.
+        """
+        self.count_worker = self._new_worker(FFprobeWorker)
+        self.count_worker.add_input_file(self.input_file)
+        self.count_worker.select_streams("v:0")
+        self.count_worker.count_packets()
+
+        self.workers.append(self.count_worker)
+        self.worker_idx = len(self.workers) - 1
+        self._execute_current_worker(callback)
+
+        streams = self.count_worker.metadata.get("streams", [])
+        count = int(streams[0].get("nb_read_packets", 0)) if streams else 0
+        return {"count": count, "method": "count_packets", "confidence": "exact"}
+
     def _finalize(self):
         pass
 
     def run(self, callback=None):
         Action.run(self, callback)
         return AVInfo(self.get_metadata())
+
+    async def run_async(self, callback=None):
+        await Action.run_async(self, callback)
+        return AVInfo(self.get_metadata())
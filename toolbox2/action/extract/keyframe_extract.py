@@ -0,0 +1,149 @@
+import os
+import fractions
+
+from toolbox2.action import Action, ActionException
+from toolbox2.action.extract.avinfo_extract import get_resource_avinfo
+from toolbox2.keyframe_index import (
+    get_keyframe_index,
+    write_keyframe_index,
+    KeyframeIndexException,
+)
+from toolbox2.worker.ffprobe import FFprobeWorker, NOPTS_VALUE, PACKET_FLAG_KEY
+
+
+class KeyframeIndexActionException(ActionException):
+    pass
+
+
+def get_keyframes(table):
+    """
+    Return the (pts, pos, gop_size) records of the keyframes of a packet
+    table, gop_size being the number of packets from a keyframe to the next.
+    """
+    columns = table.columns
+    keyframes = []
+    for idx in range(len(table)):
+        if columns["flags"][idx] & PACKET_FLAG_KEY:
+            pts = columns["pts"][idx]
+            if pts == NOPTS_VALUE:
+                pts = columns["dts"][idx]
+            if pts == NOPTS_VALUE:
+                continue
+            keyframes.append([pts, columns["pos"][idx], 0])
+        if keyframes:
+            keyframes[-1][2] += 1
+    return [tuple(keyframe) for keyframe in keyframes]
+
+
+class KeyframeIndexAction(Action):
+    """
+    Index the keyframes of the video streams of a media file using ffprobe,
+    see toolbox2.keyframe_index.
+    """
+
+    name = "keyframe_extract"
+    engine = "ffmpeg"
+    category = "extract"
+    description = "keyframe index extract tool"
+    required_params = {}
+
+    def __init__(self, log, base_dir, _id, params=None, resources=None):
+        Action.__init__(self, log, base_dir, _id, params, resources)
+        self.input_file = None
+        self.avinfo = None
+
+        if not os.path.isdir(self.tmp_dir):
+            os.makedirs(self.tmp_dir)
+
+        # Rebuild indexes even if they are up to date
+        self.force = self.params.get("force", False)
+
+    def _setup(self):
+        resource = self.get_input_resource(1)
+        self.input_file = resource.get("path")
+        if self.input_file is None:
+            raise KeyframeIndexActionException(
+                "No specified path for input (index = 1)"
+            )
+        self.avinfo = get_resource_avinfo(self.log, self.base_dir, self.id, resource)
+
+    def _get_index(self, stream_index):
+        index = get_keyframe_index(self.input_file, stream_index)
+        if index is None:
+            # No cache directory, the index only lives as long as the action
+            index = get_keyframe_index(self.input_file, stream_index, self.tmp_dir)
+        return index
+
+    def _write_index(self, stream_index, time_base, keyframes):
+        try:
+            return write_keyframe_index(
+                self.input_file, stream_index, time_base, keyframes
+            )
+        except (OSError, KeyframeIndexException) as exc:
+            self.log.warning("Keeping the keyframe index in %s: %s", self.tmp_dir, exc)
+        return write_keyframe_index(
+            self.input_file, stream_index, time_base, keyframes, self.tmp_dir
+        )
+
+    def _get_time_base(self, stream):
+        try:
+            time_base = fractions.Fraction(stream.get("time_base", "1/1"))
+        except (ValueError, ZeroDivisionError):
+            time_base = 0
+        if not time_base:
+            raise KeyframeIndexActionException(
+                "Invalid time base of stream %s: %s"
+                % (stream["index"], stream.get("time_base"))
+            )
+        return time_base
+
+    def _execute(self, callback=None):
+        indexes = {}
+        for stream in self.avinfo.video_streams:
+            stream_index = int(stream["index"])
+            index = None if self.force else self._get_index(stream_index)
+            if index is None:
+                worker = self._new_worker(FFprobeWorker)
+                worker.add_input_file(self.input_file)
+                worker.select_streams(str(stream_index))
+                worker.dump_table("packet")
+                self.workers.append(worker)
+                self.worker_idx = len(self.workers) - 1
+                self._execute_current_worker(callback)
+
+                time_base = self._get_time_base(stream)
+                keyframes = get_keyframes(worker.table)
+                path = self._write_index(
+                    stream_index,
+                    (time_base.numerator, time_base.denominator),
+                    keyframes,
+                )
+                index = self._get_index(stream_index)
+                if index is None:
+                    raise KeyframeIndexActionException(
+                        "Keyframe index %s could not be read back" % path
+                    )
+            else:
+                self.log.debug(
+                    "Keyframe index of %s stream %d is up to date",
+                    self.input_file,
+                    stream_index,
+                )
+
+            gop_sizes = index.get_gop_sizes()
+            indexes[str(stream_index)] = {
+                "path": index.path,
+                "keyframes": len(index),
+                "max_gop_size": max(gop_sizes) if gop_sizes else 0,
+            }
+            self.add_output_resource(
+                "keyframes_%d" % stream_index, {"path": index.path}
+            )
+            index.close()
+
+        self.update_metadata({"keyframe_indexes": indexes})
+        self.progress = 100
+        self._callback(callback)
+
+    def _finalize(self):
+        pass
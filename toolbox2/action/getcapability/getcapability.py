@@ -1,6 +1,5 @@
-import re
-
 from toolbox2.action import Action, ActionException
+from toolbox2.capability import get_capability_index, CapabilityException
 from toolbox2.worker.ffprobe import FFprobeWorker
 from toolbox2.worker.ffmpeg import FFmpegWorker
 
@@ -56,21 +55,13 @@ class GetCapabilityAction(Action):
             raise GetCapabilityActionException(
                 "getcapability via help extraction is not supported for %s" % self.tool
             )
-        worker.make_fullhelp()
-
-        self.workers.append(worker)
-        self.worker_idx = 0
-        self._execute_current_worker(callback)
 
-        lines = worker.stdout.split("\n")
-        for line in lines:
-            if self.regex:
-                if re.search(self.option, line):
-                    self.success = True
-            else:
-                availableoption = line.strip().partition(" ")
-                if "-" + self.option == availableoption[0]:
-                    self.success = True
+        # The help is only dumped once per tool binary
+        try:
+            index = get_capability_index(worker.tool)
+        except (CapabilityException, OSError) as exc:
+            raise GetCapabilityActionException(exc)
+        self.success = index.has_option(self.option, self.regex)
         self.add_metadata("available", self.success)
 
         self.progress = 100
@@ -79,3 +70,7 @@ class GetCapabilityAction(Action):
     def run(self, callback=None):
         Action.run(self, callback)
         return self.success
+
+    async def run_async(self, callback=None):
+        await Action.run_async(self, callback)
+        return self.success
@@ -1,7 +1,7 @@
 import os
 
 from toolbox2.action import Action, ActionException
-from toolbox2.action.extract.avinfo_extract import AVInfoAction
+from toolbox2.action.extract.avinfo_extract import get_resource_avinfo
 from toolbox2.worker.manzanita import ManzanitaMuxWorker
 from toolbox2.worker.ffmpeg import FFmpegWorker
 
@@ -58,9 +58,9 @@ class ManzanitaRewrapAction(Action):
         self.output_file = os.path.join(self.tmp_dir, output_filename)
         self.add_output_resource(1, {"path": self.output_file})
 
-        avinfo_action = AVInfoAction(self.log, self.base_dir, self.id)
-        avinfo_action.add_input_resource(1, {"path": self.input_file})
-        avinfo = avinfo_action.run()
+        avinfo = get_resource_avinfo(
+            self.log, self.base_dir, self.id, self.get_input_resource(1)
+        )
 
         # Setup ffmpeg demuxer
         ffmpeg = self._new_worker(FFmpegWorker)
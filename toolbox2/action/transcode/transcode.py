@@ -2,7 +2,7 @@ import os
 import os.path
 
 from toolbox2.action import Action, ActionException
-from toolbox2.action.extract.avinfo_extract import AVInfoAction
+from toolbox2.action.extract.avinfo_extract import get_resource_avinfo
 from toolbox2.worker.bmx import Raw2BmxWorker
 from toolbox2.worker.flvtools2 import FLVTool2Worker
 from toolbox2.worker.ffmpeg import FFmpegWorker
@@ -136,9 +136,9 @@ class TranscodeAction(Action):
         nb_video_frames = int(self.get_input_resource(1).get("nb_video_frames", 0))
         self.input_basename = os.path.splitext(os.path.basename(self.input_file))[0]
 
-        avinfo_action = AVInfoAction(self.log, self.base_dir, self.id)
-        avinfo_action.add_input_resource(1, {"path": self.input_file})
-        avinfo = avinfo_action.run()
+        avinfo = get_resource_avinfo(
+            self.log, self.base_dir, self.id, self.get_input_resource(1)
+        )
 
         ffmpeg = self._new_worker(FFmpegWorker)
         ffmpeg.add_input_file(self.input_file, {}, avinfo)
@@ -204,6 +204,7 @@ class TranscodeAction(Action):
                         hinting_worker = self._new_worker(FLVTool2Worker)
                         hinting_worker.params = {"-U": ""}
                         hinting_worker.add_input_file(output_file.path)
+                        hinting_worker.dependencies = [ffmpeg]
                         self.workers.append(hinting_worker)
                         self.add_output_resource(index + 1, {"path": output_file.path})
 
@@ -214,6 +215,7 @@ class TranscodeAction(Action):
                         hinting_worker = self._new_worker(QtFastStartWorker)
                         hinting_worker.add_input_file(output_file.path)
                         hinting_worker.add_output_file(hinting_output_path)
+                        hinting_worker.dependencies = [ffmpeg]
                         self.workers.append(hinting_worker)
                         self.add_output_resource(
                             index + 1, {"path": hinting_output_path}
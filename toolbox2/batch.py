@@ -0,0 +1,141 @@
+"""
+Run many job descriptions, see toolbox2.job, read from a JSONL file or from
+a directory of JSON files.
+
+The report of every job is appended to a JSONL file as soon as it is over,
+with its id, status, outputs, metadata, timings and error. A batch which was
+interrupted resumes from its report: jobs reported as done are skipped.
+Job ids must be unique within a batch.
+"""
+
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+from toolbox2.job import run_job
+from toolbox2.exception import Toolbox2Exception
+
+BATCH_STATUS_DONE = "done"
+BATCH_STATUS_ERROR = "error"
+
+
+class BatchException(Toolbox2Exception):
+    pass
+
+
+def read_jobs(path):
+    """
+    Yield the (id, settings) of the jobs of a JSONL file, or of the JSON
+    files of a directory. Jobs are identified by their "id" key, otherwise
+    by their line number or file name.
+
+    :param path: JSONL file or directory path
+    :type path: string
+    """
+    try:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".json"):
+                    with open(os.path.join(path, name)) as fp:
+                        settings = json.load(fp)
+                    yield str(settings.get("id", name[: -len(".json")])), settings
+        else:
+            with open(path) as fp:
+                for lineno, line in enumerate(fp, 1):
+                    if line.strip():
+                        settings = json.loads(line)
+                        yield str(settings.get("id", lineno)), settings
+    except (OSError, ValueError) as exc:
+        raise BatchException("Cannot read the jobs of %s: %s" % (path, exc))
+
+
+def read_done_jobs(report_path):
+    """
+    Return the ids of the jobs reported as done in a batch report.
+    """
+    done = set()
+    if not os.path.exists(report_path):
+        return done
+    with open(report_path) as fp:
+        for line in fp:
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue  # interrupted while writing the report
+            if report.get("status") == BATCH_STATUS_DONE:
+                done.add(report["id"])
+    return done
+
+
+def run_batch(
+    jobs, report_path, log, max_jobs=1, runner=None, callback=None, resume=True
+):
+    """
+    Run jobs, max_jobs at once, and append their reports to report_path.
+    Return the number of jobs done, failed and skipped. BatchException is
+    raised, before any job runs, if two jobs have the same id.
+
+    :param jobs: (id, settings) of the jobs, see read_jobs
+    :type jobs: iterable
+
+    :param runner: callable running a job and returning its result, see
+                   toolbox2.job.run_job, which is used by default. _id is
+                   unique to every job of every batch, to name its directory.
+    :type runner: callable(settings, _id=string)
+
+    :param callback: called with every report
+    :type callback: callable(dict)
+
+    :param resume: skip the jobs already reported as done
+    :type resume: bool
+    """
+    if runner is None:
+
+        def runner(settings, _id=None):
+            return run_job(settings, log, _id=_id)
+
+    jobs = list(jobs)
+    ids = set()
+    for _id, _ in jobs:
+        if _id in ids:
+            raise BatchException("Duplicate job id: %s" % _id)
+        ids.add(_id)
+
+    batch_id = str(time.time())
+    done = read_done_jobs(report_path) if resume else set()
+    counts = {BATCH_STATUS_DONE: 0, BATCH_STATUS_ERROR: 0, "skipped": 0}
+    lock = threading.Lock()
+
+    def run(index, _id, settings):
+        report = {"id": _id, "action": settings.get("action")}
+        started_at = time.time()
+        try:
+            result = runner(settings, _id="%s-%d" % (batch_id, index))
+            report.update(status=BATCH_STATUS_DONE)
+            report.update(outputs=result["outputs"], metadata=result["metadata"])
+        except Exception as exc:
+            log.warning("Job %s failed: %s", _id, exc)
+            report.update(status=BATCH_STATUS_ERROR, error=str(exc))
+        report.update(started_at=started_at, ended_at=time.time())
+        report["duration"] = report["ended_at"] - started_at
+
+        with lock:
+            fp.write(json.dumps(report, default=str) + "\n")
+            fp.flush()
+            counts[report["status"]] += 1
+            if callable(callback):
+                callback(report)
+
+    with open(report_path, "a") as fp:
+        with concurrent.futures.ThreadPoolExecutor(max_jobs) as executor:
+            futures = []
+            for index, (_id, settings) in enumerate(jobs):
+                if _id in done:
+                    counts["skipped"] += 1
+                    continue
+                futures.append(executor.submit(run, index, _id, settings))
+            for future in futures:
+                future.result()
+    return counts
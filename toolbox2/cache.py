@@ -0,0 +1,54 @@
+import os
+
+# Shared by all the processes of the host, when writable
+TOOLBOX2_CACHE_DIR = "/var/cache/toolbox2"
+
+
+def get_cache_dir(name):
+    """
+    Return the directory storing the cache name, creating it if needed, or
+    None when no cache directory is writable.
+
+    The TOOLBOX2_CACHE_DIR environment variable takes precedence, then
+    /var/cache/toolbox2 which is shared by all the users of the host, then
+    the cache directory of the current user.
+
+    :param name: cache name, used as a sub-directory
+    :type name: string
+    """
+    if os.environ.get("TOOLBOX2_CACHE_DIR"):
+        candidates = [os.environ["TOOLBOX2_CACHE_DIR"]]
+    else:
+        user_cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        candidates = [TOOLBOX2_CACHE_DIR, os.path.join(user_cache_dir, "toolbox2")]
+
+    for base_dir in candidates:
+        path = os.path.join(base_dir, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(path, os.W_OK):
+            return path
+    return None
+
+
+def write_cache_file(path, content):
+    """
+    Atomically replace a cache file, so that concurrent readers never see
+    it partially written.
+
+    :param content: file content
+    :type content: bytes
+    """
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as fp:
+            fp.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -0,0 +1,224 @@
+"""
+Index of the capabilities of the ffmpeg and ffprobe binaries.
+
+Dumping and scanning the help of a tool is slow, so it is only done once per
+tool binary, identified by its resolved path, modification time and size.
+Indexes are kept in memory and persisted in the cache directory, where the
+other processes of the host find them.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from toolbox2.cache import get_cache_dir, write_cache_file
+from toolbox2.command import Command, CommandException
+from toolbox2.exception import Toolbox2Exception
+
+# Bump when the format of persisted indexes changes
+CAPABILITY_INDEX_VERSION = 1
+
+CAPABILITY_SECTIONS = {
+    "help": ["-h", "full"],
+    "codecs": ["-codecs"],
+    "encoders": ["-encoders"],
+    "filters": ["-filters"],
+    "formats": ["-formats"],
+    "version": ["-version"],
+}
+
+# Sections listing one codec, encoder, filter or format per line, such as
+# " DEV.L. mpeg2video   MPEG-2 video" or " DE matroska,webm   Matroska"
+CAPABILITY_LIST_SECTIONS = ["codecs", "encoders", "filters", "formats"]
+CAPABILITY_LIST_ENTRY = re.compile(r"^\s*[A-Z.|]+\s+(\S+)\s")
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+# One lock per tool binary, held while its index is loaded or built
+_build_locks = {}
+
+
+class CapabilityException(Toolbox2Exception):
+    pass
+
+
+class CapabilityIndex(object):
+    """
+    Options, codecs, encoders, filters and formats supported by a tool.
+    """
+
+    def __init__(self, key, sections):
+        """
+        :param key: resolved path, modification time and size of the tool
+        :type key: tuple
+
+        :param sections: output lines of the tool, by section name
+        :type sections: dict
+        """
+        self.key = tuple(key)
+        self.sections = sections
+        self.options = set()
+        self.names = {}
+        self._matches = {}
+
+        for line in sections.get("help", []):
+            option = line.strip().partition(" ")[0]
+            if option.startswith("-"):
+                self.options.add(option)
+
+        for section in CAPABILITY_LIST_SECTIONS:
+            names = set()
+            for line in sections.get(section, []):
+                match = CAPABILITY_LIST_ENTRY.match(line)
+                if match and match.group(1) != "=":
+                    names.update(match.group(1).split(","))
+            self.names[section] = names
+
+        version = sections.get("version", [])
+        self.version = version[0] if version else ""
+
+    def has_option(self, option, regex=False):
+        """
+        Return True if option is listed in the full help of the tool. If
+        regex is True, option is a regular expression searched in every
+        line of the help instead.
+        """
+        if not regex:
+            return "-" + option in self.options
+        if option not in self._matches:
+            pattern = re.compile(option)
+            self._matches[option] = any(
+                pattern.search(line) for line in self.sections.get("help", [])
+            )
+        return self._matches[option]
+
+    def has_codec(self, name):
+        return name in self.names["codecs"]
+
+    def has_encoder(self, name):
+        return name in self.names["encoders"]
+
+    def has_filter(self, name):
+        return name in self.names["filters"]
+
+    def has_format(self, name):
+        return name in self.names["formats"]
+
+    def to_dict(self):
+        return {
+            "index_version": CAPABILITY_INDEX_VERSION,
+            "key": list(self.key),
+            "sections": self.sections,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["key"], data["sections"])
+
+
+def _get_tool_key(tool):
+    path = shutil.which(tool)
+    if path is None:
+        raise CapabilityException("Tool not found: %s" % tool)
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _get_index_path(key):
+    cache_dir = get_cache_dir("capabilities")
+    if cache_dir is None:
+        return None
+    name = hashlib.sha1(key[0].encode()).hexdigest()
+    return os.path.join(cache_dir, "%s.json" % name)
+
+
+def _load_index(key):
+    path = _get_index_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, "r") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if data.get("index_version") != CAPABILITY_INDEX_VERSION:
+        return None
+    if tuple(data.get("key", [])) != key:
+        return None  # the tool has been upgraded
+    return CapabilityIndex.from_dict(data)
+
+
+def _save_index(index):
+    path = _get_index_path(index.key)
+    if path is None:
+        return
+    try:
+        write_cache_file(path, json.dumps(index.to_dict()).encode())
+    except OSError:
+        pass  # the index is still available in memory
+
+
+def _build_index(key):
+    """
+    Dump every section of a tool. CapabilityException is raised if one of
+    them fails, partial output must never be indexed.
+    """
+    sections = {}
+    for section, args in CAPABILITY_SECTIONS.items():
+        output = []
+        command = Command(tempfile.gettempdir())
+        command.run([key[0]] + args)
+        try:
+            ret = command.wait(lambda stdout, stderr: output.append(stdout))
+        except CommandException as exc:
+            raise CapabilityException(str(exc))
+        if ret != 0:
+            raise CapabilityException(
+                "%s %s failed with exit code %s" % (key[0], " ".join(args), ret)
+            )
+        sections[section] = "".join(output).splitlines()
+    return CapabilityIndex(key, sections)
+
+
+def get_capability_index(tool):
+    """
+    Return the capability index of a tool, building it if no index of the
+    current binary is available in memory or in the cache directory.
+
+    :param tool: tool name or path, looked up in PATH
+    :type tool: string
+
+    :rtype: toolbox2.capability.CapabilityIndex
+    """
+    key = _get_tool_key(tool)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    # Do not block the lookups of other tools while this one runs
+    with build_lock:
+        with _indexes_lock:
+            index = _indexes.get(key)
+        if index is None:
+            index = _load_index(key)
+            if index is None:
+                index = _build_index(key)
+                _save_index(index)
+            with _indexes_lock:
+                _indexes[key] = index
+    return index
+
+
+def clear_capability_indexes():
+    """
+    Forget the indexes held in memory, persisted ones are kept.
+    """
+    with _indexes_lock:
+        _indexes.clear()
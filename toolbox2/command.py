@@ -1,30 +1,290 @@
 import os
+import asyncio
+import codecs
+import ctypes
 import fcntl
 import resource
 import subprocess
 import select
+import selectors
 import signal
 import errno
+import threading
 import time
 
 COMMAND_DEFAULT_TIMEOUT = 1
 COMMAND_DEFAULT_KILL_TIMEOUT = 3600
 COMMAND_DEFAULT_READ_SIZE = 4096
+COMMAND_DEFAULT_STREAM_LIMIT = 64 * 1024
+COMMAND_DEFAULT_SPAWN_METHOD = "popen"
+COMMAND_SPAWN_METHODS = ["popen", "posix_spawn"]
+COMMAND_USAGE_IO_COUNTERS = ["rchar", "wchar", "read_bytes", "write_bytes"]
+
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# There is no libc wrapper for ioprio_set
+IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+IOPRIO_SET_SYSCALL = IOPRIO_SET_SYSCALLS.get(os.uname().machine)
+
+# Shell wrapping the commands spawned by asyncio with limits, it waits for a
+# line on its standard input before the exec, see AsyncCommand.run
+COMMAND_GATE_SCRIPT = 'read _ && exec "$@"'
 
 
 class CommandException(Exception):
     pass
 
 
+_libc = None
+
+
+def _get_libc():
+    """
+    Return the C library, loaded once.
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def set_io_priority(pid, ioprio_class, level=0):
+    """
+    Set the I/O scheduling class and level of a process, like ionice does.
+
+    :param ioprio_class: realtime, best-effort or idle
+    :type ioprio_class: string
+
+    :param level: priority within the class, from 0 (highest) to 7
+    :type level: int
+    """
+    if ioprio_class not in IOPRIO_CLASSES:
+        raise CommandException("Unknown I/O priority class: %s" % ioprio_class)
+    syscall = IOPRIO_SET_SYSCALL
+    if syscall is None:
+        raise CommandException(
+            "I/O priorities are not supported on %s" % os.uname().machine
+        )
+
+    ioprio = (IOPRIO_CLASSES[ioprio_class] << IOPRIO_CLASS_SHIFT) | level
+    libc = _get_libc()
+    if libc.syscall(syscall, IOPRIO_WHO_PROCESS, pid, ioprio) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _open_pidfd(pid):
+    """
+    Return a file descriptor which becomes readable when the process exits,
+    or None when pidfds are not supported (Python < 3.9 or Linux < 5.3).
+    """
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def _waitstatus_to_exitcode(status):
+    """
+    Return the exit code of a wait status, like subprocess: negative for a
+    process killed by a signal. os.waitstatus_to_exitcode needs Python 3.9.
+    """
+    if hasattr(os, "waitstatus_to_exitcode"):
+        return os.waitstatus_to_exitcode(status)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _read_proc_io(pid):
+    """
+    Return the I/O counters of a process from /proc/<pid>/io, or an empty
+    dict when they are not available. They remain readable until the
+    process is reaped, and include the counters of its reaped children.
+    """
+    counters = {}
+    try:
+        with open("/proc/%d/io" % pid, "r") as fp:
+            for line in fp:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        return {}
+    return counters
+
+
+def get_usage(rusage=None, io_counters=None, wall_time=0):
+    """
+    Return the resource usage of a process as a dict.
+
+    :param rusage: resource usage returned by os.wait4
+    :type rusage: resource.struct_rusage
+
+    :param io_counters: counters read from /proc/<pid>/io
+    :type io_counters: dict
+
+    :param wall_time: time elapsed between spawn and exit, in seconds
+    :type wall_time: float
+    """
+    usage = {"wall_time": wall_time}
+    if rusage is not None:
+        usage["utime"] = rusage.ru_utime
+        usage["stime"] = rusage.ru_stime
+        # Linux reports ru_maxrss in kilobytes
+        usage["max_rss"] = rusage.ru_maxrss * 1024
+        usage["minor_faults"] = rusage.ru_minflt
+        usage["major_faults"] = rusage.ru_majflt
+        usage["voluntary_switches"] = rusage.ru_nvcsw
+        usage["involuntary_switches"] = rusage.ru_nivcsw
+    for key in COMMAND_USAGE_IO_COUNTERS:
+        if io_counters and key in io_counters:
+            usage[key] = io_counters[key]
+    return usage
+
+
+class SpawnedProcess(object):
+    """
+    Minimal subprocess.Popen replacement starting its process with
+    os.posix_spawn, so that the parent process is never forked.
+
+    posix_spawn cannot change the working directory, this is done by a
+    shell which then execs the command. With gate set, the shell waits for
+    open_gate() before the exec, so that limits can be applied to it first.
+    """
+
+    def __init__(self, args, cwd, setsid=False, gate=False):
+        self.args = args
+        self.returncode = None
+        self._gate = None
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        script = 'cd "$0" && exec "$@"'
+        file_actions = [
+            (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+            (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+        ]
+        if gate:
+            gate_r, self._gate = os.pipe()
+            script = 'cd "$0" && read _ <&3 && exec "$@" 3<&-'
+            file_actions.append((os.POSIX_SPAWN_DUP2, gate_r, 3))
+        argv = ["/bin/sh", "-c", script, cwd] + list(args)
+        try:
+            self.pid = os.posix_spawn(
+                "/bin/sh",
+                argv,
+                os.environ,
+                file_actions=file_actions,
+                # Python ignores these, do not let the tool inherit that
+                setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+                setsid=setsid,
+            )
+        except OSError:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            self.close_gate()
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+            if gate:
+                os.close(gate_r)
+
+        self.stdout = os.fdopen(stdout_r, "rb", buffering=0)
+        self.stderr = os.fdopen(stderr_r, "rb", buffering=0)
+
+    def open_gate(self):
+        """
+        Let the shell exec the command.
+        """
+        if self._gate is not None:
+            os.write(self._gate, b"\n")
+            self.close_gate()
+
+    def close_gate(self):
+        """
+        Make the shell exit without running the command, unless the gate
+        was opened.
+        """
+        if self._gate is not None:
+            os.close(self._gate)
+            self._gate = None
+
+    def _waitpid(self, options):
+        try:
+            pid, status = os.waitpid(self.pid, options)
+        except ChildProcessError:
+            # Already reaped by someone else, like Popen does
+            self.returncode = 0
+            return
+        if pid == self.pid:
+            self.returncode = _waitstatus_to_exitcode(status)
+
+    def poll(self):
+        if self.returncode is None:
+            self._waitpid(os.WNOHANG)
+        return self.returncode
+
+    def wait(self):
+        while self.returncode is None:
+            self._waitpid(0)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
 class Command(object):
     def __init__(self, base_dir):
         self.base_dir = base_dir
         self.process = None
         self.memory_limit = 0
+        self.spawn_method = COMMAND_DEFAULT_SPAWN_METHOD
+        self.cpu_affinity = None
+        self.nice = None
+        self.ionice_class = None
+        self.ionice_level = 0
+        self.sched_idle = False
+        # Run the process in its own session and process group, so that
+        # signals reach the processes it starts too
+        self.process_group = False
+        self.paused_at = None
         self.last_read = 0
+        self.started_at = 0
+        self.usage = {}
+        self.timed_out = False
         self.timeout = COMMAND_DEFAULT_TIMEOUT
         self.kill_timeout = COMMAND_DEFAULT_KILL_TIMEOUT
         self.read_size = COMMAND_DEFAULT_READ_SIZE
+        self._buffer = None
+        self._decoders = {}
+        self._eof = set()
+        self._pidfd = None
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._wakeup_lock = threading.Lock()
+        self._pause_lock = threading.Lock()
+
+    @property
+    def paused(self):
+        return self.paused_at is not None
 
     def set_timeout(self, timeout):
         self.timeout = timeout
@@ -32,36 +292,83 @@ class Command(object):
     def set_read_size(self, read_size):
         self.read_size = read_size
 
-    def _set_memory_limit(self):
+    def _has_limits(self):
+        return bool(
+            self.memory_limit > 0
+            or self.cpu_affinity
+            or self.sched_idle
+            or self.nice is not None
+            or self.ionice_class
+        )
+
+    def _set_limits(self, pid):
+        """
+        Apply resource limits and scheduling settings to a process. They are
+        applied from the parent, to the shell wrapping the tool, before it
+        execs it: the tool never runs without them, and all of its threads
+        inherit them. No preexec_fn is used, it is not safe in threaded
+        callers.
+        """
         if self.memory_limit > 0:
-            resource.setrlimit(
-                resource.RLIMIT_AS, (self.memory_limit, self.memory_limit)
+            resource.prlimit(
+                pid, resource.RLIMIT_AS, (self.memory_limit, self.memory_limit)
             )
+        if self.cpu_affinity:
+            os.sched_setaffinity(pid, self.cpu_affinity)
+        if self.sched_idle:
+            os.sched_setscheduler(pid, os.SCHED_IDLE, os.sched_param(0))
+        if self.nice is not None:
+            os.setpriority(os.PRIO_PROCESS, pid, self.nice)
+        if self.ionice_class:
+            set_io_priority(pid, self.ionice_class, self.ionice_level)
+
+    def _get_limits_error(self, pid, exc):
+        return CommandException(
+            "Could not apply limits to process (pid = %s): %s" % (pid, exc)
+        )
 
-    def _preexec_fn(self):
-        self._set_memory_limit()
+    def _spawn(self, args):
+        """
+        Start the process with posix_spawn. The shell wrapping the command
+        gets the limits before it execs the command, see SpawnedProcess.
+        """
+        gate = self._has_limits()
+        self.process = SpawnedProcess(args, self.base_dir, self.process_group, gate)
+        if not gate:
+            return
+        try:
+            self._set_limits(self.process.pid)
+        except (OSError, ValueError, CommandException) as exc:
+            self.process.close_gate()
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process.stderr.close()
+            raise self._get_limits_error(self.process.pid, exc)
+        self.process.open_gate()
 
     def run(self, args):
         if not os.path.isdir(self.base_dir):
             os.makedirs(self.base_dir)
 
-        # Only use a preexec_fn when required
-        # Note that since Python3.8 this is no longer supported in subinterpreters
-        preexec_fn = None
-        if self.memory_limit > 0:
-            preexec_fn = self._set_memory_limit
-
-        self.last_read = time.time()
-        self.process = subprocess.Popen(
-            args,
-            cwd=self.base_dir,
-            bufsize=-1,
-            close_fds=True,
-            preexec_fn=preexec_fn,
-            restore_signals=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        if self.spawn_method not in COMMAND_SPAWN_METHODS:
+            raise CommandException("Unknown spawn method: %s" % self.spawn_method)
+        self.last_read = self.started_at = time.time()
+        # Limits are applied through the gate of the posix_spawn wrapper
+        if self.spawn_method == "posix_spawn" or self._has_limits():
+            self._spawn(args)
+        else:
+            self.process = subprocess.Popen(
+                args,
+                cwd=self.base_dir,
+                bufsize=0,
+                close_fds=True,
+                restore_signals=True,
+                start_new_session=self.process_group,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        self._apply_pause()
 
         fl = fcntl.fcntl(self.process.stdout, fcntl.F_GETFL)
         fcntl.fcntl(self.process.stdout, fcntl.F_SETFL, fl | os.O_NONBLOCK)
@@ -69,33 +376,184 @@ class Command(object):
         fl = fcntl.fcntl(self.process.stderr, fcntl.F_GETFL)
         fcntl.fcntl(self.process.stderr, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
+        # Every read goes into this preallocated buffer
+        self._buffer = memoryview(bytearray(self.read_size))
+        self._init_decoders([self.process.stdout, self.process.stderr])
+
+        # Let wait() return as soon as the process exits or wakeup() is called
+        self._pidfd = _open_pidfd(self.process.pid)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+    def _init_decoders(self, files):
+        """
+        Use one incremental decoder per file so that multi-byte characters
+        split across reads are decoded properly.
+        """
+        self._decoders = {}
+        for _file in files:
+            self._decoders[_file] = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def send_signal(self, sig):
+        """
+        Send sig to the process, or to its whole process group when
+        process_group is set. Nothing is sent once the process is reaped.
+        """
+        if self.process is None or self.process.returncode is not None:
+            return
+        if not self.process_group:
+            self.process.send_signal(sig)
+            return
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
     def cancel(self):
-        self.process.kill()
+        self.send_signal(signal.SIGKILL)
+
+    def pause(self):
+        """
+        Suspend the process with SIGSTOP, from any thread. kill_timeout is
+        not enforced until resume() is called. A command paused before
+        being run is stopped as soon as its process is started.
+        """
+        with self._pause_lock:
+            if self.paused_at is not None:
+                return
+            self.paused_at = time.time()
+            self.send_signal(signal.SIGSTOP)
+
+    def resume(self):
+        """
+        Continue a paused process with SIGCONT, from any thread. The time
+        spent paused does not count towards kill_timeout.
+        """
+        with self._pause_lock:
+            if self.paused_at is None:
+                return
+            self.last_read += time.time() - self.paused_at
+            self.paused_at = None
+            self.send_signal(signal.SIGCONT)
+
+    def _apply_pause(self):
+        """
+        Stop a process started while the command is paused.
+        """
+        with self._pause_lock:
+            if self.paused_at is not None:
+                self.paused_at = time.time()
+                self.send_signal(signal.SIGSTOP)
+
+    def _has_timed_out(self, now=None):
+        """
+        Return whether the process has been silent for more than
+        kill_timeout seconds, paused processes never time out.
+        """
+        if self.paused_at is not None:
+            return False
+        return ((now or time.time()) - self.last_read) > self.kill_timeout
+
+    def _kill_timed_out(self):
+        self.send_signal(signal.SIGKILL)
+        self.timed_out = True
+
+    def poll(self):
+        """
+        Return the exit code of the process, or None if it is still running.
+
+        An exited process is reaped with wait4, its resource usage and I/O
+        counters are then available in self.usage. Use this method instead
+        of self.process.poll(), which discards them.
+        """
+        if self.process.returncode is not None:
+            return self.process.returncode
+
+        pid = self.process.pid
+        try:
+            # Leave the process a zombie so that /proc/<pid>/io can be read
+            options = os.WEXITED | os.WNOHANG | os.WNOWAIT
+            if os.waitid(os.P_PID, pid, options) is None:
+                return None
+            io_counters = _read_proc_io(pid)
+            _, status, rusage = os.wait4(pid, 0)
+        except ChildProcessError:
+            # Already reaped by someone else
+            return self.process.poll()
+
+        self.process.returncode = _waitstatus_to_exitcode(status)
+        self.usage = get_usage(rusage, io_counters, time.time() - self.started_at)
+        return self.process.returncode
+
+    def wakeup(self):
+        """
+        Make a pending wait() return immediately, from any thread.
+        """
+        with self._wakeup_lock:
+            if self._wakeup_w is None:
+                return
+            try:
+                os.write(self._wakeup_w, b"\0")
+            except BlockingIOError:
+                pass  # a wakeup is already pending
+
+    def _close_wakeup_fds(self):
+        with self._wakeup_lock:
+            for fd in (self._pidfd, self._wakeup_r, self._wakeup_w):
+                if fd is not None:
+                    os.close(fd)
+            self._pidfd = self._wakeup_r = self._wakeup_w = None
 
     def wait(self, callback=None, loop=True):
+        """
+        Wait for the process to exit, passing its output to callback.
+        The process exit (when pidfds are supported) and wakeup() interrupt
+        the wait immediately, otherwise callback is called with empty strings
+        every timeout seconds. If loop is False, return after the first
+        event: the exit code if the process has exited, None otherwise.
+        """
+        pipes = [self.process.stdout, self.process.stderr]
 
         while self.process.returncode is None:
 
-            self.process.poll()
+            self.poll()
 
-            file_r, file_w, file_x, = select.select(
-                [self.process.stdout, self.process.stderr], [], [], self.timeout
+            watched = [_file for _file in pipes if _file not in self._eof]
+            events = [fd for fd in (self._pidfd, self._wakeup_r) if fd is not None]
+            file_r, file_w, file_x = select.select(
+                watched + events, [], [], self.timeout
             )
 
-            if not file_r and not file_w and not file_x:
+            woken = self._wakeup_r is not None and self._wakeup_r in file_r
+            if woken:
+                while self._read_wakeup():
+                    pass
+
+            if self._pidfd is not None and self._pidfd in file_r:
+                self.poll()
+                # Read whatever the process wrote before exiting
+                file_r = watched
+            else:
+                file_r = [_file for _file in file_r if _file in watched]
+
+            if not file_r and not woken and self.process.returncode is None:
                 if callback:
                     callback("", "")
-                if (time.time() - self.last_read) > self.kill_timeout:
-                    self.process.kill()
+                if self._has_timed_out():
+                    self._kill_timed_out()
                     raise CommandException(
                         "Process (pid = %s) has timed out" % (self.process.pid)
                     )
-            else:
+            elif file_r:
                 stdout = ""
                 stderr = ""
                 self.last_read = time.time()
                 for _file in file_r:
-                    buf = self._read_all(_file)
+                    buf, eof = self._read_available(_file)
+                    if eof:
+                        self._eof.add(_file)
                     if _file == self.process.stdout:
                         stdout = buf
                     elif _file == self.process.stderr:
@@ -105,29 +563,365 @@ class Command(object):
             if not loop:
                 break
 
+        if self.process.returncode is not None:
+            self._close_wakeup_fds()
         return self.process.returncode
 
-    def _read_no_intr(self, _file, size):
+    def _read_wakeup(self):
+        try:
+            return os.read(self._wakeup_r, 64)
+        except BlockingIOError:
+            return b""
+
+    def _read_no_intr(self, _file):
+        """
+        Read from a non-blocking file into the command buffer.
+        Return the number of bytes read, None if nothing is available yet
+        and 0 at end of file.
+        """
         while True:
             try:
-                content = _file.read(size)
-                if content is not None:
-                    return content.decode()
-                else:
-                    return ""
+                return _file.readinto(self._buffer)
             except (OSError, IOError) as e:
                 if e.errno == errno.EINTR:
                     continue
                 elif e.errno == errno.EAGAIN or e.errno == errno.EWOULDBLOCK:
-                    return ""
+                    return None
                 else:
                     raise
 
     def _read_all(self, _file):
-        buf = ""
+        buf, _ = self._read_available(_file)
+        return buf
+
+    def _read_available(self, _file):
+        """
+        Read and decode everything available from a non-blocking file.
+        Return a (content, eof) tuple.
+        """
+        decoder = self._decoders[_file]
+        chunks = []
         while True:
-            content = self._read_no_intr(_file, self.read_size)
-            buf += content
-            if content == "":
+            size = self._read_no_intr(_file)
+            if size is None:
+                return "".join(chunks), False
+            elif size == 0:
+                chunks.append(decoder.decode(b"", final=True))
+                return "".join(chunks), True
+            chunks.append(decoder.decode(self._buffer[:size]))
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer keeping the last bytes written to it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.pos = 0
+        self.full = False
+
+    def write(self, data):
+        """
+        Append a string, only the last size bytes are kept.
+        """
+        view = memoryview(data.encode())
+        length = len(view)
+        if length >= self.size:
+            self.buffer[:] = view[length - self.size :]
+            self.pos = 0
+            self.full = True
+            return
+
+        end = self.pos + length
+        if end <= self.size:
+            self.buffer[self.pos : end] = view
+        else:
+            first = self.size - self.pos
+            self.buffer[self.pos :] = view[:first]
+            self.buffer[: length - first] = view[first:]
+        if end >= self.size:
+            self.full = True
+        self.pos = end % self.size
+
+    def getvalue(self):
+        """
+        Return the buffer content as a string.
+        """
+        if self.full:
+            content = self.buffer[self.pos :] + self.buffer[: self.pos]
+        else:
+            content = self.buffer[: self.pos]
+        # The oldest character may have been cut, invalid input was already
+        # replaced while decoding so nothing else is dropped here.
+        return content.decode(errors="ignore")
+
+
+class _ExitNotifyingProtocol(asyncio.subprocess.SubprocessStreamProtocol):
+    """
+    Resolve the exited future as soon as the process exits. Process.wait()
+    also waits for the pipes to be closed, which children of the process
+    may delay indefinitely.
+    """
+
+    def __init__(self, limit, loop):
+        asyncio.subprocess.SubprocessStreamProtocol.__init__(self, limit, loop)
+        self.exited = loop.create_future()
+
+    def process_exited(self):
+        asyncio.subprocess.SubprocessStreamProtocol.process_exited(self)
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+
+class AsyncCommand(Command):
+    """
+    Command driven by the running asyncio event loop.
+    run() and wait() are coroutines, other methods behave like in Command.
+    Processes are always spawned by asyncio, spawn_method is ignored.
+    Since asyncio reaps them itself, usage only holds the wall time.
+
+    Commands with limits are wrapped in a shell waiting for a line on its
+    standard input, a pipe the tool inherits, while the limits are applied.
+    """
+
+    async def run(self, args):
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+
+        loop = asyncio.get_running_loop()
+        gate = self._has_limits()
+        if gate:
+            args = ["/bin/sh", "-c", COMMAND_GATE_SCRIPT, "sh"] + list(args)
+        self.last_read = self.started_at = time.time()
+        self._transport, self._protocol = await loop.subprocess_exec(
+            lambda: _ExitNotifyingProtocol(COMMAND_DEFAULT_STREAM_LIMIT, loop),
+            *args,
+            cwd=self.base_dir,
+            close_fds=True,
+            restore_signals=True,
+            start_new_session=self.process_group,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self.process = asyncio.subprocess.Process(self._transport, self._protocol, loop)
+        if gate:
+            try:
+                self._set_limits(self.process.pid)
+            except (OSError, ValueError, CommandException) as exc:
+                self._transport.kill()
+                await self._protocol.exited
+                self._transport.close()
+                raise self._get_limits_error(self.process.pid, exc)
+            self._transport.get_pipe_transport(0).write(b"\n")
+        self._apply_pause()
+        self._init_decoders([self.process.stdout, self.process.stderr])
+
+    async def wait(self, callback=None):
+        """
+        Wait for the process to exit and return its exit code. callback is
+        called with (stdout, stderr) on new output, and with empty strings
+        every timeout seconds when the process stays silent.
+        """
+        readers = [
+            asyncio.ensure_future(self._pump(self.process.stdout, callback, 0)),
+            asyncio.ensure_future(self._pump(self.process.stderr, callback, 1)),
+        ]
+        exit_waiter = self._protocol.exited
+        try:
+            while not exit_waiter.done():
+                await asyncio.wait([exit_waiter], timeout=self.timeout)
+                if exit_waiter.done():
+                    break
+                if (time.time() - self.last_read) >= self.timeout and callback:
+                    callback("", "")
+                if self._has_timed_out():
+                    self._kill_timed_out()
+                    raise CommandException(
+                        "Process (pid = %s) has timed out" % (self.process.pid)
+                    )
+            self.usage = get_usage(wall_time=time.time() - self.started_at)
+            # Children of the process may keep the pipes open after it exited
+            await asyncio.wait(readers, timeout=self.timeout)
+        finally:
+            for future in readers:
+                future.cancel()
+            if exit_waiter.done():
+                self._transport.close()
+
+        return self.process.returncode
+
+    async def _pump(self, stream, callback, index):
+        decoder = self._decoders[stream]
+        while True:
+            content = await stream.read(self.read_size)
+            self.last_read = time.time()
+            output = ["", ""]
+            output[index] = decoder.decode(content, final=not content)
+            if callback and output[index]:
+                callback(*output)
+            if not content:
                 break
-        return buf
+
+
+class CommandSupervisor(object):
+    """
+    Drive many running commands from a single thread.
+
+    The stdout/stderr pipes of every registered command, as well as a pidfd
+    when the platform provides one, are watched by a single selector. Idle
+    commands cost nothing and exits are noticed as soon as they happen.
+    Commands without a pidfd are checked for exit on every poll.
+    """
+
+    def __init__(self, timeout=COMMAND_DEFAULT_TIMEOUT):
+        """
+        :param timeout: maximum time spent waiting in poll, also used as the
+                        interval of idle callbacks
+        :type timeout: float
+        """
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.commands = {}
+
+    def __len__(self):
+        return len(self.commands)
+
+    def register(self, command, callback=None, exit_callback=None):
+        """
+        Start supervising a running command.
+
+        :param command: a command on which run() has been called
+        :type command: toolbox2.command.Command
+
+        :param callback: called with new output, or with empty strings every
+                         timeout seconds when the command stays silent
+        :type callback: callable(stdout, stderr)
+
+        :param exit_callback: called with the exit code once the process is reaped
+        :type exit_callback: callable(returncode)
+        """
+        if command in self.commands:
+            raise CommandException(
+                "Process (pid = %s) is already supervised" % command.process.pid
+            )
+
+        state = {
+            "callback": callback,
+            "exit_callback": exit_callback,
+            "files": [command.process.stdout, command.process.stderr],
+            "pidfd": _open_pidfd(command.process.pid),
+            "last_callback": time.time(),
+        }
+        self.commands[command] = state
+
+        for _file in state["files"]:
+            self.selector.register(_file, selectors.EVENT_READ, command)
+        if state["pidfd"] is not None:
+            self.selector.register(state["pidfd"], selectors.EVENT_READ, command)
+        # Let Command.wakeup() interrupt poll
+        if command._wakeup_r is not None:
+            self.selector.register(command._wakeup_r, selectors.EVENT_READ, command)
+
+    def unregister(self, command):
+        """
+        Stop supervising a command. Its process is left untouched.
+        """
+        state = self.commands.pop(command)
+        for _file in state["files"]:
+            self.selector.unregister(_file)
+        if state["pidfd"] is not None:
+            self.selector.unregister(state["pidfd"])
+            os.close(state["pidfd"])
+        if command._wakeup_r is not None:
+            self.selector.unregister(command._wakeup_r)
+
+    def poll(self, timeout=None):
+        """
+        Wait at most timeout seconds for output or exits, dispatch them to
+        the registered callbacks, and return the list of commands which
+        exited during this call.
+
+        :param timeout: maximum time to wait, defaults to self.timeout
+        :type timeout: float
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self.commands:
+            return []
+
+        now = time.time()
+        exited = set()
+        readable = {}
+        for key, _ in self.selector.select(timeout):
+            command = key.data
+            if key.fileobj == self.commands[command]["pidfd"]:
+                exited.add(command)
+            elif key.fileobj == command._wakeup_r:
+                while command._read_wakeup():
+                    pass
+            else:
+                readable.setdefault(command, []).append(key.fileobj)
+
+        for command, state in list(self.commands.items()):
+            if state["pidfd"] is None and command.poll() is not None:
+                exited.add(command)
+
+            if command in readable:
+                command.last_read = time.time()
+                self._dispatch(command, readable[command])
+            elif (
+                command not in exited and (now - state["last_callback"]) >= self.timeout
+            ):
+                self._dispatch(command, [])
+                if command._has_timed_out(now):
+                    command._kill_timed_out()
+
+        finished = []
+        for command in exited:
+            state = self.commands[command]
+            # The process has already exited, this does not block
+            command.poll()
+            self._dispatch(command, list(state["files"]))
+            self.unregister(command)
+            command._close_wakeup_fds()
+            finished.append(command)
+            if callable(state["exit_callback"]):
+                state["exit_callback"](command.process.returncode)
+
+        return finished
+
+    def run(self):
+        """
+        Poll until every registered command has exited.
+        """
+        while self.commands:
+            self.poll()
+
+    def close(self):
+        """
+        Release the selector and every pidfd. Processes are left untouched.
+        """
+        for command in list(self.commands):
+            self.unregister(command)
+        self.selector.close()
+
+    def _dispatch(self, command, files):
+        state = self.commands[command]
+        output = {"stdout": "", "stderr": ""}
+        for _file in files:
+            buf, eof = command._read_available(_file)
+            if _file == command.process.stdout:
+                output["stdout"] = buf
+            else:
+                output["stderr"] = buf
+            if eof:
+                # Do not let a closed pipe wake the selector up forever
+                state["files"].remove(_file)
+                self.selector.unregister(_file)
+
+        state["last_callback"] = time.time()
+        if callable(state["callback"]):
+            state["callback"](output["stdout"], output["stderr"])
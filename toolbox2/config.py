@@ -0,0 +1,120 @@
+"""
+Configuration of toolbox2, read from /etc/toolbox2.conf.
+
+The file is parsed once per process, and parsed again only when its
+modification time or size changes. Paths of the [tools] section are
+resolved once like shutil.which does, so that creating a worker neither
+reads the file nor looks up its tool.
+"""
+
+import os
+import shutil
+import logging
+import threading
+import configparser
+
+TOOLBOX2_CONFIG_FILE = "/etc/toolbox2.conf"
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+class Config(object):
+    """
+    Parsed configuration file, refreshed by get_config.
+    """
+
+    def __init__(self, path=TOOLBOX2_CONFIG_FILE):
+        """
+        :param path: configuration file path
+        :type path: string
+        """
+        self.path = path
+        self.parser = configparser.ConfigParser()
+        self.stamp = None
+        self.lock = threading.Lock()
+        # Paths of the [tools] section resolved for a PATH, by PATH
+        self._tools = {}
+        self._loaded = False
+
+    def refresh(self):
+        """
+        Parse the file again if it changed since it was last parsed. Errors
+        are logged once, the configuration is then empty.
+        """
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError as exc:
+            stamp = str(exc)
+
+        with self.lock:
+            if self._loaded and stamp == self.stamp:
+                return
+            parser = configparser.ConfigParser()
+            if isinstance(stamp, str):
+                logging.getLogger("toolbox2").warning("%s", stamp)
+            else:
+                try:
+                    with open(self.path, "r") as fp:
+                        parser.read_file(fp)
+                except (OSError, configparser.Error) as exc:
+                    logging.getLogger("toolbox2").warning("%s", exc)
+                    parser = configparser.ConfigParser()
+            self.parser = parser
+            self.stamp = stamp
+            self._tools = {}
+            self._loaded = True
+
+    def has_option(self, section, option):
+        return self.parser.has_option(section, option)
+
+    def get(self, section, option, fallback=None):
+        return self.parser.get(section, option, fallback=fallback)
+
+    def get_tool(self, tool):
+        """
+        Return the absolute path of the executable configured for a tool,
+        the configured value if it cannot be found in PATH, or None if the
+        tool is not configured.
+
+        :param tool: tool name, as in the [tools] section
+        :type tool: string
+        """
+        if tool is None:
+            return None
+        tools = self._tools.get(os.environ.get("PATH"))
+        if tools is None:
+            tools = self._resolve_tools()
+        return tools.get(self.parser.optionxform(tool))
+
+    def _resolve_tools(self):
+        """
+        Resolve the paths of the [tools] section for the current PATH.
+        """
+        env_path = os.environ.get("PATH")
+        parser = self.parser
+        tools = {}
+        if parser.has_section("tools"):
+            for tool, value in parser.items("tools"):
+                resolved = shutil.which(value)
+                tools[tool] = os.path.abspath(resolved) if resolved else value
+        with self.lock:
+            if parser is self.parser:
+                self._tools[env_path] = tools
+        return tools
+
+
+def get_config(path=TOOLBOX2_CONFIG_FILE):
+    """
+    Return the configuration of the process, parsed again if the file has
+    changed.
+
+    :rtype: toolbox2.config.Config
+    """
+    with _configs_lock:
+        config = _configs.get(path)
+        if config is None:
+            config = _configs[path] = Config(path)
+    config.refresh()
+    return config
@@ -0,0 +1,70 @@
+"""
+Run job descriptions: JSON documents naming an action with its params and
+resources, as read by bin/toolbox2 and toolbox2d.
+
+::
+
+  {"action": "transcode", "params": {}, "resources": {"inputs": {...}}}
+"""
+
+import time
+
+from toolbox2 import Loader, LoaderException
+from toolbox2.exception import Toolbox2Exception
+
+JOB_DEFAULT_BASE_DIR = "/tmp/"
+
+
+class JobException(Toolbox2Exception):
+    pass
+
+
+def create_action(settings, log, base_dir=JOB_DEFAULT_BASE_DIR, _id=None):
+    """
+    Return the action described by a job, not started yet.
+
+    :param settings: job description
+    :type settings: dict
+
+    :param _id: job identifier, a timestamp by default
+    :type _id: string
+    """
+    if not isinstance(settings, dict) or "action" not in settings:
+        raise JobException("Invalid job description: no action")
+    try:
+        action_class = Loader().get_class(settings["action"])
+    except LoaderException as exc:
+        raise JobException(str(exc))
+    return action_class(
+        log,
+        base_dir,
+        _id or str(time.time()),
+        settings.get("params", {}),
+        settings.get("resources", {}),
+    )
+
+
+def get_job_result(action):
+    """
+    Return the JSON serializable result of an action which has run.
+    """
+    return {
+        "outputs": action.get_output_resources(),
+        "params": action.params,
+        "metadata": action.get_metadata(),
+        "running_time": action.ended_at - action.started_at,
+    }
+
+
+def run_job(settings, log, base_dir=JOB_DEFAULT_BASE_DIR, _id=None, callback=None):
+    """
+    Run a job and return its result, see get_job_result. Errors are raised
+    as Toolbox2Exception.
+
+    :param callback: called with the action every callback interval
+    :type callback: callable(action)
+    """
+    action = create_action(settings, log, base_dir, _id)
+    log.info("Running %s", settings["action"])
+    action.run(callback)
+    return get_job_result(action)
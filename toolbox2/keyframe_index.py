@@ -0,0 +1,204 @@
+"""
+Keyframe indexes of media files.
+
+An index lists the keyframes of a video stream: their presentation time,
+their byte position in the file and the number of packets of the GOP they
+start. It is stored in a compact binary sidecar in the cache directory,
+keyed by the identity of the file (device, inode, size and modification
+time), and memory-mapped when read so that finding the keyframe before a
+given time is a binary search, without decoding nor reading the file.
+"""
+
+import os
+import math
+import mmap
+import struct
+import bisect
+
+from toolbox2.cache import get_cache_dir, write_cache_file
+from toolbox2.exception import Toolbox2Exception
+
+# Bump when the format of the sidecars changes
+KEYFRAME_INDEX_VERSION = 1
+KEYFRAME_INDEX_MAGIC = b"TB2K"
+
+# magic, version, stream index, time base, file size and mtime, keyframes
+KEYFRAME_INDEX_HEADER = struct.Struct("<4sHHIIqqQ")
+# pts, byte position (-1 if unknown), packets in the GOP
+KEYFRAME_INDEX_RECORD = struct.Struct("<qqI")
+
+
+class KeyframeIndexException(Toolbox2Exception):
+    pass
+
+
+class _Column(object):
+    """
+    Read-only sequence of one field of the records of an index, for bisect.
+    """
+
+    def __init__(self, index, field):
+        self.index = index
+        self.field = field
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        return self.index.get_record(idx)[self.field]
+
+
+class KeyframeIndex(object):
+    """
+    Memory-mapped keyframe index of one video stream.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: sidecar path, see write_keyframe_index
+        :type path: string
+        """
+        self.path = path
+        with open(path, "rb") as fp:
+            try:
+                self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise KeyframeIndexException("Empty keyframe index: %s" % path)
+
+        if len(self._map) < KEYFRAME_INDEX_HEADER.size:
+            self.close()
+            raise KeyframeIndexException("Truncated keyframe index: %s" % path)
+        header = KEYFRAME_INDEX_HEADER.unpack_from(self._map)
+        (magic, version, self.stream_index, num, den) = header[:5]
+        (self.file_size, self.file_mtime_ns, self.count) = header[5:]
+        size = KEYFRAME_INDEX_HEADER.size + self.count * KEYFRAME_INDEX_RECORD.size
+        if magic != KEYFRAME_INDEX_MAGIC or version != KEYFRAME_INDEX_VERSION:
+            self.close()
+            raise KeyframeIndexException("Invalid keyframe index: %s" % path)
+        if len(self._map) != size:
+            self.close()
+            raise KeyframeIndexException("Truncated keyframe index: %s" % path)
+        if not num or not den:
+            self.close()
+            raise KeyframeIndexException("Invalid time base: %s" % path)
+        self.time_base = (num, den)
+        self._pts = _Column(self, 0)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+    def get_record(self, idx):
+        """
+        Return the (pts, pos, gop_size) record of the keyframe idx.
+        """
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError("keyframe index out of range")
+        offset = KEYFRAME_INDEX_HEADER.size + idx * KEYFRAME_INDEX_RECORD.size
+        return KEYFRAME_INDEX_RECORD.unpack_from(self._map, offset)
+
+    def to_seconds(self, pts):
+        return float(pts) * self.time_base[0] / self.time_base[1]
+
+    def find(self, seconds, start_time=0):
+        """
+        Return the nearest keyframe at or before seconds, as a dict with its
+        time, pts, byte position and GOP size, or None if seconds is before
+        the first keyframe.
+
+        :param start_time: start time of the file, in seconds. Positions
+                           and returned times are relative to it, like the
+                           -ss option of ffmpeg, pts are not
+        :type start_time: float
+        """
+        ticks = (seconds + start_time) * self.time_base[1] / self.time_base[0]
+        # Absorb float errors, 1.4 * 90000 is 125999.99999999999
+        pts = math.floor(ticks + 1e-6)
+        idx = bisect.bisect_right(self._pts, pts) - 1
+        if idx < 0:
+            return None
+        (pts, pos, gop_size) = self.get_record(idx)
+        return {
+            "time": self.to_seconds(pts) - start_time,
+            "pts": pts,
+            "pos": pos,
+            "gop_size": gop_size,
+        }
+
+    def get_gop_sizes(self):
+        return [self.get_record(idx)[2] for idx in range(self.count)]
+
+
+def get_keyframe_index_path(path, stream_index, cache_dir=None):
+    """
+    Return the sidecar path of the index of a stream of a file, None if the
+    file cannot be stat'ed or if no cache directory is writable.
+    """
+    cache_dir = cache_dir or get_cache_dir("keyframes")
+    if cache_dir is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    name = "%x-%x-%d.kfi" % (stat.st_dev, stat.st_ino, stream_index)
+    return os.path.join(cache_dir, name)
+
+
+def write_keyframe_index(path, stream_index, time_base, keyframes, cache_dir=None):
+    """
+    Write the index of a stream of a file and return its sidecar path.
+
+    :param time_base: time base of the stream, as (num, den)
+    :type time_base: tuple
+
+    :param keyframes: (pts, pos, gop_size) of every keyframe
+    :type keyframes: list
+    """
+    if not time_base[0] or not time_base[1]:
+        raise KeyframeIndexException("Invalid time base: %s/%s" % tuple(time_base))
+    index_path = get_keyframe_index_path(path, stream_index, cache_dir)
+    if index_path is None:
+        raise KeyframeIndexException("Cannot store the keyframe index of %s" % path)
+    stat = os.stat(path)
+    keyframes = sorted(keyframes)
+    content = [
+        KEYFRAME_INDEX_HEADER.pack(
+            KEYFRAME_INDEX_MAGIC,
+            KEYFRAME_INDEX_VERSION,
+            stream_index,
+            time_base[0],
+            time_base[1],
+            stat.st_size,
+            stat.st_mtime_ns,
+            len(keyframes),
+        )
+    ]
+    content += [KEYFRAME_INDEX_RECORD.pack(*keyframe) for keyframe in keyframes]
+    write_cache_file(index_path, b"".join(content))
+    return index_path
+
+
+def get_keyframe_index(path, stream_index, cache_dir=None):
+    """
+    Return the index of a stream of a file, None if it has not been built
+    or if the file has changed since.
+
+    :rtype: toolbox2.keyframe_index.KeyframeIndex
+    """
+    index_path = get_keyframe_index_path(path, stream_index, cache_dir)
+    if index_path is None or not os.path.exists(index_path):
+        return None
+    try:
+        index = KeyframeIndex(index_path)
+    except (OSError, KeyframeIndexException):
+        return None
+    stat = os.stat(path)
+    if (index.file_size, index.file_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        index.close()
+        return None
+    return index
@@ -0,0 +1,160 @@
+"""
+Cache of the metadata probed from media files.
+
+Entries are keyed by the identity of the file (device, inode, size and
+modification time) and by the probe options, so that a modified file is
+probed again. Recently used entries are kept in memory, all of them are
+stored in a SQLite database in the cache directory, shared by the processes
+of the host.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import collections
+
+from toolbox2.cache import get_cache_dir
+
+PROBE_CACHE_DEFAULT_SIZE = 128
+PROBE_CACHE_DB_TIMEOUT = 5
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+class ProbeCache(object):
+    """
+    Two-level cache of probe results: an in-process LRU in front of a
+    shared SQLite database. Every failure of the database is ignored, the
+    cache then only works in memory.
+    """
+
+    def __init__(self, db_path=None, size=PROBE_CACHE_DEFAULT_SIZE):
+        """
+        :param db_path: SQLite database path, None to only cache in memory
+        :type db_path: string
+
+        :param size: maximum number of entries kept in memory
+        :type size: int
+        """
+        self.db_path = db_path
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "db_hits": 0, "misses": 0}
+        if self.db_path:
+            self._execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                " dev INTEGER, ino INTEGER, options TEXT,"
+                " size INTEGER, mtime_ns INTEGER, metadata TEXT,"
+                " PRIMARY KEY (dev, ino, options))"
+            )
+
+    def _execute(self, query, args=()):
+        try:
+            db = sqlite3.connect(self.db_path, timeout=PROBE_CACHE_DB_TIMEOUT)
+            try:
+                with db:
+                    return db.execute(query, args).fetchall()
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return None
+
+    @staticmethod
+    def _get_key(path, options):
+        """
+        Return the cache key of a file probed with options, None if the
+        file cannot be stat'ed.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        options = json.dumps(options or {}, sort_keys=True)
+        return (stat.st_dev, stat.st_ino, options, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, path, options=None):
+        """
+        Return the cached metadata of a file, or None.
+
+        :param path: path of the probed file
+        :type path: string
+
+        :param options: options the file was probed with
+        :type options: dict
+        """
+        key = self._get_key(path, options)
+        if key is None:
+            return None
+
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return json.loads(payload)
+
+        rows = None
+        if self.db_path:
+            rows = self._execute(
+                "SELECT size, mtime_ns, metadata FROM probes"
+                " WHERE dev = ? AND ino = ? AND options = ?",
+                key[:3],
+            )
+        if rows and tuple(rows[0][:2]) == key[3:]:
+            payload = rows[0][2]
+            with self.lock:
+                self._remember(key, payload)
+                self.stats["db_hits"] += 1
+            return json.loads(payload)
+
+        with self.lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, path, options, metadata):
+        """
+        Store the metadata of a file probed with options.
+        """
+        key = self._get_key(path, options)
+        if key is None:
+            return
+        payload = json.dumps(metadata)
+        with self.lock:
+            self._remember(key, payload)
+        if self.db_path:
+            # Replaces the entry of a previous version of the file
+            self._execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+                key + (payload,),
+            )
+
+    def _remember(self, key, payload):
+        self.entries[key] = payload
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry, from memory and from the database.
+        """
+        with self.lock:
+            self.entries.clear()
+        if self.db_path:
+            self._execute("DELETE FROM probes")
+
+
+def get_probe_cache():
+    """
+    Return the probe cache of the process, stored in the cache directory.
+    """
+    global _probe_cache
+    with _probe_cache_lock:
+        if _probe_cache is None:
+            cache_dir = get_cache_dir("probe")
+            db_path = os.path.join(cache_dir, "probe.sqlite") if cache_dir else None
+            _probe_cache = ProbeCache(db_path)
+        return _probe_cache
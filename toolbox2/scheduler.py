@@ -0,0 +1,243 @@
+"""
+Scheduling of actions run by a long-running process, such as toolbox2d.
+
+Jobs are queued in one of two lanes, each served by its own threads, so
+that short jobs (probes, capability checks, single frame grabs) never wait
+behind long transcodes. Within a lane, jobs of a higher priority class run
+first. Among the tenants having jobs of the same class, the tenant with
+the fewest running jobs, then with the least time consumed, goes first.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+import concurrent.futures
+
+from toolbox2.exception import Toolbox2Exception
+
+PRIORITIES = {
+    "urgent": 0,
+    "high": 1,
+    "normal": 2,
+    "low": 3,
+}
+DEFAULT_PRIORITY = "normal"
+DEFAULT_TENANT = "default"
+
+LANE_LIGHT = "light"
+LANE_HEAVY = "heavy"
+
+# Actions which only read a small part of their inputs
+LIGHT_ACTIONS = ["avinfo_extract", "getcapability"]
+# Params making an action decode its video or read all of its inputs,
+# estimate_frames falls back to counting packets
+HEAVY_PARAMS = [
+    "count_frames",
+    "count_packets",
+    "estimate_frames",
+    "thumbnail",
+    "thumbnails",
+    "sprite",
+]
+
+
+class SchedulerException(Toolbox2Exception):
+    pass
+
+
+def get_lane(settings):
+    """
+    Return the lane of a job description, see toolbox2.job.
+    """
+    params = settings.get("params") or {}
+    if any(params.get(name) for name in HEAVY_PARAMS):
+        return LANE_HEAVY
+    if settings.get("action") in LIGHT_ACTIONS or params.get("single_frame"):
+        return LANE_LIGHT
+    return LANE_HEAVY
+
+
+class _Job(object):
+    def __init__(self, func, tenant, priority, seq):
+        self.func = func
+        self.tenant = tenant
+        self.priority = priority
+        self.seq = seq
+        self.future = concurrent.futures.Future()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Lane(object):
+    """
+    Queues of the jobs of a lane, one heap per tenant.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.queues = {}
+        self.running = {}
+        self.served = {}
+        self.threads = []
+
+    def push(self, job):
+        queue = self.queues.setdefault(job.tenant, [])
+        if not queue and not self.running.get(job.tenant):
+            # A tenant coming back gets no credit for the time it was idle
+            active = [
+                self.served.get(tenant, 0)
+                for tenant, other in self.queues.items()
+                if other or self.running.get(tenant)
+            ]
+            self.served[job.tenant] = max(
+                self.served.get(job.tenant, 0), min(active) if active else 0
+            )
+        heapq.heappush(queue, job)
+
+    def pop(self):
+        best = None
+        for tenant, queue in self.queues.items():
+            if not queue:
+                continue
+            key = (
+                queue[0].priority,
+                self.running.get(tenant, 0),
+                self.served.get(tenant, 0),
+                queue[0].seq,
+            )
+            if best is None or key < best[0]:
+                best = (key, tenant)
+        if best is None:
+            return None
+        job = heapq.heappop(self.queues[best[1]])
+        self.running[job.tenant] = self.running.get(job.tenant, 0) + 1
+        return job
+
+    def done(self, job, duration):
+        self.running[job.tenant] -= 1
+        self.served[job.tenant] = self.served.get(job.tenant, 0) + duration
+
+    def get_stats(self):
+        return {
+            "queued": sum(len(queue) for queue in self.queues.values()),
+            "running": sum(self.running.values()),
+            "workers": self.workers,
+        }
+
+
+class ActionScheduler(object):
+    """
+    Run callables, typically running an action, in priority and fair share
+    order, see the module documentation.
+    """
+
+    def __init__(self, light_workers=2, heavy_workers=1):
+        """
+        :param light_workers: jobs of the light lane running at once
+        :type light_workers: int
+
+        :param heavy_workers: jobs of the heavy lane running at once
+        :type heavy_workers: int
+        """
+        self.cond = threading.Condition()
+        self.lanes = {
+            LANE_LIGHT: _Lane(LANE_LIGHT, light_workers),
+            LANE_HEAVY: _Lane(LANE_HEAVY, heavy_workers),
+        }
+        self._seq = itertools.count()
+        self._shutdown = False
+
+        for lane in self.lanes.values():
+            if lane.workers < 1:
+                raise SchedulerException(
+                    "The %s lane needs at least one worker" % lane.name
+                )
+            for _ in range(lane.workers):
+                thread = threading.Thread(target=self._work, args=(lane,))
+                thread.daemon = True
+                thread.start()
+                lane.threads.append(thread)
+
+    def submit(self, func, lane=LANE_HEAVY, tenant=None, priority=None):
+        """
+        Queue func and return a concurrent.futures.Future of its result.
+        Jobs may be cancelled with Future.cancel until they start.
+
+        :param lane: light or heavy, see get_lane
+        :type lane: string
+
+        :param tenant: job owner, shares the lane fairly with other tenants
+        :type tenant: string
+
+        :param priority: urgent, high, normal or low
+        :type priority: string
+        """
+        priority = priority or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            raise SchedulerException("Invalid priority: %s" % priority)
+        if lane not in self.lanes:
+            raise SchedulerException("Invalid lane: %s" % lane)
+
+        with self.cond:
+            if self._shutdown:
+                raise SchedulerException("The scheduler is shut down")
+            job = _Job(
+                func, tenant or DEFAULT_TENANT, PRIORITIES[priority], next(self._seq)
+            )
+            self.lanes[lane].push(job)
+            self.cond.notify_all()
+        return job.future
+
+    def _work(self, lane):
+        while True:
+            with self.cond:
+                job = lane.pop()
+                while job is None and not self._shutdown:
+                    self.cond.wait()
+                    job = lane.pop()
+                if job is None:
+                    return
+
+            started_at = time.time()
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.func())
+                except BaseException as exc:
+                    job.future.set_exception(exc)
+
+            with self.cond:
+                lane.done(job, time.time() - started_at)
+
+    def get_stats(self):
+        """
+        Return the number of queued and running jobs of every lane.
+        """
+        with self.cond:
+            return dict((name, lane.get_stats()) for name, lane in self.lanes.items())
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Cancel queued jobs and stop the threads once running jobs are over.
+
+        :param timeout: maximum time to wait for the running jobs, in seconds
+        :type timeout: float
+        """
+        with self.cond:
+            self._shutdown = True
+            for lane in self.lanes.values():
+                for queue in lane.queues.values():
+                    for job in queue:
+                        job.future.cancel()
+                    del queue[:]
+            self.cond.notify_all()
+        if wait:
+            deadline = None if timeout is None else time.time() + timeout
+            for lane in self.lanes.values():
+                for thread in lane.threads:
+                    if deadline is None:
+                        thread.join()
+                    else:
+                        thread.join(max(deadline - time.time(), 0))
@@ -0,0 +1,347 @@
+"""
+Resident job server, run by toolbox2d.
+
+Clients connect to a UNIX socket and send one job description on a single
+JSON line, see toolbox2.job. The server answers with JSON lines until the
+job is over:
+
+::
+
+  {"event": "queued", "id": "..."}
+  {"event": "started", "id": "..."}
+  {"event": "progress", "progress": 42}
+  {"event": "done", "result": {"outputs": ..., "metadata": ...}}
+  {"event": "error", "error": "..."}
+
+Jobs are run by an ActionScheduler, see toolbox2.scheduler: at most
+max_jobs heavy jobs and light_jobs light jobs run at once, the others wait
+in the queue. Job descriptions may set a "tenant" and a "priority" class.
+A job is cancelled when its client disconnects, and when the server is
+closed. Resource paths must be absolute: submit_job makes them so.
+"""
+
+import os
+import json
+import time
+import select
+import socket
+import threading
+import socketserver
+import concurrent.futures
+
+from toolbox2.command import COMMAND_DEFAULT_KILL_TIMEOUT
+from toolbox2.job import JOB_DEFAULT_BASE_DIR, create_action, get_job_result
+from toolbox2.scheduler import ActionScheduler, get_lane
+from toolbox2.exception import Toolbox2Exception
+
+TOOLBOX2D_SOCKET = "/run/toolbox2d.sock"
+TOOLBOX2D_DEFAULT_MAX_JOBS = 4
+TOOLBOX2D_DEFAULT_LIGHT_JOBS = 2
+TOOLBOX2D_DEFAULT_MAX_QUEUED = 1000
+# Clients of queued jobs are checked for disconnection this often, in seconds
+TOOLBOX2D_DISCONNECT_INTERVAL = 1
+
+
+class ServerException(Toolbox2Exception):
+    pass
+
+
+def get_socket_path():
+    """
+    Return the socket path of toolbox2d, which the TOOLBOX2D_SOCKET
+    environment variable overrides.
+    """
+    return os.environ.get("TOOLBOX2D_SOCKET") or TOOLBOX2D_SOCKET
+
+
+def _encode(event):
+    return (json.dumps(event, default=str) + "\n").encode()
+
+
+def _iter_resources(settings):
+    """
+    Yield the (section, index, resource) of the resources of a job.
+    """
+    resources = settings.get("resources") or {}
+    for section, items in resources.items():
+        if isinstance(items, dict):
+            for index, resource in items.items():
+                if isinstance(resource, dict):
+                    yield section, index, resource
+
+
+def get_absolute_settings(settings):
+    """
+    Return a copy of a job description whose resource paths are absolute,
+    relative ones being resolved against the current directory.
+    """
+    settings = dict(settings)
+    if settings.get("resources"):
+        resources = {}
+        for section, items in settings["resources"].items():
+            resources[section] = dict(items) if isinstance(items, dict) else items
+        for section, index, resource in _iter_resources(settings):
+            if resource.get("path"):
+                path = os.path.abspath(resource["path"])
+                resources[section][index] = dict(resource, path=path)
+        settings["resources"] = resources
+    return settings
+
+
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    def send(self, event):
+        self.wfile.write(_encode(event))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        line = self.rfile.readline()
+        try:
+            settings = json.loads(line.decode())
+            if not isinstance(settings, dict):
+                raise ServerException("Invalid job description")
+            # The server does not run in the directory of its clients
+            for section, index, resource in _iter_resources(settings):
+                if resource.get("path") and not os.path.isabs(resource["path"]):
+                    raise ServerException(
+                        "Relative path in %s %s: %s"
+                        % (section, index, resource["path"])
+                    )
+            _id = "%s-%d" % (time.time(), server.next_id())
+            action = create_action(settings, server.log, server.base_dir, _id)
+        except (ValueError, Toolbox2Exception) as exc:
+            self.send({"event": "error", "error": str(exc)})
+            return
+
+        disconnected = threading.Event()
+
+        def callback(action):
+            try:
+                self.send({"event": "progress", "progress": action.progress})
+            except OSError:
+                if not disconnected.is_set():
+                    disconnected.set()
+                    server.log.warning("Client of job %s is gone, cancelling", _id)
+                    action.cancel()
+
+        def run():
+            server.dequeue()
+            self.send({"event": "started", "id": _id})
+            server.log.info("Running job %s: %s", _id, settings["action"])
+            server.add_action(action)
+            try:
+                action.run(callback)
+            finally:
+                server.remove_action(action)
+            if server.stopping:
+                raise ServerException("toolbox2d is stopping, job cancelled")
+            return get_job_result(action)
+
+        if not server.enqueue():
+            self.send({"event": "error", "error": "Too many queued jobs"})
+            return
+        try:
+            self.send({"event": "queued", "id": _id})
+            future = server.scheduler.submit(
+                run,
+                get_lane(settings),
+                settings.get("tenant"),
+                settings.get("priority"),
+            )
+        except (OSError, Toolbox2Exception) as exc:
+            server.dequeue()
+            if isinstance(exc, Toolbox2Exception):
+                self.send({"event": "error", "error": str(exc)})
+            return
+
+        self.wait(future, action, disconnected)
+        try:
+            self.send({"event": "done", "result": future.result()})
+        except OSError:
+            pass  # the client is gone
+        except concurrent.futures.CancelledError:
+            if not disconnected.is_set():
+                try:
+                    self.send({"event": "error", "error": "Job cancelled"})
+                except OSError:
+                    pass
+        except Exception as exc:
+            if isinstance(exc, Toolbox2Exception):
+                server.log.warning("Job %s failed: %s", _id, exc)
+            else:
+                server.log.exception("Job %s failed", _id)
+            if not disconnected.is_set():
+                try:
+                    self.send({"event": "error", "error": str(exc)})
+                except OSError:
+                    pass
+
+    def wait(self, future, action, disconnected):
+        """
+        Wait for a job to be over. If its client disconnects first, the job
+        is cancelled: dropped from the queue, or killed if it is running.
+        """
+        while not future.done() and not disconnected.is_set():
+            concurrent.futures.wait([future], timeout=TOOLBOX2D_DISCONNECT_INTERVAL)
+            if future.done() or not self.is_disconnected():
+                continue
+            disconnected.set()
+            self.server.log.warning("Client of job %s is gone, cancelling", action.id)
+            if future.cancel():
+                self.server.dequeue()
+            else:
+                action.cancel()
+        concurrent.futures.wait([future])
+
+    def is_disconnected(self):
+        """
+        Return whether the client has closed the connection. Nothing is
+        expected after the job description, any other data is dropped.
+        """
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.connection.recv(4096)
+        except OSError:
+            return True
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    UNIX socket server running jobs with bounded concurrency, see
+    toolbox2.scheduler.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path,
+        log,
+        base_dir=JOB_DEFAULT_BASE_DIR,
+        max_jobs=TOOLBOX2D_DEFAULT_MAX_JOBS,
+        max_queued=TOOLBOX2D_DEFAULT_MAX_QUEUED,
+        light_jobs=TOOLBOX2D_DEFAULT_LIGHT_JOBS,
+        stop_timeout=COMMAND_DEFAULT_KILL_TIMEOUT,
+    ):
+        """
+        :param socket_path: path of the UNIX socket to listen on
+        :type socket_path: string
+
+        :param max_jobs: heavy jobs running at once
+        :type max_jobs: int
+
+        :param max_queued: jobs waiting for a slot, more are rejected
+        :type max_queued: int
+
+        :param light_jobs: light jobs running at once
+        :type light_jobs: int
+
+        :param stop_timeout: time given to the cancelled jobs to exit when
+                             the server is closed, in seconds
+        :type stop_timeout: float
+        """
+        self.log = log
+        self.base_dir = base_dir
+        self.max_queued = max_queued
+        self.stop_timeout = stop_timeout
+        self.queued = 0
+        self.actions = set()
+        self.stopping = False
+        self.lock = threading.Lock()
+        self._ids = 0
+
+        if os.path.exists(socket_path):
+            # Refuse to steal the socket of a running server
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise ServerException("%s is already in use" % socket_path)
+            finally:
+                probe.close()
+        socketserver.UnixStreamServer.__init__(self, socket_path, JobRequestHandler)
+        self.scheduler = ActionScheduler(light_jobs, max_jobs)
+
+    def next_id(self):
+        with self.lock:
+            self._ids += 1
+            return self._ids
+
+    def enqueue(self):
+        with self.lock:
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+            return True
+
+    def dequeue(self):
+        with self.lock:
+            self.queued -= 1
+
+    def add_action(self, action):
+        with self.lock:
+            self.actions.add(action)
+            if self.stopping:
+                action.cancel()
+
+    def remove_action(self, action):
+        with self.lock:
+            self.actions.discard(action)
+
+    def cancel_actions(self):
+        """
+        Cancel the running actions and the ones about to start.
+        """
+        with self.lock:
+            self.stopping = True
+            actions = list(self.actions)
+        for action in actions:
+            action.cancel()
+
+    def server_close(self):
+        """
+        Stop listening, cancel the queued and running jobs, and wait for
+        the running ones to kill their processes, at most stop_timeout.
+        """
+        socketserver.UnixStreamServer.server_close(self)
+        self.scheduler.shutdown(wait=False)
+        self.cancel_actions()
+        self.scheduler.shutdown(timeout=self.stop_timeout)
+        with self.lock:
+            if self.actions:
+                self.log.warning("%d jobs did not exit in time", len(self.actions))
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def submit_job(settings, socket_path=None, callback=None):
+    """
+    Run a job on toolbox2d and return its result. ServerException is raised
+    if the job fails, OSError if the server cannot be reached. Relative
+    resource paths are resolved against the current directory first.
+
+    :param callback: called with every event received from the server
+    :type callback: callable(dict)
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path or get_socket_path())
+        sock.sendall(_encode(get_absolute_settings(settings)))
+        with sock.makefile("rb") as fp:
+            for line in fp:
+                event = json.loads(line.decode())
+                if callable(callback):
+                    callback(event)
+                if event["event"] == "done":
+                    return event["result"]
+                if event["event"] == "error":
+                    raise ServerException(event["error"])
+    finally:
+        sock.close()
+    raise ServerException("toolbox2d closed the connection")
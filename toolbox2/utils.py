@@ -32,3 +32,25 @@ def is_option_available(tool, option, regex=False):
     else:
         logger.info("Tool %s does not support option %s", tool, option)
     return success
+
+
+def parse_cpu_list(cpu_list):
+    """Return the set of CPUs described by a list such as "0-3,8,10-11"
+
+    :param cpu_list: comma separated CPU ids or ranges, or an iterable of ids
+    :type cpu_list: string
+
+    :return cpus
+    :rtype set
+    """
+    if not isinstance(cpu_list, str):
+        return set(int(cpu) for cpu in cpu_list)
+
+    cpus = set()
+    for item in cpu_list.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
@@ -1,7 +1,9 @@
-from toolbox2.command import Command
-from toolbox2.command import COMMAND_DEFAULT_KILL_TIMEOUT
+from toolbox2.command import Command, AsyncCommand, RingBuffer
+from toolbox2.command import COMMAND_DEFAULT_KILL_TIMEOUT, COMMAND_DEFAULT_SPAWN_METHOD
 from toolbox2.exception import Toolbox2Exception
 
+WORKER_DEFAULT_TAIL_SIZE = 64 * 1024
+
 
 class WorkerException(Toolbox2Exception):
     pass
@@ -37,6 +39,7 @@ class Worker(object):
         self.command = None
         self.tool = None
         self.is_running = False
+        self.returncode = None
         self.input_files = []
         self.output_files = []
 
@@ -45,11 +48,67 @@ class Worker(object):
         self.progress = 0
         self.memory_limit = 0
         self.kill_timeout = COMMAND_DEFAULT_KILL_TIMEOUT
-
+        self.spawn_method = COMMAND_DEFAULT_SPAWN_METHOD
+        self.cpu_affinity = None
+        self.nice = None
+        self.ionice_class = None
+        self.ionice_level = 0
+        self.sched_idle = False
+        self.process_group = False
+        # Set by pause(), the command of a paused worker is stopped as soon
+        # as it is started
+        self.paused = False
+        # Workers this one must wait for, None meaning all the previous
+        # workers of the action
+        self.dependencies = None
+        # Workers sharing a pipeline identifier are connected by named pipes
+        # and run concurrently, see Action.add_pipeline
+        self.pipeline = None
+
+        # Set keep_stdout/keep_stderr to False to avoid retaining the whole
+        # output of long running tools, the end of stderr is always kept
+        # in stderr_tail for error reporting.
+        self.keep_stdout = True
+        self.keep_stderr = True
+        self.stderr_tail = RingBuffer(WORKER_DEFAULT_TAIL_SIZE)
         self.stdout = ""
         self.stderr = ""
         self.error_lines = 1
 
+    @staticmethod
+    def _join_output(chunks):
+        if len(chunks) > 1:
+            chunks[:] = ["".join(chunks)]
+        return chunks[0] if chunks else ""
+
+    @property
+    def stdout(self):
+        """Standard output of the command, empty unless keep_stdout is set"""
+        return self._join_output(self._stdout)
+
+    @stdout.setter
+    def stdout(self, value):
+        self._stdout = [value] if value else []
+
+    @property
+    def stderr(self):
+        """Standard error of the command, empty unless keep_stderr is set"""
+        return self._join_output(self._stderr)
+
+    @stderr.setter
+    def stderr(self, value):
+        self._stderr = [value] if value else []
+
+    @property
+    def usage(self):
+        """
+        Resource usage of the command once its process has exited, see
+        toolbox2.command.get_usage.
+        """
+        if self.command is None:
+            return {}
+        return self.command.usage
+
     def add_input_file(self, path, params=None):
         """
         Add an input file with associated parameters.
@@ -78,8 +137,12 @@ class Worker(object):
         """
         Store stdout and stderr from command line.
         """
-        self.stdout += stdout
-        self.stderr += stderr
+        if stdout and self.keep_stdout:
+            self._stdout.append(stdout)
+        if stderr:
+            self.stderr_tail.write(stderr)
+            if self.keep_stderr:
+                self._stderr.append(stderr)
 
     def get_args(self):
         """
@@ -106,7 +169,7 @@ class Worker(object):
         Return the last lines from stderr. The number of lines returned
         could be configured with Worker.error_lines attribute.
         """
-        lines = self.stderr.split("\n")
+        lines = self.stderr_tail.getvalue().split("\n")
         lines.reverse()
 
         i = 0
@@ -135,24 +198,61 @@ class Worker(object):
         """
         pass
 
-    def run(self, base_dir):
+    def _prepare(self, base_dir, command_class):
         """
-        Compute and launch command line.
+        Setup the worker, create its command and return the command line.
         """
         self._setup(base_dir)
+        self.returncode = None
 
         args = self.get_process_args()
         args = [str(arg) for arg in args]
         cmd = " ".join(args)
         self.log.info("Running command: %s", cmd)
 
-        self.command = Command(base_dir)
+        self.command = command_class(base_dir)
         self.command.memory_limit = self.memory_limit
         self.command.kill_timeout = self.kill_timeout
+        self.command.spawn_method = self.spawn_method
+        self.command.cpu_affinity = self.cpu_affinity
+        self.command.nice = self.nice
+        self.command.ionice_class = self.ionice_class
+        self.command.ionice_level = self.ionice_level
+        self.command.sched_idle = self.sched_idle
+        self.command.process_group = self.process_group
+        # Read once the command is set, pause() may be called concurrently
+        if self.paused:
+            self.command.pause()
+        return args
+
+    def run(self, base_dir):
+        """
+        Compute and launch command line.
+        """
+        args = self._prepare(base_dir, Command)
         self.command.run(args)
 
         self.is_running = True
 
+    async def run_async(self, base_dir):
+        """
+        Coroutine counterpart of run() followed by wait(), the process being
+        driven by the running event loop. If an error occurs raise a
+        WorkerException, otherwise returns 0
+        """
+        args = self._prepare(base_dir, AsyncCommand)
+        await self.command.run(args)
+        self.is_running = True
+
+        ret = await self.command.wait(self._handle_output)
+        self.returncode = ret
+        self.is_running = False
+        if ret != 0:
+            error = self.get_error()
+            raise WorkerException(error)
+        self._finalize()
+        return ret
+
     def wait(self):
         """
         Wait running process. If an error occurs raise a WorkerException,
@@ -165,10 +265,53 @@ class Worker(object):
         self._finalize()
         return ret
 
+    def supervise(self, supervisor, callback=None):
+        """
+        Hand the running command over to a supervisor instead of waiting
+        on it from the current thread. Output is dispatched to _handle_output
+        and the worker is finalized once its process has exited successfully.
+        Exceptions raised by _finalize are propagated by supervisor.poll().
+
+        :param supervisor: supervisor driving this worker
+        :type supervisor: toolbox2.command.CommandSupervisor
+
+        :param callback: called with the worker once its process has exited
+        :type callback: callable(worker)
+        """
+
+        def exit_callback(returncode):
+            self.returncode = returncode
+            self.is_running = False
+            if returncode == 0:
+                self._finalize()
+            if callable(callback):
+                callback(self)
+
+        supervisor.register(self.command, self._handle_output, exit_callback)
+
     def cancel(self):
         """Cancel a running command"""
         self.command.cancel()
 
+    def pause(self):
+        """Suspend the running command, or the next one, see Command.pause"""
+        self.paused = True
+        command = self.command
+        if command is not None:
+            command.pause()
+
+    def resume(self):
+        """Continue the command suspended by pause()"""
+        self.paused = False
+        command = self.command
+        if command is not None:
+            command.resume()
+
+    def wakeup(self):
+        """Make a pending wait on the running command return immediately"""
+        if self.command is not None:
+            self.command.wakeup()
+
     def wait_noloop(self):
         """
         Wait (non-blocking) running process and return its exit code.
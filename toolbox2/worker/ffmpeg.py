@@ -12,6 +12,9 @@ from toolbox2.utils import is_option_available
 from toolbox2.worker import Worker, WorkerException
 
 
+# Muxers seeking back to rewrite their header once done
+FIFO_UNSUPPORTED_EXTENSIONS = [".wav"]
+
 codec_extension_map = {
     # Video
     "mpegvideo": ".m1v",
@@ -31,14 +34,56 @@ class FFmpegWorkerException(WorkerException):
     pass
 
 
+def _parse_progress_value(value, default=0):
+    """
+    Return a number from a -progress value such as "1.5x", "2400.1kbits/s"
+    or "N/A", default if there is none.
+    """
+    if value is None:
+        return default
+    match = re.match(r"\s*(-?[\d.]+)", value)
+    if not match:
+        return default
+    try:
+        return float(match.group(1))
+    except ValueError:
+        return default
+
+
+def _parse_progress_time(values):
+    """
+    Return the output time of a -progress report in seconds, None if there
+    is none. ffmpeg < 4.2 does not report out_time_us, only out_time_ms,
+    which is in microseconds too, and out_time.
+    """
+    for key in ["out_time_us", "out_time_ms"]:
+        microseconds = _parse_progress_value(values.get(key), None)
+        if microseconds is not None:
+            return microseconds / 1000000.0
+    match = re.match(r"\s*(-?)(\d+):(\d+):([\d.]+)", values.get("out_time") or "")
+    if not match:
+        return None
+    sign, hours, minutes, seconds = match.groups()
+    try:
+        seconds = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+    return -seconds if sign else seconds
+
+
 class FFmpegWorker(Worker):
     class InputFile(Worker.InputFile):
         def __init__(self, path, params=None, avinfo=None):
             Worker.InputFile.__init__(self, path, params)
             self.avinfo = avinfo
+            # Options applied to this input only, such as seeking
+            self.input_opts = (params or {}).get("input_opts", [])
 
         def get_args(self):
-            return ["-i", self.path]
+            args = []
+            for option in self.input_opts:
+                args += list(option)
+            return args + ["-i", self.path]
 
     class OutputFile(Worker.OutputFile):
         def __init__(self, path, params=None, output_type="mixed"):
@@ -71,6 +116,21 @@ class FFmpegWorker(Worker):
         Worker.__init__(self, log, params)
         self.nb_frames = 0
         self.tool = "ffmpeg"
+        # Statistics are printed on stderr for the whole transcode, and
+        # progress reports on stdout
+        self.keep_stdout = False
+        self.keep_stderr = False
+        # Parse the key=value reports of -progress
+        self.report_progress = True
+        self._progress_line = ""
+        self._progress_values = {}
+        self.frame = 0
+        self.out_time = 0
+        self.speed = 0
+        self.bitrate = 0
+        self.total_size = 0
+        self.dup_frames = 0
+        self.drop_frames = 0
         self.video_opts = self.params.get("video_opts", [])
         self.audio_opts = self.params.get("audio_opts", [])
         self.format_opts = self.params.get("format_opts", [])
@@ -85,21 +145,75 @@ class FFmpegWorker(Worker):
         self.fps = 0
         self.special_audio_filter = None
         self.special_audio_mapping = None
+        self.special_video_filter = None
         self.single_frame = False
         self.seek = 0
 
     def _handle_output(self, stdout, stderr):
         Worker._handle_output(self, stdout, stderr)
+        if not self.report_progress:
+            return
+
+        # Reports are blocks of key=value lines ending with progress=...
+        lines = (self._progress_line + stdout).split("\n")
+        self._progress_line = lines.pop()
+        for line in lines:
+            key, sep, value = line.strip().partition("=")
+            if not sep:
+                continue
+            if key == "progress":
+                self._update_progress(self._progress_values)
+                self._progress_values = {}
+            else:
+                self._progress_values[key] = value
+
+    def _update_progress(self, values):
+        """
+        Update progress and statistics from a -progress report.
+        """
+        self.frame = int(_parse_progress_value(values.get("frame"), self.frame))
+        self.fps = _parse_progress_value(values.get("fps"), self.fps)
+        self.bitrate = _parse_progress_value(values.get("bitrate"), self.bitrate)
+        self.total_size = int(
+            _parse_progress_value(values.get("total_size"), self.total_size)
+        )
+        self.dup_frames = int(
+            _parse_progress_value(values.get("dup_frames"), self.dup_frames)
+        )
+        self.drop_frames = int(
+            _parse_progress_value(values.get("drop_frames"), self.drop_frames)
+        )
+        self.speed = _parse_progress_value(values.get("speed"), self.speed)
+        out_time = _parse_progress_time(values)
+        if out_time is not None:
+            self.out_time = out_time
+
+        duration = self._get_input_duration() - self.seek
+        if duration > 0:
+            progress = self.out_time / duration * 100
+            if self.speed > 0:
+                self.timeleft = max(duration - self.out_time, 0) / self.speed
+        elif self.nb_frames > 0:
+            progress = float(self.frame) / self.nb_frames * 100
+        else:
+            return
+        self.progress = min(progress, 99)
 
-        res = re.findall(r"frame=\s*(\d+)", stderr)
-        if len(res) > 0 and self.nb_frames > 0:
-            frame = float(res[-1])
-            self.progress = (frame / self.nb_frames) * 100
-            if self.progress > 99:
-                self.progress = 99
-        res = re.findall(r"fps=\s*(\d+)", stderr)
-        if res:
-            self.fps = int(res[-1])
+    def _get_input_duration(self):
+        """
+        Return the duration of the first input file in seconds, from its
+        frame count when known, from the probed duration otherwise, 0 if
+        it is unknown.
+        """
+        avinfo = self.input_files[0].avinfo if self.input_files else None
+        if not avinfo:
+            return 0
+        if self.nb_frames and avinfo.video_fps:
+            return self.nb_frames / float(avinfo.video_fps)
+        try:
+            return float(avinfo.format.get("duration", 0))
+        except ValueError:
+            return 0
 
     def add_input_file(self, path, params=None, avinfo=None):
         self.input_files.append(self.InputFile(path, params, avinfo))
@@ -130,6 +244,8 @@ class FFmpegWorker(Worker):
 
     def get_args(self):
         args = ["-y"]
+        if self.report_progress:
+            args += ["-nostats", "-progress", "pipe:1"]
 
         for input_file in self.input_files:
             if self.decoding_threads:
@@ -143,6 +259,10 @@ class FFmpegWorker(Worker):
             args += ["-vf"]
             args += [",".join([flt[1] for flt in self.video_filter_chain])]
 
+        if self.special_video_filter:
+            args += ["-filter_complex"]
+            args += [self.special_video_filter]
+
         if self.special_audio_filter:
             args += ["-filter_complex"]
             args += [self.special_audio_filter]
@@ -294,9 +414,10 @@ class FFmpegWorker(Worker):
                 )
                 map_chain.append(("-map", "[m%s]" % (index)))
 
-        if self.audio_min_streams and not self.nb_frames:
+        duration = round(self._get_input_duration(), 2)
+        if self.audio_min_streams and not duration:
             raise FFmpegWorkerException(
-                "audio_min_streams option requires input file nb frames to be computed"
+                "audio_min_streams option requires input file duration to be known"
             )
         else:
             if not self.audio_min_streams:
@@ -315,8 +436,6 @@ class FFmpegWorker(Worker):
             if not i_channels_per_stream:
                 i_channels_per_stream = 2
 
-            duration = round(self.nb_frames / avinfo.video_fps, 2)
-
             for index in range(empty_streams):
                 filter_chain += "aevalsrc=%s:n=480:s=48000:d=%s[null%s];" % (
                     "0:" * i_channels_per_stream,
@@ -328,6 +447,8 @@ class FFmpegWorker(Worker):
         return filter_chain.rstrip(";"), map_chain
 
     def make_fullhelp(self):
+        self.report_progress = False
+        self.keep_stdout = True
         self.format_opts += [("-h", "full")]
 
     def make_thumbnail(self, options=None):
@@ -362,6 +483,73 @@ class FFmpegWorker(Worker):
         else:
             self.video_filter_chain += [("thumbnail", "thumbnail=%d" % frames_batch)]
 
+    def make_thumbnails(self, basedir, times, options=None):
+        """
+        Extract a still at each of the given times, and optionally a sprite
+        sheet tiling all of them, in a single ffmpeg process. The file is
+        opened once per still, seeking to the keyframe preceding its time,
+        and only keyframes are decoded.
+
+        :param times: positions of the stills, in seconds
+        :type times: list
+
+        :param options: width of the stills (0 to keep the input size),
+                        sprite to also write a sprite sheet, and
+                        sprite_columns
+        :type options: dict
+
+        :return: paths of the stills and of the sprite sheet, or None
+        :rtype: tuple
+        """
+        options = options or {}
+        width = options.get("width", 0)
+        columns = options.get("sprite_columns") or min(len(times), 5)
+        path = self.input_files[0].path
+        avinfo = self.input_files[0].avinfo
+        self.input_files = []
+
+        scale = ",scale=%s:-2" % width if width else ""
+        filters = []
+        thumbnails = []
+        for index, position in enumerate(times):
+            input_opts = [("-skip_frame", "nokey"), ("-noaccurate_seek",)]
+            if position > 0:
+                input_opts.append(("-ss", "%.3f" % position))
+            self.add_input_file(path, {"input_opts": input_opts}, avinfo)
+
+            # A single frame is taken from every input so that it is not
+            # read any further
+            chain = "[%d:v:0]trim=end_frame=1,setpts=PTS-STARTPTS%s" % (index, scale)
+            if options.get("sprite"):
+                chain += ",split=2[t%d][s%d]" % (index, index)
+            else:
+                chain += "[t%d]" % index
+            filters.append(chain)
+
+            thumbnail = os.path.join(basedir, "thumbnail_%03d.jpg" % index)
+            params = {"single_frame": True, "video_opts": [("-map", "[t%d]" % index)]}
+            self.add_output_file(thumbnail, params, "video")
+            thumbnails.append(thumbnail)
+
+        sprite = None
+        if options.get("sprite"):
+            rows = int(math.ceil(len(times) / float(columns)))
+            filters.append(
+                "%sconcat=n=%d:v=1:a=0,tile=%dx%d[sprite]"
+                % (
+                    "".join("[s%d]" % index for index in range(len(times))),
+                    len(times),
+                    columns,
+                    rows,
+                )
+            )
+            sprite = os.path.join(basedir, "sprite.jpg")
+            params = {"single_frame": True, "video_opts": [("-map", "[sprite]")]}
+            self.add_output_file(sprite, params, "video")
+
+        self.special_video_filter = ";".join(filters)
+        return thumbnails, sprite
+
     def get_opt(self, opt_name, opt_default=None):
         for opts in [self.video_opts, self.audio_opts, self.format_opts]:
             for opt in opts:
@@ -375,7 +563,14 @@ class FFmpegWorker(Worker):
             return opt[1]
         return opt_default
 
-    def demux(self, basedir):
+    def demux(self, basedir, fifo=False):
+        """
+        Write every elementary stream of the input to its own file in basedir.
+
+        :param fifo: create the output files as named pipes, for a muxer
+                     reading them while ffmpeg is running
+        :type fifo: bool
+        """
         basename = os.path.splitext(os.path.basename(self.input_files[0].path))[0]
         avinfo = self._get_input_avinfo()
 
@@ -420,6 +615,18 @@ class FFmpegWorker(Worker):
             self.add_output_file(path, {"audio_opts": opts}, "audio")
             index += 1
 
+        if fifo:
+            for output_file in self.output_files:
+                extension = os.path.splitext(output_file.path)[1]
+                if extension in FIFO_UNSUPPORTED_EXTENSIONS:
+                    raise FFmpegWorkerException(
+                        "%s files cannot be written to named pipes" % extension
+                    )
+            for output_file in self.output_files:
+                if os.path.lexists(output_file.path):
+                    os.unlink(output_file.path)
+                os.mkfifo(output_file.path)
+
         # Clean global audio/video options
         self.video_opts = []
         self.audio_opts = []
@@ -1,13 +1,131 @@
 import re
 import json
+import array
 
 from toolbox2.worker import Worker, WorkerException
 
+# Value of missing timestamps, like AV_NOPTS_VALUE
+NOPTS_VALUE = -(2**63)
+
+# Packet flags, from the "flags" entry of packets ("K_", "KD_"...)
+PACKET_FLAG_KEY = 1
+PACKET_FLAG_DISCARD = 2
+PACKET_FLAG_CORRUPT = 4
+PACKET_FLAGS = {
+    "K": PACKET_FLAG_KEY,
+    "D": PACKET_FLAG_DISCARD,
+    "C": PACKET_FLAG_CORRUPT,
+}
+
+# ffprobe entries read for each column of a ProbeTable
+PROBE_TABLE_ENTRIES = {
+    "packet": {
+        "stream_index": "stream_index",
+        "pts": "pts",
+        "dts": "dts",
+        "size": "size",
+        "pos": "pos",
+        "flags": "flags",
+    },
+    "frame": {
+        "stream_index": "stream_index",
+        "pts": "pts",
+        "pkt_dts": "dts",
+        "pkt_size": "size",
+        "pkt_pos": "pos",
+        "key_frame": "flags",
+    },
+}
+
 
 class FFprobeWorkerException(WorkerException):
     pass
 
 
+class ProbeTable(object):
+    """
+    Packets or frames of a media file stored by column, one typed array
+    per column, so that millions of them fit in a few bytes each.
+    Missing timestamps are set to NOPTS_VALUE, missing positions to -1.
+    """
+
+    COLUMNS = [
+        ("stream_index", "i"),
+        ("pts", "q"),
+        ("dts", "q"),
+        ("size", "q"),
+        ("pos", "q"),
+        ("flags", "B"),
+    ]
+
+    def __init__(self, section="packet"):
+        """
+        :param section: ffprobe section to read: packet or frame
+        :type section: string
+        """
+        if section not in PROBE_TABLE_ENTRIES:
+            raise FFprobeWorkerException("Unsupported probe table: %s" % section)
+        self.section = section
+        self.entries = PROBE_TABLE_ENTRIES[section]
+        self.columns = dict(
+            (name, array.array(typecode)) for name, typecode in self.COLUMNS
+        )
+        self._line = ""
+
+    def __len__(self):
+        return len(self.columns["stream_index"])
+
+    def feed(self, data):
+        """
+        Parse compact ffprobe output (-print_format compact=p=0:nk=0), which
+        may be split anywhere.
+        """
+        lines = (self._line + data).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            if line:
+                self._append(line)
+
+    def close(self):
+        """
+        Parse the last line if it had no end of line.
+        """
+        if self._line:
+            self._append(self._line)
+            self._line = ""
+
+    def _append(self, line):
+        row = {"stream_index": 0, "pts": NOPTS_VALUE, "dts": NOPTS_VALUE, "size": 0}
+        row.update({"pos": -1, "flags": 0})
+        for field in line.split("|"):
+            key, _, value = field.partition("=")
+            column = self.entries.get(key)
+            if column is None:
+                continue
+            if key == "flags":
+                row["flags"] = sum(PACKET_FLAGS.get(flag, 0) for flag in value)
+            elif key == "key_frame":
+                row["flags"] = PACKET_FLAG_KEY if value == "1" else 0
+            elif value.lstrip("-").isdigit():
+                row[column] = int(value)
+        for name, _ in self.COLUMNS:
+            self.columns[name].append(row[name])
+
+    def to_numpy(self):
+        """
+        Return the columns as NumPy arrays sharing the memory of this table.
+        NumPy is only needed by this method.
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise FFprobeWorkerException("NumPy is required to convert probe tables")
+        return dict(
+            (name, numpy.frombuffer(column, dtype=column.typecode))
+            for name, column in self.columns.items()
+        )
+
+
 class FFprobeWorker(Worker):
     """
     FFprobe worker.
@@ -17,6 +135,7 @@ class FFprobeWorker(Worker):
         Worker.__init__(self, log, params)
         self.tool = "ffprobe"
         self.metadata = {}
+        self.table = None
         self.params.update(
             {
                 "-print_format": "json",
@@ -37,6 +156,13 @@ class FFprobeWorker(Worker):
             }
         )
 
+    def select_streams(self, stream_specifier):
+        self.params.update(
+            {
+                "-select_streams": stream_specifier,
+            }
+        )
+
     def count_packets(self):
         self.params.update(
             {
@@ -44,6 +170,31 @@ class FFprobeWorker(Worker):
             }
         )
 
+    def dump_table(self, section="packet"):
+        """
+        Read every packet or frame of the input into self.table, a
+        ProbeTable, as the output of ffprobe arrives instead of decoding a
+        whole JSON document once ffprobe is done.
+
+        :param section: packet or frame
+        :type section: string
+        """
+        self.table = ProbeTable(section)
+        self.keep_stdout = False
+        for key in ["-print_format", "-show_format", "-show_streams"]:
+            self.params.pop(key, None)
+        self.params.update(
+            {
+                "-show_entries": "%s=%s" % (section, ",".join(self.table.entries)),
+                "-print_format": "compact=p=0:nk=0",
+            }
+        )
+
+    def _handle_output(self, stdout, stderr):
+        Worker._handle_output(self, stdout, stderr)
+        if self.table is not None and stdout:
+            self.table.feed(stdout)
+
     def get_args(self):
         args = Worker.get_args(self)
 
@@ -53,6 +204,8 @@ class FFprobeWorker(Worker):
         return args
 
     def _finalize(self):
+        if self.table is not None:
+            self.table.close()
         nb_audio_streams = 0
         nb_video_streams = 0
         if self.params.get("-print_format") == "json":
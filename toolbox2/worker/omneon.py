@@ -32,6 +32,8 @@ class OmneonCopyWorker(Worker):
         Worker.__init__(self, log, params)
         self.tool = "ommcp"
         self.base_dir = "/"
+        # Progress is printed on stdout for the whole copy
+        self.keep_stdout = False
 
     def _handle_output(self, stdout, stderr):
         Worker._handle_output(self, stdout, stderr)